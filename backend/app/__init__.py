@@ -1,4 +1,4 @@
-from flask import Flask, send_from_directory, jsonify
+from flask import Flask, jsonify
 from pymongo import MongoClient
 from flask_jwt_extended import JWTManager
 from flask_caching import Cache
@@ -89,9 +89,12 @@ def create_app():
     from app.routes.marketplace_routes import marketplace_bp
     from app.routes.message_routes import message_bp
     from app.routes.announcement_routes import announcement_bp
+    from app.routes.carpool_routes import carpool_bp
     from app.controllers.admin_rides import admin_rides_bp
     from app.controllers.admin_lost_found import admin_lost_found_bp
     from app.controllers.admin_marketplace import admin_marketplace_bp
+    from app.controllers.uploads import uploads_bp
+    from app.utils.upload_serving import serve_upload
     
     app.register_blueprint(auth_bp, url_prefix='/api/auth')
     app.register_blueprint(marketplace_bp, url_prefix='/api/marketplace')
@@ -101,22 +104,24 @@ def create_app():
     app.register_blueprint(users_bp, url_prefix='/api/users')
     app.register_blueprint(notification_bp, url_prefix='/api/notifications')
     app.register_blueprint(message_bp, url_prefix='/api/messages')
+    app.register_blueprint(carpool_bp, url_prefix='/api/carpool')
     # Register announcement blueprint with two different prefixes for admin and public routes
     app.register_blueprint(announcement_bp)
     app.register_blueprint(admin_rides_bp, url_prefix='/api/admin')
     app.register_blueprint(admin_lost_found_bp, url_prefix='/api/admin')
     app.register_blueprint(admin_marketplace_bp, url_prefix='/api/admin')
+    app.register_blueprint(uploads_bp, url_prefix='/api/uploads')
     
-    # Serve uploaded files with caching
+    # Serve uploaded files with caching; ?w=&h=&fmt= serves a resized copy
     @app.route('/uploads/<path:filename>')
     def uploaded_file(filename):
-        uploads_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'uploads')
-        return send_from_directory(uploads_dir, filename)
+        return serve_upload(filename)
     
     # Add cache headers
     @app.after_request
     def add_cache_headers(response):
-        response.headers['Cache-Control'] = 'public, max-age=300'  # Cache for 5 minutes by default
+        # Cache for 5 minutes by default, unless the route set its own policy
+        response.headers.setdefault('Cache-Control', 'public, max-age=300')
         return response
     
     # Add basic error handlers
@@ -1,6 +1,8 @@
 from flask import Blueprint, request, jsonify, current_app
 from pymongo import MongoClient
 from ..models.user import User
+from ..models.ride_repository import RideRepository
+from ..utils.lost_found_matcher import lost_found_matcher
 import os
 import jwt
 from functools import wraps
@@ -311,9 +313,10 @@ def get_statistics():
         found_items = db.lost_found_items.count_documents({'item_type': 'found'})
 
         # Share ride statistics
-        total_share_rides = db.share_rides.count_documents({})
-        active_share_rides = db.share_rides.count_documents({'status': 'active'})
-        inactive_share_rides = db.share_rides.count_documents({'status': {'$ne': 'active'}})
+        rides = RideRepository(db)
+        total_share_rides = rides.count()
+        active_share_rides = rides.count({'status': 'active'})
+        inactive_share_rides = total_share_rides - active_share_rides
 
         # Get recent activities
         recent_bookings = list(db.bookings.find().sort('created_at', -1).limit(5))
@@ -525,6 +528,7 @@ def update_lost_found_item(item_id):
             {'_id': ObjectId(item_id)},
             {'$set': update_data}
         )
+        lost_found_matcher.update(db, dict(item, **update_data))
         
         # Clear all related caches
         cache.delete('view/api/lost-found/items')
@@ -551,6 +555,7 @@ def delete_lost_found_item(item_id):
         
         # Delete item
         db.lost_found_items.delete_one({'_id': ObjectId(item_id)})
+        lost_found_matcher.remove(db, item_id)
         
         # Clear all related caches
         cache.delete('view/api/lost-found/items')
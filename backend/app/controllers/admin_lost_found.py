@@ -3,7 +3,10 @@ from flask_jwt_extended import jwt_required, get_jwt_identity
 from app.controllers.admin import admin_required
 from pymongo import MongoClient
 from bson import ObjectId
+from bson.errors import InvalidId
 from app.db import get_db
+from app.utils.lost_found_matcher import lost_found_matcher
+from app.models.lost_found_claim import LostFoundClaim, ITEM_STATUSES, serialize_claim
 import datetime
 
 admin_lost_found_bp = Blueprint('admin_lost_found', __name__)
@@ -115,6 +118,8 @@ def delete_item(item_id):
         
         if result.deleted_count == 0:
             return jsonify({'error': 'Item not found'}), 404
+        lost_found_matcher.remove(db, item_id)
+        LostFoundClaim.close_item(db, ObjectId(item_id))
             
         return jsonify({'message': 'Item deleted successfully'}), 200
     except Exception as e:
@@ -146,26 +151,37 @@ def update_item(item_id):
             "updated_at": datetime.datetime.utcnow()
         }
         
-        # Optional fields
+        # Optional fields; claimed, verified and returned are set through the item's claims,
+        # except on items marked so before claims existed (they have no claim_id)
+        item_query = {"_id": ObjectId(item_id)}
         if 'status' in data:
-            update_data['status'] = data['status']
+            item = db.lost_found_items.find_one(item_query, {'status': 1, 'claim_id': 1})
+            current = item.get('status') if item else None
+            if data['status'] != current:
+                if data['status'] in ITEM_STATUSES or (item and item.get('claim_id')):
+                    return jsonify({"error": "The status of a claimed item changes through its claims"}), 400
+                update_data['status'] = data['status']
+                item_query['claim_id'] = {'$exists': False}
             
         if 'contact_info' in data:
             update_data['contact_info'] = data['contact_info']
         
         # Update the item
-        result = db.lost_found_items.update_one(
-            {"_id": ObjectId(item_id)},
-            {"$set": update_data}
-        )
+        result = db.lost_found_items.update_one(item_query, {"$set": update_data})
         
         if result.matched_count == 0:
+            if 'claim_id' in item_query and db.lost_found_items.count_documents({"_id": item_query["_id"]}):
+                return jsonify({"error": "The status of a claimed item changes through its claims"}), 409
             return jsonify({"error": "Item not found"}), 404
+        if update_data.get('status') == 'open':
+            # Claims queued while the item was closed get their turn
+            LostFoundClaim.advance(db, item_query["_id"])
             
         if result.modified_count > 0:
             # Get the updated item
             updated_item = db.lost_found_items.find_one({"_id": ObjectId(item_id)})
             if updated_item:
+                lost_found_matcher.update(db, updated_item)
                 updated_item['_id'] = str(updated_item['_id'])
                 if 'user_id' in updated_item:
                     updated_item['user_id'] = str(updated_item['user_id'])
@@ -178,3 +194,30 @@ def update_item(item_id):
         return jsonify({"message": "No changes made"}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
+
+@admin_lost_found_bp.route('/lost-found/claims', methods=['GET'])
+@jwt_required()
+@admin_required
+def get_claim_history():
+    """
+    Claim history, newest first, with the next page's cursor in X-Next-Cursor
+
+    Query parameters: status, item_id, claimant_id, limit and cursor.
+    """
+    try:
+        claims, next_cursor = LostFoundClaim.history(
+            get_db(),
+            status=request.args.get('status'),
+            item_id=request.args.get('item_id'),
+            claimant_id=request.args.get('claimant_id'),
+            limit=request.args.get('limit', type=int),
+            cursor=request.args.get('cursor')
+        )
+    except (ValueError, InvalidId):
+        return jsonify({'error': 'Invalid cursor or id'}), 400
+    
+    response = jsonify([serialize_claim(claim) for claim in claims])
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
@@ -4,7 +4,7 @@ from .. import limiter, cache
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from app.controllers.admin import admin_required
 from app.db import get_db
-import os
+from app.utils.upload_refs import release_uploads
 import datetime
 
 admin_marketplace_bp = Blueprint('admin_marketplace', __name__)
@@ -75,18 +75,12 @@ def admin_delete_item(item_id):
         if not item:
             return jsonify({'error': 'Item not found'}), 404
         
-        # Delete images if they exist
-        if 'images' in item:
-            for image_url in item['images']:
-                try:
-                    image_path = os.path.join(current_app.config.get('UPLOAD_FOLDER', '../uploads'), image_url.lstrip('/uploads/'))
-                    if os.path.exists(image_path):
-                        os.remove(image_path)
-                except Exception as e:
-                    current_app.logger.error(f"Error deleting image {image_url}: {str(e)}")
-        
-        # Delete item from database
-        db.marketplace_items.delete_one({'_id': ObjectId(item_id)})
+        # Delete item from database, then release its images
+        db.marketplace_items.delete_one({'_id': item['_id']})
+        try:
+            release_uploads(item.get('images'), db)
+        except Exception as e:
+            current_app.logger.error(f"Error releasing images of item {item_id}: {str(e)}")
         
         # Clear all related caches
         cache.delete('view/api/marketplace/items')
@@ -4,6 +4,7 @@ from app.controllers.admin import admin_required
 from pymongo import MongoClient
 from bson import ObjectId
 from app.db import get_db
+from app.models.ride_repository import RideRepository
 import datetime
 
 admin_rides_bp = Blueprint('admin_rides', __name__)
@@ -15,7 +16,7 @@ def get_all_rides():
     """Get all ride share posts for admin"""
     try:
         db = get_db()
-        rides = list(db.share_rides.find())
+        rides = RideRepository(db).find()
         
         # Process ride data and add user information
         for ride in rides:
@@ -46,15 +47,14 @@ def get_all_rides():
 def delete_ride(ride_id):
     """Delete a ride share post (admin only)"""
     try:
-        db = get_db()
         # Safely handle ObjectId conversion
         try:
-            result = db.share_rides.delete_one({'_id': ObjectId(ride_id)})
+            ride = RideRepository(get_db()).delete(ride_id)
         except:
             # If ride_id is not a valid ObjectId, return an error
             return jsonify({'error': 'Invalid ride ID format'}), 400
         
-        if result.deleted_count == 0:
+        if not ride:
             return jsonify({'error': 'Ride not found'}), 404
             
         return jsonify({'message': 'Ride deleted successfully'}), 200
@@ -1,11 +1,10 @@
 from flask import Blueprint, request, jsonify, current_app, url_for, render_template_string
 from pymongo import MongoClient
 from ..models.user import User
+from ..utils.upload import save_image
 import os
 import jwt
-from werkzeug.utils import secure_filename
 from datetime import datetime, timedelta
-import uuid
 from flask_jwt_extended import create_access_token, get_jwt_identity, jwt_required, decode_token
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_limiter import Limiter
@@ -65,10 +64,7 @@ def get_current_user():
 # Secret key for JWT
 JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY', 'your-secret-key')
 
-# Upload folder for ID card photos
-UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'uploads')
-if not os.path.exists(UPLOAD_FOLDER):
-    os.makedirs(UPLOAD_FOLDER)
+# ID card photo formats
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
 
 # Email configuration
@@ -209,12 +205,10 @@ def register():
             return jsonify({'error': 'No ID card photo selected'}), 400
             
         if file and allowed_file(file.filename):
-            filename = secure_filename(file.filename)
-            # Use unique filename to avoid collisions
-            unique_filename = f"{uuid.uuid4()}_{filename}"
-            file_path = os.path.join(UPLOAD_FOLDER, unique_filename)
-            file.save(file_path)
-            id_card_url = f"/uploads/{unique_filename}"
+            try:
+                id_card_url = save_image(file, 'id_cards')
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
         else:
             return jsonify({'error': 'Invalid file format. Only PNG, JPG, JPEG are allowed'}), 400
         
@@ -1,92 +1,63 @@
-from flask import Blueprint, request, jsonify, current_app, send_from_directory
+from flask import Blueprint, request, jsonify, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from pymongo import MongoClient
 from bson import ObjectId
 import datetime
-import os
-import base64
-import uuid
 from werkzeug.utils import secure_filename
-from ..utils.upload import save_image
+from ..utils.upload import save_image, save_image_data, is_image_data
+from ..utils import upload_serving
+from ..utils.image_variants import queue_variants
+from ..utils.upload_refs import release_upload
+from ..utils.lost_found_matcher import lost_found_matcher
+from ..models.lost_found_item import LostFoundItem, creator_fields
+from ..models.lost_found_claim import LostFoundClaim, ITEM_STATUSES, serialize_claim
 from .. import cache, limiter
 
 lost_found_bp = Blueprint('lost_found', __name__)
 client = MongoClient('mongodb://localhost:27017/')
 db = client.bracu_circle
 
-# Configure upload folder for Lost & Found images
-UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'uploads', 'lost_found')
-if not os.path.exists(UPLOAD_FOLDER):
-    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-
 # Allowed file extensions
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-# Function to save base64 image
-def save_base64_image(base64_string, folder):
-    try:
-        # Extract the image data from the base64 string
-        if ',' in base64_string:
-            header, base64_data = base64_string.split(',', 1)
-        else:
-            base64_data = base64_string
-            
-        # Decode the base64 data
-        image_data = base64.b64decode(base64_data)
-        
-        # Generate a unique filename
-        filename = f"{uuid.uuid4().hex}.jpg"
-        
-        # Make sure the folder exists
-        upload_folder = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'uploads', 'lost_found')
-        os.makedirs(upload_folder, exist_ok=True)
-        
-        # Create the full path
-        file_path = os.path.join(upload_folder, filename)
-        
-        # Save the image
-        with open(file_path, 'wb') as f:
-            f.write(image_data)
-            
-        # Return the URL path for the image
-        return f"/uploads/lost_found/{filename}"
-    except Exception as e:
-        current_app.logger.error(f"Error saving base64 image: {str(e)}")
-        return None
-
 @lost_found_bp.route('/items', methods=['GET'])
 @limiter.limit("30 per minute")
 def get_items():
-    items = list(db.lost_found_items.find())
-    for item in items:
-        item['_id'] = str(item['_id'])
-        if 'user_id' in item:
-            user_id = item['user_id']
-            item['user_id'] = str(user_id)
-            
-            # Add creator information
-            try:
-                user = db.users.find_one({'_id': ObjectId(user_id)})
-                if user:
-                    item['creator_name'] = user.get('name', 'Anonymous')
-                    item['creator_email'] = user.get('email', 'No email provided')
-                else:
-                    item['creator_name'] = 'Anonymous'
-                    item['creator_email'] = 'No email provided'
-            except Exception as e:
-                current_app.logger.error(f"Error getting creator info: {str(e)}")
-                item['creator_name'] = 'Anonymous'
-                item['creator_email'] = 'No email provided'
+    """
+    Reports, newest first; when paged with limit or cursor, the next page's
+    cursor is in X-Next-Cursor
+
+    Query parameters: item_type, status, category, date_from, date_to
+    (inclusive, YYYY-MM-DD), limit and cursor.
+    """
+    try:
+        item_type = request.args.get('item_type')
+        if item_type and item_type not in ['lost', 'found']:
+            return jsonify({'error': 'Item type must be "lost" or "found"'}), 400
+        
+        items, next_cursor = LostFoundItem.list_page(
+            db,
+            item_type=item_type,
+            status=request.args.get('status'),
+            category=request.args.get('category'),
+            date_from=request.args.get('date_from'),
+            date_to=request.args.get('date_to'),
+            limit=request.args.get('limit', type=int),
+            cursor=request.args.get('cursor')
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
-    # Add cache control headers
     response = jsonify(items)
-    response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
-    response.headers['Pragma'] = 'no-cache'
-    response.headers['Expires'] = '0'
-    return response, 200
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    # Always revalidate, but let an unchanged page come back as a 304
+    response.headers['Cache-Control'] = 'no-cache'
+    response.add_etag()
+    return response.make_conditional(request)
 
 @lost_found_bp.route('/items', methods=['POST'])
 @jwt_required()
@@ -120,7 +91,8 @@ def create_item():
                 'updated_at': datetime.datetime.utcnow(),
                 'status': 'open',
                 'contact': data.get('contact', ''),
-                'phone': data.get('phone', '')
+                'phone': data.get('phone', ''),
+                **LostFoundItem.creator_snapshot(db, user_id)
             }
             
             if 'category' in data:
@@ -170,21 +142,24 @@ def create_item():
                 'updated_at': datetime.datetime.utcnow(),
                 'status': 'open',
                 'contact': data.get('contact', ''),
-                'phone': data.get('phone', '')
+                'phone': data.get('phone', ''),
+                **LostFoundItem.creator_snapshot(db, user_id)
             }
             
             if 'category' in data:
                 new_item['category'] = data['category']
             
-            # Handle base64 image upload
-            if 'image' in data and data['image'] and isinstance(data['image'], str) and data['image'].startswith('data:'):
+            # Handle base64 image upload, or the URL of a direct upload
+            if is_image_data(data.get('image')):
                 try:
                     # Save the base64 image
-                    image_url = save_base64_image(data['image'], 'lost_found')
+                    image_url = save_image_data(data['image'], 'lost_found')
                     if image_url:
                         # Store the image path in the database
                         new_item['image'] = image_url
                         current_app.logger.info(f"Image saved successfully: {image_url}")
+                except ValueError as e:
+                    return jsonify({'error': str(e)}), 400
                 except Exception as e:
                     current_app.logger.error(f"Error processing image: {str(e)}")
             
@@ -194,6 +169,15 @@ def create_item():
         return jsonify({'error': str(e)}), 500
     
     result = db.lost_found_items.insert_one(new_item)
+    new_item['_id'] = result.inserted_id
+    
+    # Score the report against open reports of the opposite type
+    try:
+        lost_found_matcher.add(db, new_item)
+        lost_found_matcher.hash_photo(db, new_item)
+        queue_variants(db, 'lost_found_items', new_item['_id'], 'image', new_item.get('image'))
+    except Exception as e:
+        current_app.logger.error(f"Error matching lost & found item: {str(e)}")
     
     # Clear all related caches
     cache.delete('view/api/lost-found/items')
@@ -219,19 +203,13 @@ def get_item(item_id):
             user_id = item['user_id']
             item['user_id'] = str(user_id)
             
-            # Add creator information
-            try:
-                user = db.users.find_one({'_id': user_id})
-                if user:
-                    item['creator_name'] = user.get('name', 'Anonymous')
-                    item['creator_email'] = user.get('email', 'No email provided')
-                else:
-                    item['creator_name'] = 'Anonymous'
-                    item['creator_email'] = 'No email provided'
-            except Exception as e:
-                current_app.logger.error(f"Error getting creator info: {str(e)}")
-                item['creator_name'] = 'Anonymous'
-                item['creator_email'] = 'No email provided'
+            # Reports carry their creator snapshot; older ones are looked up until backfilled
+            if 'creator_name' not in item:
+                try:
+                    item.update(creator_fields(db.users.find_one({'_id': user_id})))
+                except Exception as e:
+                    current_app.logger.error(f"Error getting creator info: {str(e)}")
+                    item.update(creator_fields(None))
         
         # Add cache control headers
         response = jsonify(item)
@@ -300,33 +278,61 @@ def update_item(item_id):
         for field in allowed_fields:
             if field in data:
                 update_data[field] = data[field]
+        
+        # Claimed, verified and returned are only set through the item's claims. Items
+        # marked claimed or returned before claims existed have no claim_id and can
+        # still be reopened or closed here.
+        if update_data.get('status') == item.get('status'):
+            update_data.pop('status')
+        elif 'status' in update_data and (update_data['status'] in ITEM_STATUSES or item.get('claim_id')):
+            return jsonify({'error': 'The status of a claimed item changes through its claims'}), 400
                 
         # Handle image update
-        if 'image' in data and data['image'] and data['image'].startswith('data:'):
+        if is_image_data(data.get('image')) and data['image'] != item.get('image'):
             try:
                 # Save the base64 image
-                image_filename = save_base64_image(data['image'], UPLOAD_FOLDER)
-                if image_filename:
-                    # Store the image path in the database
-                    update_data['image'] = f"/api/lost-found/images/{image_filename}"
+                image_url = save_image_data(data['image'], 'lost_found')
+                if image_url:
+                    # Store the image path in the database; the new photo is hashed below
+                    update_data['image'] = image_url
+                    update_data['image_hash'] = None
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
             except Exception as e:
                 current_app.logger.error(f"Error processing image: {str(e)}")
         
         # Handle ID card image update
-        if 'idCardImage' in data and data['idCardImage'] and data['idCardImage'].startswith('data:'):
+        if is_image_data(data.get('idCardImage')) and data['idCardImage'] != item.get('idCardImage'):
             try:
                 # Save the base64 image
-                id_card_filename = save_base64_image(data['idCardImage'], UPLOAD_FOLDER)
-                if id_card_filename:
+                id_card_url = save_image_data(data['idCardImage'], 'lost_found')
+                if id_card_url:
                     # Store the image path in the database
-                    update_data['idCardImage'] = f"/api/lost-found/images/{id_card_filename}"
+                    update_data['idCardImage'] = id_card_url
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
             except Exception as e:
                 current_app.logger.error(f"Error processing ID card image: {str(e)}")
         
-        db.lost_found_items.update_one(
-            {'_id': ObjectId(item_id)},
-            {'$set': update_data}
-        )
+        item_query = {'_id': ObjectId(item_id)}
+        if 'status' in update_data:
+            # A claim may have taken the item since it was read
+            item_query['claim_id'] = {'$exists': False}
+        if not db.lost_found_items.update_one(item_query, {'$set': update_data}).matched_count:
+            return jsonify({'error': 'The status of a claimed item changes through its claims'}), 409
+        if update_data.get('status') == 'open':
+            # Claims queued while the item was closed get their turn
+            LostFoundClaim.advance(db, item['_id'])
+        # Release the images that were replaced
+        for field in ('image', 'idCardImage'):
+            if field in update_data:
+                release_upload(item.get(field))
+        
+        updated_item = dict(item, **update_data)
+        lost_found_matcher.update(db, updated_item)
+        if 'image' in update_data:
+            lost_found_matcher.hash_photo(db, updated_item)
+            queue_variants(db, 'lost_found_items', item['_id'], 'image', update_data['image'])
         
         # Clear all related caches
         cache.delete('view/api/lost-found/items')
@@ -362,6 +368,10 @@ def delete_item(item_id):
         
         # Delete item
         db.lost_found_items.delete_one({'_id': ObjectId(item_id)})
+        lost_found_matcher.remove(db, item_id)
+        LostFoundClaim.close_item(db, item['_id'])
+        release_upload(item.get('image'))
+        release_upload(item.get('idCardImage'))
         
         # Clear all related caches
         cache.delete('view/api/lost-found/items')
@@ -378,6 +388,10 @@ def delete_item(item_id):
 @limiter.limit("10 per minute")
 @jwt_required()
 def claim_item(item_id):
+    """
+    Claim a found item. The claim joins the item's queue and becomes active
+    (the item is marked claimed) once it reaches the front.
+    """
     try:
         user_id = get_jwt_identity()
         
@@ -386,42 +400,158 @@ def claim_item(item_id):
         if not item:
             return jsonify({'error': 'Item not found'}), 404
         
-        # Only allow claiming "found" items
-        if item['item_type'] != 'found':
-            return jsonify({'error': 'Only found items can be claimed'}), 400
+        claim_data = request.get_json() or {}
+        try:
+            claim = LostFoundClaim.submit(
+                db, item, user_id,
+                proof=claim_data.get('proof', ''),
+                contact=claim_data.get('contact', '')
+            )
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        _clear_claim_caches(item_id)
+        
+        return jsonify({'message': 'Claim submitted successfully', 'claim': serialize_claim(claim)}), 201
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400 
+
+def _clear_claim_caches(item_id):
+    cache.delete(f'view/api/lost-found/items/{item_id}')
+    cache.delete_many('view/api/lost-found/*')
+    cache.delete_many('view/api/admin/*')
+
+@lost_found_bp.route('/items/<item_id>/claims', methods=['GET'])
+@limiter.limit("30 per minute")
+@jwt_required()
+def get_item_claims(item_id):
+    """The claims on an item in queue order (poster or admin only)"""
+    try:
+        user_id = get_jwt_identity()
+        item = db.lost_found_items.find_one({'_id': ObjectId(item_id)}, {'user_id': 1})
+        if not item:
+            return jsonify({'error': 'Item not found'}), 404
+        if str(item['user_id']) != user_id and not db.users.find_one({"_id": ObjectId(user_id), "role": "admin"}):
+            return jsonify({'error': 'Unauthorized to view claims on this item'}), 403
         
-        # Already claimed
-        if item['status'] == 'claimed':
-            return jsonify({'error': 'Item already claimed'}), 400
+        claims = LostFoundClaim.for_item(db, item_id)
+        for claim in claims:
+            claim['position'] = LostFoundClaim.position(db, claim)
+        return jsonify([serialize_claim(claim) for claim in claims]), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+# Claim transitions: action -> (function, who may take it)
+CLAIM_ACTIONS = {
+    'verify': (LostFoundClaim.verify, 'poster'),
+    'return': (LostFoundClaim.mark_returned, 'poster'),
+    'reject': (LostFoundClaim.reject, 'poster'),
+    'withdraw': (LostFoundClaim.withdraw, 'claimant'),
+}
+
+@lost_found_bp.route('/claims/<claim_id>/<action>', methods=['POST'])
+@limiter.limit("20 per minute")
+@jwt_required()
+def update_claim(claim_id, action):
+    """
+    Move a claim on: the poster verifies, marks returned or rejects it; the
+    claimant withdraws it. 409 if it is no longer in a state that allows this.
+    """
+    try:
+        if action not in CLAIM_ACTIONS:
+            return jsonify({'error': 'Unknown claim action'}), 404
+        transition, actor = CLAIM_ACTIONS[action]
+        user_id = get_jwt_identity()
         
-        claim_data = request.get_json() or {}
+        claim = LostFoundClaim.get(db, claim_id)
+        if not claim:
+            return jsonify({'error': 'Claim not found'}), 404
+        allowed = str(claim.get(f'{actor}_id')) == user_id
+        if not allowed and actor == 'poster':
+            # Admins moderate claims on any item
+            allowed = db.users.find_one({"_id": ObjectId(user_id), "role": "admin"}) is not None
+        if not allowed:
+            return jsonify({'error': f'Only the {actor} can {action} this claim'}), 403
+        
+        updated = transition(db, claim)
+        if not updated:
+            return jsonify({'error': f'Claim cannot be {action} from status "{claim["status"]}"'}), 409
+        
+        _clear_claim_caches(str(claim['item_id']))
+        return jsonify({'message': 'Claim updated', 'claim': serialize_claim(updated)}), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+@lost_found_bp.route('/claims/mine', methods=['GET'])
+@limiter.limit("30 per minute")
+@jwt_required()
+def get_my_claims():
+    """The user's claims, newest first, with the next page's cursor in X-Next-Cursor"""
+    try:
+        claims, next_cursor = LostFoundClaim.history(
+            db,
+            claimant_id=get_jwt_identity(),
+            limit=request.args.get('limit', type=int),
+            cursor=request.args.get('cursor')
+        )
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    
+    for claim in claims:
+        claim['position'] = LostFoundClaim.position(db, claim)
+    response = jsonify([serialize_claim(claim) for claim in claims])
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@lost_found_bp.route('/matches/<item_id>', methods=['GET'])
+@limiter.limit("30 per minute")
+def get_item_matches(item_id):
+    """Likely counterparts of a lost or found report, best first, from the stored matches"""
+    try:
+        item = db.lost_found_items.find_one({'_id': ObjectId(item_id)})
+        if not item:
+            return jsonify({'error': 'Item not found'}), 404
         
-        # Create claim
-        claim = {
-            'item_id': item_id,
-            'claimant_id': user_id,
-            'proof': claim_data.get('proof', ''),
-            'contact': claim_data.get('contact', ''),
-            'status': 'pending',
-            'created_at': datetime.datetime.utcnow()
-        }
+        matches = []
+        for match, score in lost_found_matcher.matches_for(db, item):
+            match['_id'] = str(match['_id'])
+            if 'user_id' in match:
+                match['user_id'] = str(match['user_id'])
+            match['match_score'] = score
+            matches.append(match)
         
-        db.claims.insert_one(claim)
+        return jsonify({'item_id': item_id, 'matches': matches}), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+@lost_found_bp.route('/similar-photos/<item_id>', methods=['GET'])
+@limiter.limit("30 per minute")
+def get_similar_photos(item_id):
+    """Open reports whose photo looks like this report's, closest first"""
+    try:
+        item = db.lost_found_items.find_one({'_id': ObjectId(item_id)})
+        if not item:
+            return jsonify({'error': 'Item not found'}), 404
         
-        # Clear related caches
-        cache.delete(f'view/api/lost-found/items/{item_id}')
-        cache.delete_many('view/api/lost-found/*')
-        cache.delete_many('view/api/admin/*')
+        items = []
+        for similar, distance in lost_found_matcher.similar_photos(db, item):
+            similar['_id'] = str(similar['_id'])
+            if 'user_id' in similar:
+                similar['user_id'] = str(similar['user_id'])
+            similar['photo_distance'] = distance
+            items.append(similar)
         
-        return jsonify({'message': 'Claim submitted successfully'}), 201
+        return jsonify({'item_id': item_id, 'items': items}), 200
     except Exception as e:
-        return jsonify({'error': str(e)}), 400 
+        return jsonify({'error': str(e)}), 400
 
 # Route to serve images
 @lost_found_bp.route('/images/<filename>', methods=['GET'])
 def get_image(filename):
     try:
-        return send_from_directory(UPLOAD_FOLDER, filename)
+        return upload_serving.serve_upload(f'lost_found/{filename}')
     except Exception as e:
         current_app.logger.error(f"Error serving image: {str(e)}")
         return jsonify({'error': 'Image not found'}), 404
@@ -430,8 +560,7 @@ def get_image(filename):
 @lost_found_bp.route('/uploads/<path:filename>', methods=['GET'])
 def serve_upload(filename):
     try:
-        upload_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'uploads')
-        return send_from_directory(upload_dir, filename)
+        return upload_serving.serve_upload(filename)
     except Exception as e:
         current_app.logger.error(f"Error serving upload: {str(e)}")
         return jsonify({'error': 'File not found'}), 404
\ No newline at end of file
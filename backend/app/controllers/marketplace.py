@@ -3,11 +3,10 @@ from flask_jwt_extended import jwt_required, get_jwt_identity
 from pymongo import MongoClient
 from bson import ObjectId
 import datetime
-import os
-from ..utils.upload import save_image
+from ..utils.upload import save_image, claim_upload
+from ..utils.image_variants import queue_variants, thumbnail_urls
+from ..utils.upload_refs import release_uploads
 from .. import cache, limiter
-from werkzeug.utils import secure_filename
-import uuid
 
 marketplace_bp = Blueprint('marketplace', __name__)
 client = MongoClient('mongodb://localhost:27017/')
@@ -41,6 +40,7 @@ def get_items():
         for item in items:
             item['_id'] = str(item['_id'])
             item['user_id'] = str(item['user_id'])
+            item['thumbnails'] = thumbnail_urls(item, 'images')
             # Add user details in a clean format
             if 'user_details' in item:
                 item['user'] = {
@@ -71,22 +71,18 @@ def create_item():
         for field in required_fields:
             if field not in data:
                 return jsonify({'error': f'Missing required field: {field}'}), 400
-        UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'uploads')
-        MARKETPLACE_FOLDER = os.path.join(UPLOAD_FOLDER, 'marketplace')
-        if not os.path.exists(MARKETPLACE_FOLDER):
-            os.makedirs(MARKETPLACE_FOLDER)
-        # Handle multiple images
+        # Handle multiple images, uploaded with the form or directly to storage
         images = request.files.getlist('images')
         image_urls = []
-        for file in images[:3]:  # Limit to 3 images
-            if file and file.filename != '':
-                filename = secure_filename(file.filename)
-                # Create a timestamp-based filename to avoid conflicts
-                timestamp = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
-                unique_filename = f"{timestamp}_{filename}"
-                file_path = os.path.join(MARKETPLACE_FOLDER, unique_filename)
-                file.save(file_path)
-                image_urls.append(f"/uploads/marketplace/{unique_filename}")
+        try:
+            for file in images[:3]:  # Limit to 3 images
+                if file and file.filename != '':
+                    image_urls.append(save_image(file, 'marketplace'))
+            for url in request.form.getlist('image_urls')[:3 - len(image_urls)]:
+                image_urls.append(claim_upload(url))
+        except ValueError as e:
+            release_uploads(image_urls)
+            return jsonify({'error': str(e)}), 400
         if not image_urls:
             return jsonify({'error': 'No image(s) provided'}), 400
         item_data = {
@@ -100,6 +96,7 @@ def create_item():
             "updated_at": datetime.datetime.utcnow()
         }
         result = db.marketplace_items.insert_one(item_data)
+        queue_variants(db, 'marketplace_items', result.inserted_id, 'images', image_urls)
         
         # Clear all related caches to ensure real-time updates
         cache.delete('view/api/marketplace/items')
@@ -132,6 +129,7 @@ def get_items_by_user(user_id):
         for item in items:
             item['_id'] = str(item['_id'])
             item['user_id'] = str(item['user_id'])
+            item['thumbnails'] = thumbnail_urls(item, 'images')
             # Add user details to each item
             item['user'] = {
                 "name": user.get('name', ''),
@@ -253,34 +251,21 @@ def update_item(item_id):
             "updated_at": datetime.datetime.utcnow()
         }
         
-        # Handle multiple images
-        if 'images' in request.files:
+        # Handle multiple images, uploaded with the form or directly to storage
+        if 'images' in request.files or 'image_urls' in request.form:
             images = request.files.getlist('images')
             image_urls = []
             
-            # Delete old images if they exist
-            if item.get('images'):
-                for old_image_url in item['images']:
-                    old_image_path = os.path.join(current_app.config.get('UPLOAD_FOLDER', '../uploads'), old_image_url.lstrip('/uploads/'))
-                    if os.path.exists(old_image_path):
-                        os.remove(old_image_path)
-            
-            # Create marketplace folder if it doesn't exist
-            UPLOAD_FOLDER = current_app.config.get('UPLOAD_FOLDER', os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'uploads'))
-            MARKETPLACE_FOLDER = os.path.join(UPLOAD_FOLDER, 'marketplace')
-            if not os.path.exists(MARKETPLACE_FOLDER):
-                os.makedirs(MARKETPLACE_FOLDER)
-            
             # Save new images
-            for file in images[:3]:  # Limit to 3 images
-                if file and file.filename != '':
-                    filename = secure_filename(file.filename)
-                    # Create a timestamp-based filename to avoid conflicts
-                    timestamp = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
-                    unique_filename = f"{timestamp}_{filename}"
-                    file_path = os.path.join(MARKETPLACE_FOLDER, unique_filename)
-                    file.save(file_path)
-                    image_urls.append(f"/uploads/marketplace/{unique_filename}")
+            try:
+                for file in images[:3]:  # Limit to 3 images
+                    if file and file.filename != '':
+                        image_urls.append(save_image(file, 'marketplace'))
+                for url in request.form.getlist('image_urls')[:3 - len(image_urls)]:
+                    image_urls.append(claim_upload(url))
+            except ValueError as e:
+                release_uploads(image_urls)
+                return jsonify({'error': str(e)}), 400
             
             if image_urls:
                 update_data['images'] = image_urls
@@ -290,6 +275,10 @@ def update_item(item_id):
             {'_id': ObjectId(item_id)},
             {'$set': update_data}
         )
+        if 'images' in update_data:
+            # The old images are released once the item no longer points at them
+            release_uploads(item.get('images'))
+            queue_variants(db, 'marketplace_items', item['_id'], 'images', update_data['images'])
         
         # Get updated item
         updated_item = db.marketplace_items.find_one({'_id': ObjectId(item_id)})
@@ -362,18 +351,12 @@ def delete_item(item_id):
         # Store user_id before deleting for cache invalidation
         user_id = str(item['user_id'])
         
-        # Delete images
-        if 'images' in item:
-            for image_url in item['images']:
-                try:
-                    image_path = os.path.join(current_app.config.get('UPLOAD_FOLDER', '../uploads'), image_url.lstrip('/uploads/'))
-                    if os.path.exists(image_path):
-                        os.remove(image_path)
-                except Exception as e:
-                    current_app.logger.error(f"Error deleting image {image_url}: {str(e)}")
-        
-        # Delete item from database
+        # Delete item from database, then release its images
         db.marketplace_items.delete_one({'_id': ObjectId(item_id)})
+        try:
+            release_uploads(item.get('images'))
+        except Exception as e:
+            current_app.logger.error(f"Error releasing images of item {item_id}: {str(e)}")
         
         # Clear all related caches
         cache.delete('view/api/marketplace/items')
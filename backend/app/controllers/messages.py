@@ -1,14 +1,11 @@
 from flask import Blueprint, request, jsonify, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from bson import ObjectId
-import os
-import base64
-import uuid
 from datetime import datetime
 
 from app.models.message import Message
 from app.models.user import User
-from app.utils.upload import save_base64_image
+from app.utils.upload import save_image, save_image_data, is_image_data
 from app.extensions import socketio
 
 messages_bp = Blueprint('messages', __name__)
@@ -42,9 +39,11 @@ def send_message():
     if data.get('image_data'):
         try:
             image_data = data.get('image_data')
-            if isinstance(image_data, str) and image_data.startswith('data:image'):
-                image_url = save_base64_image(image_data, 'messages')
+            if is_image_data(image_data):
+                image_url = save_image_data(image_data, 'messages')
                 message_data['image_url'] = image_url
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         except Exception as e:
             current_app.logger.error(f"Error saving base64 image: {str(e)}")
             return jsonify({'error': f'Error saving image: {str(e)}'}), 500
@@ -54,20 +53,10 @@ def send_message():
         try:
             file = request.files['image']
             if file.filename:
-                # Create directory if it doesn't exist
-                upload_folder = os.path.join(current_app.config['UPLOAD_FOLDER'], 'messages')
-                os.makedirs(upload_folder, exist_ok=True)
-                
-                # Generate unique filename
-                filename = f"{uuid.uuid4()}_{file.filename}"
-                file_path = os.path.join(upload_folder, filename)
-                
-                # Save file
-                file.save(file_path)
-                
-                # Set relative URL path
-                image_url = f"/uploads/messages/{filename}"
+                image_url = save_image(file, 'messages')
                 message_data['image_url'] = image_url
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         except Exception as e:
             current_app.logger.error(f"Error uploading file: {str(e)}")
             return jsonify({'error': f'Error uploading file: {str(e)}'}), 500
@@ -2,18 +2,30 @@ from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from pymongo import MongoClient
 from bson import ObjectId
+from app.utils.ids import to_object_id, match_user_id, user_id_forms
+from app.utils.locations import location_fields, location_index, SUGGEST_LIMIT, MAX_SUGGEST_LIMIT
+from app.utils.ride_expiry import departure_fields
+from app.utils.bookings import attach_live_rides, new_share_booking
+from app.models.ride_repository import RideRepository, RIDES
+from app.models.ride_waitlist import RideWaitlist
+from app.models.ride_request import RideRequest, serialize_request
+from app.utils.geo import (
+    to_point, point_fields, departure_datetime,
+    DEFAULT_RADIUS_M, MAX_RADIUS_M, DEFAULT_LIMIT, MAX_LIMIT
+)
 import datetime
 
 ride_bp = Blueprint('ride', __name__)
 client = MongoClient('mongodb://localhost:27017/')
 db = client.bracu_circle
+rides_repo = RideRepository(db)
 
 # Share ride endpoints
 @ride_bp.route('/share', methods=['GET'])
 def get_share_rides():
-    """Get all active share rides"""
+    """Get all active share rides, optionally filtered by from/to location and date"""
     try:
-        rides = list(db.share_rides.find({'status': 'active'}))
+        rides = rides_repo.find_active(request.args.get('from'), request.args.get('to'), request.args.get('date'))
         
         # Process ride data
         for ride in rides:
@@ -24,13 +36,44 @@ def get_share_rides():
     except Exception as e:
         return jsonify({'error': str(e)}), 400
 
+@ride_bp.route('/share/nearby', methods=['GET'])
+def get_nearby_share_rides():
+    """
+    Get active share rides starting near from_lat/from_lng and ending near
+    to_lat/to_lng, ranked by detour and departure time closeness
+    """
+    try:
+        args = request.args
+        try:
+            origin = to_point({'lat': args.get('from_lat'), 'lng': args.get('from_lng')})
+            destination = to_point({'lat': args.get('to_lat'), 'lng': args.get('to_lng')})
+        except ValueError as e:
+            return jsonify({'error': f'from_lat, from_lng, to_lat and to_lng are required: {e}'}), 400
+        
+        radius = min(args.get('radius', DEFAULT_RADIUS_M, type=float), MAX_RADIUS_M)
+        limit = max(1, min(args.get('limit', DEFAULT_LIMIT, type=int), MAX_LIMIT))
+        query = {'status': 'active'}
+        departure = None
+        if args.get('date'):
+            query['date'] = args['date']
+            departure = departure_datetime(args['date'], args.get('time', '00:00'))
+        
+        rides = rides_repo.find_nearby(origin, destination, radius, query, departure, limit)
+        for ride in rides:
+            ride['_id'] = str(ride['_id'])
+            ride['user_id'] = str(ride['user_id'])
+        
+        return jsonify(rides), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
 @ride_bp.route('/share/user', methods=['GET'])
 @jwt_required()
 def get_user_share_rides():
     """Get share rides posted by the currently logged-in user"""
     try:
         user_id = get_jwt_identity()
-        rides = list(db.share_rides.find({'user_id': user_id}))
+        rides = rides_repo.find_by_user(user_id)
         
         # Process ride data
         for ride in rides:
@@ -70,7 +113,7 @@ def create_share_ride():
         
         # Prepare ride data
         ride_data = {
-            'user_id': user_id,
+            'user_id': to_object_id(user_id),
             'user_name': user_name,
             'user_email': user_email,
             'from_location': data['from_location'],
@@ -87,23 +130,24 @@ def create_share_ride():
             'status': 'active',
             'updated_at': datetime.datetime.utcnow()
         }
+        ride_data.update(location_fields(data['from_location'], data['to_location']))
+        # Optional {'lat', 'lng'} coordinates of the pickup and drop-off points
+        ride_data.update(point_fields(data))
+        ride_data.update(departure_fields(data['date'], data['time']))
         
         # If it's an update, update the existing ride
         if ride_id:
             try:
                 # Verify the ride belongs to the current user
-                existing_ride = db.share_rides.find_one({'_id': ObjectId(ride_id)})
+                existing_ride = rides_repo.get(ride_id, {'user_id': 1})
                 if not existing_ride:
                     return jsonify({'error': 'Ride not found'}), 404
                     
-                if existing_ride['user_id'] != user_id:
+                if str(existing_ride['user_id']) != user_id:
                     return jsonify({'error': 'You can only edit your own rides'}), 403
                 
                 # Update the ride
-                db.share_rides.update_one(
-                    {'_id': ObjectId(ride_id)},
-                    {'$set': ride_data}
-                )
+                rides_repo.update(ride_id, ride_data)
                 
                 return jsonify({
                     'message': 'Share ride updated successfully',
@@ -117,11 +161,11 @@ def create_share_ride():
         ride_data['created_at'] = datetime.datetime.utcnow()
         
         # Insert the new ride
-        result = db.share_rides.insert_one(ride_data)
+        inserted_id = rides_repo.insert(ride_data)
         
         return jsonify({
             'message': 'Share ride created successfully',
-            'ride_id': str(result.inserted_id)
+            'ride_id': str(inserted_id)
         }), 201
     except Exception as e:
         return jsonify({'error': str(e)}), 400
@@ -132,7 +176,7 @@ def delete_share_ride(ride_id):
     """Delete a share ride (only by the owner or admin)"""
     try:
         user_id = get_jwt_identity()
-        ride = db.share_rides.find_one({'_id': ObjectId(ride_id)})
+        ride = rides_repo.get(ride_id, {'user_id': 1})
         if not ride:
             return jsonify({'error': 'Ride not found'}), 404
         is_owner = str(ride['user_id']) == user_id
@@ -140,11 +184,127 @@ def delete_share_ride(ride_id):
         is_admin = user and user.get('role') == 'admin'
         if not (is_owner or is_admin):
             return jsonify({'error': 'Unauthorized'}), 403
-        db.share_rides.delete_one({'_id': ObjectId(ride_id)})
+        rides_repo.delete(ride_id)
         return jsonify({'message': 'Share ride deleted successfully'}), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 400
 
+# Ride request endpoints; active requests are matched with rides in /api/carpool
+@ride_bp.route('/requests', methods=['POST'])
+@jwt_required()
+def create_ride_request():
+    """Ask for a ride on a route, date and time"""
+    try:
+        ride = RideRequest.create(db, get_jwt_identity(), request.get_json() or {})
+        return jsonify({
+            'message': 'Ride request created successfully',
+            'request': serialize_request(ride)
+        }), 201
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@ride_bp.route('/requests/mine', methods=['GET'])
+@jwt_required()
+def get_my_ride_requests():
+    """The current user's ride requests, newest first"""
+    try:
+        return jsonify(RideRequest.for_user(db, get_jwt_identity())), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@ride_bp.route('/requests/<request_id>/status', methods=['PUT'])
+@jwt_required()
+def close_ride_request(request_id):
+    """Cancel a ride request, or mark it matched once a ride was found"""
+    try:
+        status = (request.get_json() or {}).get('status')
+        if not RideRequest.close(db, request_id, get_jwt_identity(), status):
+            return jsonify({'error': 'Active ride request not found or unauthorized'}), 404
+        return jsonify({'message': f'Ride request {status}'}), 200
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@ride_bp.route('/locations/suggest', methods=['GET'])
+def suggest_locations():
+    """Autocomplete pickup and drop-off places used by live rides"""
+    try:
+        prefix = request.args.get('q', '')
+        limit = min(request.args.get('limit', SUGGEST_LIMIT, type=int), MAX_SUGGEST_LIMIT)
+        suggestions = location_index.suggest(db, [RIDES], prefix, max(limit, 1))
+        return jsonify(suggestions), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+def serialize_bookings(bookings):
+    """Convert the ObjectIds of bookings and their rides to strings"""
+    for booking in bookings:
+        booking['_id'] = str(booking['_id'])
+        if 'ride_id' in booking:
+            booking['ride_id'] = str(booking['ride_id'])
+        if 'user_id' in booking:
+            booking['user_id'] = str(booking['user_id'])
+        if 'ride' in booking and booking['ride']:
+            if '_id' in booking['ride']:
+                booking['ride']['_id'] = str(booking['ride']['_id'])
+            if 'user_id' in booking['ride']:
+                booking['ride']['user_id'] = str(booking['ride']['user_id'])
+    return bookings
+
+@ride_bp.route('/share/<ride_id>/waitlist', methods=['POST'])
+@jwt_required()
+def join_waitlist(ride_id):
+    """Join the waitlist of a full ride; seats freed by cancellations go to the oldest entry"""
+    try:
+        data = request.get_json(silent=True) or {}
+        user_id = get_jwt_identity()
+        seats = int(data.get('seats', 1))
+        if seats <= 0:
+            return jsonify({'error': 'Seats must be a positive number'}), 400
+        
+        ride = rides_repo.get(ride_id, {'user_id': 1, 'seats_available': 1, 'status': 1})
+        if not ride:
+            return jsonify({'error': 'Ride not found'}), 404
+        if str(ride['user_id']) == user_id:
+            return jsonify({'error': 'You cannot join the waitlist of your own ride'}), 400
+        if ride.get('status') not in ('active', 'booked'):
+            return jsonify({'error': 'Ride is no longer available'}), 400
+        if ride.get('status') == 'active' and ride['seats_available'] >= seats:
+            return jsonify({'error': 'Seats are available, book the ride instead'}), 400
+        
+        entry = RideWaitlist.join(ride_id, user_id, seats)
+        return jsonify(entry), 201
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+@ride_bp.route('/share/<ride_id>/waitlist', methods=['GET'])
+@jwt_required()
+def get_waitlist_entry(ride_id):
+    """Get the current user's place on a ride's waitlist"""
+    try:
+        entry = RideWaitlist.get_entry(ride_id, get_jwt_identity())
+        if not entry:
+            return jsonify({'error': 'You are not on the waitlist for this ride'}), 404
+        return jsonify(entry), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+@ride_bp.route('/share/<ride_id>/waitlist', methods=['DELETE'])
+@jwt_required()
+def leave_waitlist(ride_id):
+    """Leave a ride's waitlist"""
+    try:
+        if not RideWaitlist.leave(ride_id, get_jwt_identity()):
+            return jsonify({'error': 'You are not on the waitlist for this ride'}), 404
+        return jsonify({'message': 'Left the waitlist'}), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
 # Booking endpoints
 @ride_bp.route('/bookings', methods=['GET'])
 @jwt_required()
@@ -152,22 +312,22 @@ def get_user_bookings():
     """Get all bookings for the current user"""
     try:
         user_id = get_jwt_identity()
-        bookings = list(db.bookings.find({'user_id': user_id, 'status': 'active'}))
-        
-        # Process booking data
-        for booking in bookings:
-            booking['_id'] = str(booking['_id'])
-            if 'ride_id' in booking:
-                booking['ride_id'] = str(booking['ride_id'])
-            if 'user_id' in booking:
-                booking['user_id'] = str(booking['user_id'])
-            if 'ride' in booking and booking['ride']:
-                if '_id' in booking['ride']:
-                    booking['ride']['_id'] = str(booking['ride']['_id'])
-                if 'user_id' in booking['ride']:
-                    booking['ride']['user_id'] = str(booking['ride']['user_id'])
-        
-        return jsonify(bookings), 200
+        bookings = list(db.bookings.find({'user_id': match_user_id(user_id), 'status': 'active'}))
+        
+        return jsonify(serialize_bookings(bookings)), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+@ride_bp.route('/bookings/live', methods=['GET'])
+@jwt_required()
+def get_user_bookings_live():
+    """Get the current user's bookings with the current state of each ride"""
+    try:
+        user_id = get_jwt_identity()
+        bookings = list(db.bookings.find({'user_id': match_user_id(user_id), 'status': 'active'}))
+        attach_live_rides(rides_repo.collection(), bookings)
+        
+        return jsonify(serialize_bookings(bookings)), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 400
 
@@ -185,53 +345,41 @@ def create_booking():
             if field not in data:
                 return jsonify({'error': f'Missing {field}'}), 400
         
-        # Get the ride
-        ride = db.share_rides.find_one({'_id': ObjectId(data['ride_id'])})
-        if not ride:
-            return jsonify({'error': 'Ride not found'}), 404
-        
-        # Check if user is trying to book their own ride
-        if str(ride['user_id']) == user_id:
-            return jsonify({'error': 'You cannot book your own ride'}), 400
-        
-        # Check if there are enough seats available
         seats_requested = int(data['seats'])
-        if seats_requested > ride['seats_available']:
+        if seats_requested <= 0:
+            return jsonify({'error': 'Seats must be a positive number'}), 400
+        
+        # Reserve the seats in one conditional write so concurrent bookings cannot oversell
+        ride_obj_id = ObjectId(data['ride_id'])
+        ride = rides_repo.reserve(
+            ride_obj_id,
+            seats_requested,
+            query={'status': 'active', 'user_id': {'$nin': user_id_forms(user_id)}}
+        )
+        if not ride:
+            # Only the failure path pays for a second read, to explain why
+            ride = rides_repo.get(ride_obj_id, {'user_id': 1, 'seats_available': 1, 'status': 1})
+            if not ride:
+                return jsonify({'error': 'Ride not found'}), 404
+            if str(ride['user_id']) == user_id:
+                return jsonify({'error': 'You cannot book your own ride'}), 400
+            if ride.get('status') not in ('active', 'booked'):
+                return jsonify({'error': 'Ride is no longer available'}), 400
             return jsonify({'error': f'Not enough seats available. Only {ride["seats_available"]} left'}), 400
         
-        # Get user info
-        user = db.users.find_one({'_id': ObjectId(user_id)})
-        user_name = user.get('name', 'Unknown User') if user else 'Unknown User'
-        user_email = user.get('email', 'No email') if user else 'No email'
-        
-        # Create booking
-        booking = {
-            'user_id': user_id,
-            'user_name': user_name,
-            'user_email': user_email,
-            'ride_id': data['ride_id'],
-            'ride': ride,  # Store a copy of the ride at booking time
-            'seats': seats_requested,
-            'pickup_location': data.get('pickup_location', ride['from_location']),
-            'dropoff_location': data.get('dropoff_location', ride['to_location']),
-            'status': 'active',
-            'created_at': datetime.datetime.utcnow(),
-            'updated_at': datetime.datetime.utcnow()
-        }
-        
-        # Insert booking
-        result = db.bookings.insert_one(booking)
-        
-        # Update available seats in the ride
-        new_seats_available = ride['seats_available'] - seats_requested
-        db.share_rides.update_one(
-            {'_id': ObjectId(data['ride_id'])},
-            {'$set': {
-                'seats_available': new_seats_available,
-                # If no seats left, mark as booked
-                'status': 'booked' if new_seats_available == 0 else 'active'
-            }}
-        )
+        try:
+            booking = new_share_booking(
+                db, ride, user_id, seats_requested,
+                data.get('pickup_location'), data.get('dropoff_location')
+            )
+            result = db.bookings.insert_one(booking)
+        except Exception:
+            # Compensate: the booking was not stored, so give the seats back
+            rides_repo.release(ride_obj_id, seats_requested)
+            raise
+        
+        # A user who was waiting for this ride no longer needs to
+        RideWaitlist.leave(ride_obj_id, user_id, status='booked')
         
         return jsonify({
             'message': 'Booking created successfully',
@@ -284,9 +432,9 @@ def cancel_booking(booking_id):
             # If there's an error parsing the datetime, log it but continue with cancellation
             print(f"Error checking time restriction: {str(e)}")
         
-        # Update booking status
-        db.bookings.update_one(
-            {'_id': ObjectId(booking_id)},
+        # Update booking status; the status guard makes sure seats are returned only once
+        result = db.bookings.update_one(
+            {'_id': ObjectId(booking_id), 'status': 'active'},
             {'$set': {
                 'status': 'cancelled',
                 'cancellation_reason': data['reason'],
@@ -294,13 +442,17 @@ def cancel_booking(booking_id):
                 'updated_at': datetime.datetime.utcnow()
             }}
         )
+        if result.modified_count == 0:
+            return jsonify({'error': 'Booking is already cancelled or completed'}), 400
         
-        # Update ride seats
-        db.share_rides.update_one(
-            {'_id': ObjectId(booking['ride_id'])},
-            {'$inc': {'seats_available': booking['seats']},
-             '$set': {'status': 'active'}}  # Set back to active since seats are available again
-        )
+        # Return the seats, reopening the ride if it was full
+        rides_repo.release(booking['ride_id'], booking['seats'])
+        
+        # Hand the freed seats to the waitlist; promoted users are notified over Socket.IO
+        try:
+            RideWaitlist.promote(db, booking['ride_id'])
+        except Exception as e:
+            print(f"Error promoting waitlist: {str(e)}")
         
         return jsonify({'message': 'Booking cancelled successfully'}), 200
     except Exception as e:
@@ -325,7 +477,7 @@ def admin_get_all_share_rides():
             return jsonify({'error': 'Admin privileges required'}), 403
             
         # Fetch all ride shares
-        rides = list(db.share_rides.find())
+        rides = rides_repo.find()
         
         # Process ride data
         for ride in rides:
@@ -0,0 +1,32 @@
+from flask import Blueprint, jsonify, request, current_app
+from flask_jwt_extended import jwt_required
+from .. import limiter
+from app.utils.upload import presign_upload
+
+uploads_bp = Blueprint('uploads', __name__)
+
+@uploads_bp.route('/presign', methods=['POST'])
+@jwt_required()
+@limiter.limit("60 per minute")
+def presign():
+    """
+    Get a URL for uploading an image straight to storage
+
+    Body: {content_type, size, sha256 (hex of the file), folder}. The
+    response's `url` is sent in place of the image (e.g. as `image` on a lost
+    & found report) once the file has been uploaded with `upload`, which is
+    null if the same image is already stored.
+    """
+    try:
+        data = request.get_json() or {}
+        result = presign_upload(
+            data.get('content_type'), data.get('size'), data.get('sha256'), data.get('folder')
+        )
+        return jsonify(result), 200
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except NotImplementedError as e:
+        return jsonify({'error': str(e)}), 501
+    except Exception as e:
+        current_app.logger.error(f"Error presigning upload: {str(e)}")
+        return jsonify({'error': 'Failed to prepare upload'}), 500
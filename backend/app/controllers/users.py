@@ -3,10 +3,12 @@ from flask_jwt_extended import jwt_required, get_jwt_identity
 from pymongo import MongoClient
 from bson import ObjectId
 import datetime
-import os
-from werkzeug.utils import secure_filename
-import uuid
 from .. import limiter
+from ..models.purchase_history import PurchaseHistory
+from ..models.lost_found_item import LostFoundItem
+from ..utils.upload import save_image, save_image_data, is_image_data
+from ..utils.image_variants import queue_variants, thumbnail_urls
+from ..utils.upload_refs import release_upload
 
 users_bp = Blueprint('users', __name__)
 
@@ -41,16 +43,13 @@ def get_current_user():
         if 'id_card_photo' in user and user['id_card_photo']:
             if not user['id_card_photo'].startswith('/uploads/') and not user['id_card_photo'].startswith('http'):
                 user['id_card_photo'] = '/uploads/' + user['id_card_photo']
+        user['profile_picture_thumb'] = thumbnail_urls(user, 'profile_picture')
 
         return jsonify(user), 200
     except Exception as e:
         current_app.logger.error(f"Error getting current user: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
-# Constants
-UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'uploads', 'profiles')
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-
 def allowed_file(filename):
     ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -86,6 +85,7 @@ def get_user(user_id):
         if 'id_card_photo' in user and user['id_card_photo']:
             if not user['id_card_photo'].startswith('/uploads/') and not user['id_card_photo'].startswith('http'):
                 user['id_card_photo'] = '/uploads/' + user['id_card_photo']
+        user['profile_picture_thumb'] = thumbnail_urls(user, 'profile_picture')
 
         return jsonify(user), 200
     except Exception as e:
@@ -117,34 +117,14 @@ def update_user(user_id):
         current_app.logger.info(f"Updating user {user_id} with data: {data}")
         
         # Handle base64 profile picture if present
+        profile_picture_url = None
         if 'profile_picture_data' in data and data['profile_picture_data']:
             try:
                 # Extract base64 data
                 image_data = data['profile_picture_data']
-                if image_data.startswith('data:image'):
-                    # Save the image
-                    unique_filename = f"profile_{user_id}_{uuid.uuid4()}.jpg"
-                    file_path = os.path.join(UPLOAD_FOLDER, unique_filename)
-                    
-                    # Extract the base64 data
-                    header, base64_data = image_data.split(',', 1)
-                    import base64
-                    image_bytes = base64.b64decode(base64_data)
-                    
-                    # Save the image
-                    with open(file_path, 'wb') as f:
-                        f.write(image_bytes)
-                    
-                    # Update profile picture path
-                    profile_picture_url = f"/uploads/profiles/{unique_filename}"
-                    data['profile_picture'] = profile_picture_url
-                    
-                    # Delete old profile picture if exists
-                    user = db.users.find_one({"_id": ObjectId(user_id)})
-                    if user and 'profile_picture' in user and user['profile_picture']:
-                        old_file_path = os.path.join(os.path.dirname(UPLOAD_FOLDER), user['profile_picture'].lstrip('/'))
-                        if os.path.exists(old_file_path):
-                            os.remove(old_file_path)
+                if is_image_data(image_data):
+                    # Save the image, or claim the direct upload
+                    profile_picture_url = save_image_data(image_data, 'profiles')
             except Exception as e:
                 current_app.logger.error(f"Error processing profile picture: {str(e)}")
                 
@@ -154,22 +134,35 @@ def update_user(user_id):
         # Fields that can be updated
         allowed_fields = ['name', 'student_id', 'department', 'semester', 'phone', 'address']
         update_data = {k: v for k, v in data.items() if k in allowed_fields}
+        if profile_picture_url:
+            update_data['profile_picture'] = profile_picture_url
         
         # Add updated timestamp
         update_data['updated_at'] = datetime.datetime.utcnow()
         
         # Update user in database
-        result = db.users.update_one(
+        previous = db.users.find_one_and_update(
             {"_id": ObjectId(user_id)},
-            {"$set": update_data}
+            {"$set": update_data},
+            projection={'profile_picture': 1}
         )
         
-        if result.matched_count == 0:
+        if previous is None:
+            release_upload(profile_picture_url)
             return jsonify({"error": "User not found"}), 404
         
+        if profile_picture_url:
+            # Release the replaced picture
+            release_upload(previous.get('profile_picture'))
+            queue_variants(db, 'users', previous['_id'], 'profile_picture', profile_picture_url)
+        
         # Get updated user data
         updated_user = db.users.find_one({"_id": ObjectId(user_id)})
         
+        # Keep the creator snapshot on the user's lost & found reports current
+        if 'name' in update_data:
+            LostFoundItem.refresh_creator(db, updated_user)
+        
         # Remove sensitive information
         updated_user.pop('password', None)
         
@@ -211,20 +204,13 @@ def update_profile_picture(user_id):
         if not user:
             return jsonify({"error": "User not found"}), 404
         
-        # Delete old profile picture if exists
-        if 'profile_picture' in user and user['profile_picture']:
-            old_file_path = os.path.join(os.path.dirname(UPLOAD_FOLDER), user['profile_picture'].lstrip('/'))
-            if os.path.exists(old_file_path):
-                os.remove(old_file_path)
-        
         # Save new profile picture
-        filename = secure_filename(file.filename)
-        unique_filename = f"profile_{user_id}_{uuid.uuid4()}_{filename}"
-        file_path = os.path.join(UPLOAD_FOLDER, unique_filename)
-        file.save(file_path)
+        try:
+            profile_picture_url = save_image(file, 'profiles')
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
         
         # Update profile picture path in database
-        profile_picture_url = f"/uploads/profiles/{unique_filename}"
         db.users.update_one(
             {"_id": ObjectId(user_id)},
             {"$set": {
@@ -233,6 +219,10 @@ def update_profile_picture(user_id):
             }}
         )
         
+        # Release the old profile picture
+        release_upload(user.get('profile_picture'))
+        queue_variants(db, 'users', user['_id'], 'profile_picture', profile_picture_url)
+        
         return jsonify({
             "message": "Profile picture updated successfully",
             "profile_picture": profile_picture_url
@@ -259,24 +249,19 @@ def delete_profile_picture(user_id):
         if not user:
             return jsonify({"error": "User not found"}), 404
         
-        # Delete profile picture if exists
-        if 'profile_picture' in user and user['profile_picture']:
-            try:
-                # Delete file from filesystem
-                old_file_path = os.path.join(os.path.dirname(UPLOAD_FOLDER), user['profile_picture'].lstrip('/'))
-                if os.path.exists(old_file_path):
-                    os.remove(old_file_path)
-                    current_app.logger.info(f"Deleted profile picture file: {old_file_path}")
-            except Exception as e:
-                current_app.logger.error(f"Error deleting profile picture file: {str(e)}")
-        
         # Update user in database to remove profile picture
         db.users.update_one(
             {"_id": ObjectId(user_id)},
-            {"$unset": {"profile_picture": ""},
+            {"$unset": {"profile_picture": "", "variants.profile_picture": ""},
              "$set": {"updated_at": datetime.datetime.utcnow()}}
         )
         
+        # Release the picture's file
+        try:
+            release_upload(user.get('profile_picture'))
+        except Exception as e:
+            current_app.logger.error(f"Error releasing profile picture: {str(e)}")
+        
         return jsonify({
             "message": "Profile picture deleted successfully"
         }), 200
@@ -309,53 +294,20 @@ def get_user_purchases(user_id):
         if not user:
             return jsonify({"error": "User not found"}), 404
             
-        # Get purchase history from database - check both collections
-        # First check the user_purchases collection (new format)
-        user_purchases = list(db.user_purchases.find({"buyer_id": user_id}))
-        
-        # Then check the purchases collection (old format)
-        old_purchases = list(db.purchases.find({"user_id": user_obj_id}))
-        
-        # Combine both results
-        all_purchases = []
-        
-        # Format user_purchases data (new format)
-        for purchase in user_purchases:
-            formatted_purchase = {
-                '_id': str(purchase['_id']),
-                'buyer_id': purchase.get('buyer_id', ''),
-                'seller_id': purchase.get('seller_id', ''),
-                'item_id': purchase.get('item_id', ''),
-                'title': purchase.get('title', ''),
-                'description': purchase.get('description', ''),
-                'price': purchase.get('price', 0),
-                'payment_method': purchase.get('payment_method', ''),
-                'purchase_date': purchase.get('purchase_date', ''),
-                'images': purchase.get('images', [])
-            }
-            all_purchases.append(formatted_purchase)
-            
-        # Format old purchases data
-        for purchase in old_purchases:
-            purchase['_id'] = str(purchase['_id'])
-            purchase['user_id'] = str(purchase['user_id'])
-            if 'item_id' in purchase:
-                purchase['item_id'] = str(purchase['item_id'])
-                
-                # Get item details if available
-                try:
-                    item = db.marketplace_items.find_one({"_id": ObjectId(purchase['item_id'])})
-                    if item:
-                        purchase['title'] = item.get('title', '')
-                        purchase['price'] = item.get('price', 0)
-                        purchase['description'] = item.get('description', '')
-                        purchase['images'] = item.get('images', [])
-                except Exception as item_error:
-                    print(f"Error getting item details: {str(item_error)}")
-            
-            all_purchases.append(purchase)
-        
-        return jsonify(all_purchases), 200
+        # Purchase history is one indexed range read on the materialized projection
+        try:
+            purchases, next_cursor = PurchaseHistory.get_for_buyer(
+                user_id,
+                limit=request.args.get('limit', type=int),
+                cursor=request.args.get('cursor')
+            )
+        except ValueError:
+            return jsonify({"error": "Invalid cursor"}), 400
+        
+        response = jsonify(purchases)
+        if next_cursor:
+            response.headers['X-Next-Cursor'] = next_cursor
+        return response, 200
     except Exception as e:
         current_app.logger.error(f"Error getting purchase history: {str(e)}")
         return jsonify({"error": str(e)}), 500
@@ -382,14 +334,14 @@ def create_purchase_record():
         if not data.get('purchase_date'):
             data['purchase_date'] = datetime.datetime.utcnow()
             
-        # Insert purchase record
-        result = db.user_purchases.insert_one(data)
+        # Record the purchase in the buyer's history
+        purchase_id = PurchaseHistory.record_purchase(data)
         
         # Return success response
         return jsonify({
             "success": True,
             "message": "Purchase record created successfully",
-            "purchase_id": str(result.inserted_id)
+            "purchase_id": purchase_id
         }), 201
     except Exception as e:
         current_app.logger.error(f"Error creating purchase record: {str(e)}")
@@ -415,6 +367,7 @@ def get_user_marketplace_items(user_id):
         for item in items:
             item['_id'] = str(item['_id'])
             item['user_id'] = str(item['user_id'])
+            item['thumbnails'] = thumbnail_urls(item, 'images')
         
         return jsonify(items), 200
     except Exception as e:
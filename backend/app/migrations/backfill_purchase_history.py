@@ -0,0 +1,115 @@
+"""
+Backfill the purchase_history read model from every place purchases were recorded before it existed
+"""
+from app.models.purchase_history import PurchaseHistory
+from app.utils.ids import to_object_id
+from app.utils.migrations import Migration
+
+class PurchaseHistoryBackfill(Migration):
+    """Upsert purchase_history entries for one source collection"""
+    source = None
+
+    def __init__(self):
+        self.name = f'backfill_purchase_history.{self.collection}'
+        self._indexes_ready = False
+
+    def entries(self, db, documents):
+        """Yield the keyword arguments of PurchaseHistory.upsert_operation for each source document"""
+        raise NotImplementedError
+
+    def apply_batch(self, collection, documents):
+        db = collection.database
+        target = db.purchase_history
+        if not self._indexes_ready:
+            PurchaseHistory.ensure_indexes(target)
+            self._indexes_ready = True
+
+        operations = [
+            PurchaseHistory.upsert_operation(source=self.source, **entry)
+            for entry in self.entries(db, documents)
+            if entry.get('buyer_id')
+        ]
+        if not operations:
+            return 0
+        result = target.bulk_write(operations, ordered=False)
+        return result.upserted_count + result.modified_count
+
+    @staticmethod
+    def items_by_id(db, item_ids):
+        """Fetch the marketplace items referenced by a batch with one $in query"""
+        ids = list({to_object_id(item_id) for item_id in item_ids if item_id})
+        return {item['_id']: item for item in db.marketplace_items.find({'_id': {'$in': ids}})}
+
+class UserPurchasesBackfill(PurchaseHistoryBackfill):
+    collection = 'user_purchases'
+    source = 'purchase_record'
+
+    def entries(self, db, documents):
+        for purchase in documents:
+            images = purchase.get('images') or []
+            yield {
+                'buyer_id': purchase.get('buyer_id'),
+                'item_id': purchase.get('item_id'),
+                'seller_id': purchase.get('seller_id'),
+                'title': purchase.get('title'),
+                'description': purchase.get('description'),
+                'price': purchase.get('price'),
+                'images': images,
+                'image': images[0] if images else None,
+                'payment_method': purchase.get('payment_method'),
+                'purchase_date': purchase.get('purchase_date')
+            }
+
+class LegacyPurchasesBackfill(PurchaseHistoryBackfill):
+    collection = 'purchases'
+    source = 'legacy'
+
+    def entries(self, db, documents):
+        items = self.items_by_id(db, [purchase.get('item_id') for purchase in documents])
+        for purchase in documents:
+            item = items.get(to_object_id(purchase.get('item_id')))
+            if item:
+                entry = PurchaseHistory.entry_from_item(item, purchase.get('user_id'))
+            else:
+                entry = {'buyer_id': purchase.get('user_id'), 'item_id': purchase.get('item_id')}
+            entry['purchase_date'] = purchase.get('purchase_date') or purchase.get('created_at')
+            yield entry
+
+class OrdersBackfill(PurchaseHistoryBackfill):
+    collection = 'orders'
+    source = 'order'
+
+    def entries(self, db, documents):
+        items = self.items_by_id(db, [order.get('item_id') for order in documents])
+        for order in documents:
+            item = items.get(to_object_id(order.get('item_id')))
+            if item:
+                entry = PurchaseHistory.entry_from_item(item, order.get('buyer_id'))
+            else:
+                entry = {'buyer_id': order.get('buyer_id'), 'item_id': order.get('item_id')}
+            payment_info = order.get('payment_info')
+            entry.update({
+                'seller_id': order.get('seller_id'),
+                'order_id': order['_id'],
+                'price': order.get('total_amount', entry.get('price')),
+                'payment_method': payment_info.get('paymentMethod') if isinstance(payment_info, dict) else None,
+                'purchase_date': order.get('created_at')
+            })
+            yield entry
+
+class SoldItemsBackfill(PurchaseHistoryBackfill):
+    collection = 'marketplace_items'
+    source = 'sold'
+
+    def query(self):
+        return {'buyer_id': {'$exists': True, '$ne': None}}
+
+    def entries(self, db, documents):
+        for item in documents:
+            payment_info = item.get('payment_info')
+            payment_method = payment_info.get('paymentMethod') if isinstance(payment_info, dict) else None
+            yield PurchaseHistory.entry_from_item(
+                item, item.get('buyer_id'), payment_method, item.get('sold_date') or item.get('sold_at')
+            )
+
+MIGRATIONS = [UserPurchasesBackfill(), LegacyPurchasesBackfill(), OrdersBackfill(), SoldItemsBackfill()]
@@ -0,0 +1,31 @@
+"""
+Store departure_at on existing rides so the sweeper can expire them
+"""
+from app.utils.migrations import Migration
+from app.utils.ride_expiry import departure_fields
+
+class DepartureAt(Migration):
+    """Derive departure_at from the date and time strings of one ride collection"""
+
+    def __init__(self, collection):
+        self.name = f'departure_at.{collection}'
+        self.collection = collection
+
+    def query(self):
+        return {'departure_at': {'$exists': False}}
+
+    def projection(self):
+        return {'date': 1, 'time': 1}
+
+    def migrate_document(self, document):
+        fields = departure_fields(document.get('date'), document.get('time'))
+        return {'$set': fields} if fields else None
+
+    def indexes(self):
+        return [
+            ([('departure_at', 1)], {'name': 'departure_at_active', 'partialFilterExpression': {'status': 'active'}}),
+            ([('status', 1), ('departure_at', 1)], {'name': 'departure_at_booked', 'partialFilterExpression': {'status': 'booked'}}),
+            ([('closed_at', 1)], {'sparse': True}),
+        ]
+
+MIGRATIONS = [DepartureAt('share_rides'), DepartureAt('ride_posts')]
@@ -0,0 +1,38 @@
+"""
+Build thumbnail and medium variants of images uploaded before the variant pipeline
+"""
+from app.utils.image_variants import make_variants
+from app.utils.migrations import Migration
+
+class ImageVariants(Migration):
+    """
+    Write the variants of one image field and record them under
+    `variants.<field>`
+
+    Needs Pillow. Images whose file is gone get an entry with only their
+    source, so list endpoints keep returning the original URL.
+    """
+    batch_size = 50
+
+    def __init__(self, collection, field):
+        self.name = f'image_variants.{collection}.{field}'
+        self.collection = collection
+        self.field = field
+
+    def query(self):
+        return {self.field: {'$nin': [None, '', []]}, f'variants.{self.field}': {'$exists': False}}
+
+    def projection(self):
+        return {self.field: 1}
+
+    def migrate_document(self, document):
+        value = document[self.field]
+        urls = value if isinstance(value, list) else [value]
+        entries = [make_variants(url) or {'source': url} for url in urls if isinstance(url, str)]
+        return {'$set': {f'variants.{self.field}': entries}}
+
+MIGRATIONS = [
+    ImageVariants('marketplace_items', 'images'),
+    ImageVariants('lost_found_items', 'image'),
+    ImageVariants('users', 'profile_picture'),
+]
@@ -0,0 +1,32 @@
+"""
+Store normalized location tokens on existing rides so location search can use an index
+"""
+from app.utils.locations import location_fields
+from app.utils.migrations import Migration
+
+# Each token array gets its own index: a compound index cannot hold two multikey fields
+INDEXES = [
+    ([('from_tokens', 1), ('status', 1)], {}),
+    ([('to_tokens', 1), ('status', 1)], {}),
+]
+
+class LocationTokens(Migration):
+    """Add from_tokens/to_tokens to the rides of one collection"""
+
+    def __init__(self, collection):
+        self.name = f'location_tokens.{collection}'
+        self.collection = collection
+
+    def query(self):
+        return {'$or': [{'from_tokens': {'$exists': False}}, {'to_tokens': {'$exists': False}}]}
+
+    def projection(self):
+        return {'from_location': 1, 'to_location': 1}
+
+    def migrate_document(self, document):
+        return {'$set': location_fields(document.get('from_location') or '', document.get('to_location') or '')}
+
+    def indexes(self):
+        return INDEXES
+
+MIGRATIONS = [LocationTokens('share_rides'), LocationTokens('ride_posts')]
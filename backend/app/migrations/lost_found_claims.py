@@ -0,0 +1,74 @@
+"""
+Move claims from the old `claims` collection into the lost & found claim workflow
+"""
+from datetime import datetime
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+from app.models.lost_found_claim import LostFoundClaim, CLOSED, PENDING
+from app.utils.ids import to_object_id
+from app.utils.migrations import Migration
+
+class LostFoundClaims(Migration):
+    """
+    Copy each old claim into `lost_found_claims` with its item and claimant
+    snapshot, then start the queue of every item that got claims
+
+    Old claims were never acted on, so they enter the queue as pending, in
+    their original order. Claims on missing or lost items, and repeated
+    claims by the same user, are copied as closed. The old documents are
+    marked `migrated_at` and left in place.
+    """
+    name = 'lost_found_claims'
+    collection = 'claims'
+    batch_size = 100
+
+    def query(self):
+        return {'migrated_at': {'$exists': False}}
+
+    def apply_batch(self, collection, documents):
+        db = collection.database
+        item_ids = list({ObjectId(document['item_id']) for document in documents
+                         if ObjectId.is_valid(str(document.get('item_id')))})
+        items = {item['_id']: item for item in db.lost_found_items.find(
+            {'_id': {'$in': item_ids}}, {'title': 1, 'user_id': 1, 'item_type': 1})}
+        claimant_ids = list({to_object_id(document.get('claimant_id')) for document in documents})
+        users = {user['_id']: user for user in db.users.find({'_id': {'$in': claimant_ids}}, {'name': 1})}
+
+        claims = LostFoundClaim.collection(db)
+        queued = set()
+        for document in documents:
+            item_id = document.get('item_id')
+            item = items.get(ObjectId(item_id)) if ObjectId.is_valid(str(item_id)) else None
+            claimant_id = to_object_id(document.get('claimant_id'))
+            created_at = document.get('created_at') or document['_id'].generation_time.replace(tzinfo=None)
+            claim = {
+                '_id': document['_id'],
+                'item_id': item['_id'] if item else item_id,
+                'item_title': item.get('title') if item else None,
+                'poster_id': item.get('user_id') if item else None,
+                'claimant_id': claimant_id,
+                'claimant_name': users.get(claimant_id, {}).get('name'),
+                'proof': document.get('proof', ''),
+                'contact': document.get('contact', ''),
+                'status': PENDING,
+                'live': True,
+                'created_at': created_at,
+                'updated_at': datetime.utcnow()
+            }
+            if not item or item.get('item_type') != 'found':
+                claim.update(status=CLOSED, live=False)
+            try:
+                claims.insert_one(claim)
+            except DuplicateKeyError:
+                if claims.find_one({'_id': claim['_id']}) is None:
+                    # The user already has a live claim on this item
+                    claims.insert_one(dict(claim, status=CLOSED, live=False))
+            if claim['live']:
+                queued.add(claim['item_id'])
+            collection.update_one({'_id': document['_id']}, {'$set': {'migrated_at': datetime.utcnow()}})
+
+        for item_id in queued:
+            LostFoundClaim.advance(db, item_id, notify=False)
+        return len(documents)
+
+MIGRATIONS = [LostFoundClaims()]
@@ -0,0 +1,43 @@
+"""
+Store the creator snapshot on existing lost & found reports so the listing needs no user lookups
+"""
+from pymongo import UpdateOne
+from app.models.lost_found_item import INDEXES, creator_fields
+from app.utils.migrations import Migration
+
+class LostFoundCreators(Migration):
+    """
+    Add creator_name/creator_email to reports that lack them, looking up the
+    creators of a batch with one $in query
+
+    Reports without created_at get the creation time of their _id, so every
+    report has a place in the cursor order of the listing.
+    """
+    name = 'lost_found_creators'
+    collection = 'lost_found_items'
+
+    def query(self):
+        return {'$or': [{'creator_name': {'$exists': False}}, {'created_at': {'$exists': False}}]}
+
+    def projection(self):
+        return {'user_id': 1, 'creator_name': 1, 'created_at': 1}
+
+    def apply_batch(self, collection, documents):
+        user_ids = list({document['user_id'] for document in documents if document.get('user_id')})
+        users = collection.database.users.find({'_id': {'$in': user_ids}}, {'name': 1, 'email': 1})
+        users = {user['_id']: user for user in users}
+
+        operations = []
+        for document in documents:
+            fields = {}
+            if 'creator_name' not in document:
+                fields.update(creator_fields(users.get(document.get('user_id'))))
+            if 'created_at' not in document:
+                fields['created_at'] = document['_id'].generation_time.replace(tzinfo=None)
+            operations.append(UpdateOne({'_id': document['_id']}, {'$set': fields}))
+        return collection.bulk_write(operations, ordered=False).modified_count
+
+    def indexes(self):
+        return INDEXES
+
+MIGRATIONS = [LostFoundCreators()]
@@ -0,0 +1,39 @@
+"""
+Hash the photos of existing lost & found reports so they take part in photo matching
+"""
+from app.utils.image_hash import dhash, format_hash
+from app.utils.migrations import Migration
+from app.utils.storage import get_storage
+from app.utils.upload import upload_key
+
+class LostFoundPhotoHashes(Migration):
+    """
+    Store `image_hash` on lost & found items that have a photo but no hash
+
+    New photos are hashed in the background after upload. Needs Pillow;
+    photos whose file is gone or cannot be read as an image are left
+    unhashed, so one bad upload does not stop the migration. The matcher picks the hashes
+    up when it next loads (restart the app, or call lost_found_matcher.reset()).
+    """
+    name = 'lost_found_photo_hashes'
+    collection = 'lost_found_items'
+    batch_size = 100
+
+    def query(self):
+        return {'image': {'$nin': [None, '']}, 'image_hash': None}
+
+    def projection(self):
+        return {'image': 1}
+
+    def migrate_document(self, document):
+        key = upload_key(document.get('image'))
+        if not key:
+            return None
+        try:
+            with get_storage().local_file(key) as path:
+                return {'$set': {'image_hash': format_hash(dhash(path))}}
+        except (OSError, RuntimeError):
+            # Missing, unreadable or non-image file (or no Pillow): leave this photo unhashed
+            return None
+
+MIGRATIONS = [LostFoundPhotoHashes()]
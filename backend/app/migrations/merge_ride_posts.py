@@ -0,0 +1,31 @@
+"""
+Move ride_posts into share_rides so every ride offer lives in one collection
+"""
+from pymongo import UpdateOne
+from app.models.ride_repository import RIDES, LEGACY_RIDES, legacy_ride
+from app.utils.migrations import Migration
+
+class MergeRidePosts(Migration):
+    """
+    Copy each ride post into the rides collection under its own _id, then
+    delete the original
+
+    Bookings refer to rides by _id, so they keep pointing at the right ride.
+    The copy never overwrites a ride that is already there (e.g. one moved on
+    access by RideRepository), and the originals are only deleted once their
+    batch is copied, so the migration can be interrupted and rerun.
+    """
+    name = 'merge_ride_posts'
+    collection = LEGACY_RIDES
+
+    def apply_batch(self, collection, documents):
+        operations = []
+        for document in documents:
+            ride = legacy_ride(document)
+            del ride['_id']
+            operations.append(UpdateOne({'_id': document['_id']}, {'$setOnInsert': ride}, upsert=True))
+        result = collection.database[RIDES].bulk_write(operations, ordered=False)
+        collection.delete_many({'_id': {'$in': [document['_id'] for document in documents]}})
+        return result.upserted_count
+
+MIGRATIONS = [MergeRidePosts()]
@@ -0,0 +1,52 @@
+"""
+Normalize user reference fields that were stored as JWT identity strings to ObjectIds
+"""
+from bson import ObjectId
+from app.utils.ids import to_object_id
+from app.utils.migrations import Migration
+
+# collection -> (user reference fields, indexes serving the lookups on them)
+COLLECTIONS = {
+    'share_rides': (('user_id',), [([('user_id', 1)], {})]),
+    'bookings': (('user_id',), [([('user_id', 1), ('status', 1)], {})]),
+    'ride_posts': (('creator_id', 'user_id'), [([('creator_id', 1)], {})]),
+    'marketplace_items': (('user_id', 'buyer_id'), [([('user_id', 1)], {}), ([('buyer_id', 1)], {'sparse': True})]),
+    'user_purchases': (('buyer_id', 'seller_id'), [([('buyer_id', 1), ('purchase_date', -1)], {})]),
+    'purchases': (('user_id',), [([('user_id', 1)], {})]),
+    'orders': (('buyer_id', 'seller_id'), [
+        ([('buyer_id', 1), ('created_at', -1)], {}),
+        ([('seller_id', 1), ('created_at', -1)], {})
+    ]),
+    'lost_found_items': (('user_id',), [([('user_id', 1)], {})]),
+}
+
+class NormalizeUserIds(Migration):
+    """Convert string user references in one collection to ObjectIds"""
+
+    def __init__(self, collection, fields, indexes):
+        self.name = f'normalize_user_ids.{collection}'
+        self.collection = collection
+        self.fields = fields
+        self._indexes = indexes
+
+    def query(self):
+        return {'$or': [{field: {'$type': 'string'}} for field in self.fields]}
+
+    def projection(self):
+        return {field: 1 for field in self.fields}
+
+    def migrate_document(self, document):
+        updates = {}
+        for field in self.fields:
+            value = document.get(field)
+            if isinstance(value, str):
+                normalized = to_object_id(value)
+                # Legacy identities that are not ObjectIds (e.g. "admin") stay strings
+                if isinstance(normalized, ObjectId):
+                    updates[field] = normalized
+        return {'$set': updates} if updates else None
+
+    def indexes(self):
+        return self._indexes
+
+MIGRATIONS = [NormalizeUserIds(name, fields, indexes) for name, (fields, indexes) in COLLECTIONS.items()]
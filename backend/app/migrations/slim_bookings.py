@@ -0,0 +1,33 @@
+"""
+Replace the full ride copies embedded in bookings with the fixed ride snapshot
+"""
+from app.utils.bookings import ride_snapshot, SNAPSHOT_FIELDS
+from app.utils.migrations import Migration
+
+# share_rides bookings embed the ride as `ride`, ride_posts bookings as `ride_details`
+EMBEDDED_FIELDS = ('ride', 'ride_details')
+
+class SlimBookings(Migration):
+    """Trim embedded rides down to SNAPSHOT_FIELDS"""
+    name = 'slim_bookings'
+    collection = 'bookings'
+
+    def query(self):
+        # seats_available is on every ride but never in a snapshot
+        return {'$or': [{f'{field}.seats_available': {'$exists': True}} for field in EMBEDDED_FIELDS]}
+
+    def projection(self):
+        return {field: 1 for field in EMBEDDED_FIELDS}
+
+    def migrate_document(self, document):
+        updates = {}
+        for field in EMBEDDED_FIELDS:
+            ride = document.get(field)
+            if isinstance(ride, dict) and set(ride) - set(SNAPSHOT_FIELDS):
+                updates[field] = ride_snapshot(ride)
+        return {'$set': updates} if updates else None
+
+    def indexes(self):
+        return [([('user_id', 1), ('status', 1)], {})]
+
+MIGRATIONS = [SlimBookings()]
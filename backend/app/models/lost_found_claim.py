@@ -0,0 +1,349 @@
+"""
+Claims on found items
+
+A found item moves open -> claimed -> verified -> returned. Claims are kept
+in their own collection, one document per claim, and each item has a FIFO
+queue of them: while the item is open, its oldest pending claim becomes the
+active one and the item is marked claimed. If the poster rejects that claim
+or the claimant withdraws it, the item reopens and the next claim in the
+queue takes over.
+
+Every transition is a conditional find_one_and_update on the item's status
+and active claim, followed by the claim's own status. Two requests racing on
+the same item or claim cannot both win, and the loser gets None.
+
+The poster is told about new and withdrawn claims, and the claimant about
+the poster's decisions, through their Socket.IO rooms (`lost_found_claim`
+events). Claims carry a snapshot of the item title and the claimant's name,
+so the admin history is one indexed range read.
+"""
+from datetime import datetime
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import DESCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from app.extensions import socketio
+from app.utils.ids import to_object_id, stringify_ids
+from app.utils.lost_found_matcher import lost_found_matcher
+
+# Claim statuses. A pending claim waits in the item's queue; the active one
+# holds the item while it is claimed, and stays with it through verified
+# and returned.
+PENDING = 'pending'
+ACTIVE = 'active'
+VERIFIED = 'verified'
+RETURNED = 'returned'
+REJECTED = 'rejected'
+WITHDRAWN = 'withdrawn'
+# The item was returned to another claimant or deleted
+CLOSED = 'closed'
+
+# Item statuses owned by the claim workflow
+ITEM_STATUSES = ('claimed', 'verified', 'returned')
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 100
+
+INDEXES = [
+    # An item's queue, oldest first
+    ([('item_id', 1), ('status', 1), ('created_at', 1), ('_id', 1)], {}),
+    # One live (pending, active or verified) claim per user and item
+    ([('item_id', 1), ('claimant_id', 1)], {'unique': True, 'partialFilterExpression': {'live': True}}),
+    # Admin history, newest first, unfiltered or by status, item or claimant
+    ([('created_at', DESCENDING), ('_id', DESCENDING)], {}),
+    ([('status', 1), ('created_at', DESCENDING), ('_id', DESCENDING)], {}),
+    ([('item_id', 1), ('created_at', DESCENDING), ('_id', DESCENDING)], {}),
+    ([('claimant_id', 1), ('created_at', DESCENDING), ('_id', DESCENDING)], {}),
+]
+
+_indexes_ready = False
+
+def serialize_claim(claim):
+    claim = stringify_ids(dict(claim))
+    for field in ('created_at', 'updated_at'):
+        if isinstance(claim.get(field), datetime):
+            claim[field] = claim[field].isoformat()
+    return claim
+
+class LostFoundClaim:
+    """
+    Claims: pending -> active -> verified -> returned, or rejected / withdrawn / closed
+    """
+
+    @staticmethod
+    def collection(db):
+        global _indexes_ready
+        collection = db.lost_found_claims
+        if not _indexes_ready:
+            for keys, options in INDEXES:
+                collection.create_index(keys, **options)
+            _indexes_ready = True
+        return collection
+
+    @staticmethod
+    def get(db, claim_id):
+        return LostFoundClaim.collection(db).find_one({'_id': ObjectId(claim_id)})
+
+    @staticmethod
+    def submit(db, item, claimant_id, proof='', contact=''):
+        """
+        Queue a claim on a found item, and make it active if the item is open
+
+        Returns:
+            dict: The claim, with its 1-based `position` in the item's queue (0 once active)
+
+        Raises:
+            ValueError: If the item cannot be claimed by this user
+        """
+        if item.get('item_type') != 'found':
+            raise ValueError('Only found items can be claimed')
+        if item.get('status') == 'returned':
+            raise ValueError('Item has already been returned')
+        claimant_id = to_object_id(claimant_id)
+        if claimant_id == item.get('user_id'):
+            raise ValueError('You cannot claim your own item')
+
+        claimant = db.users.find_one({'_id': claimant_id}, {'name': 1})
+        now = datetime.utcnow()
+        claim = {
+            'item_id': item['_id'],
+            'item_title': item.get('title'),
+            'poster_id': item.get('user_id'),
+            'claimant_id': claimant_id,
+            'claimant_name': claimant.get('name') if claimant else None,
+            'proof': proof,
+            'contact': contact,
+            'status': PENDING,
+            'live': True,
+            'created_at': now,
+            'updated_at': now
+        }
+        try:
+            LostFoundClaim.collection(db).insert_one(claim)
+        except DuplicateKeyError:
+            raise ValueError('You already have a claim on this item')
+        LostFoundClaim.notify(claim, 'submitted', claim['poster_id'])
+
+        LostFoundClaim.advance(db, item['_id'])
+        claim = LostFoundClaim.get(db, claim['_id'])
+        claim['position'] = LostFoundClaim.position(db, claim)
+        return claim
+
+    @staticmethod
+    def advance(db, item_id, notify=True):
+        """
+        Make the oldest pending claim active if the item is open
+
+        Args:
+            notify: Whether to tell the poster (off outside the app, e.g. in migrations)
+
+        Returns:
+            dict: The newly active claim, or None
+        """
+        claims = LostFoundClaim.collection(db)
+        # Take the head of the queue; concurrent calls take different claims
+        claim = claims.find_one_and_update(
+            {'item_id': item_id, 'status': PENDING},
+            {'$set': {'status': ACTIVE, 'updated_at': datetime.utcnow()}},
+            sort=[('created_at', 1), ('_id', 1)],
+            return_document=ReturnDocument.AFTER
+        )
+        if not claim:
+            return None
+        item = db.lost_found_items.find_one_and_update(
+            {'_id': item_id, 'status': 'open'},
+            # The item's API serializes only its own ids, so the claim is referenced as a string
+            {'$set': {'status': 'claimed', 'claim_id': str(claim['_id']), 'updated_at': datetime.utcnow()}},
+            return_document=ReturnDocument.AFTER
+        )
+        if not item:
+            # Already held by another claim; back into place in the queue
+            claims.update_one({'_id': claim['_id'], 'status': ACTIVE}, {'$set': {'status': PENDING}})
+            return None
+        LostFoundClaim._item_changed(db, item)
+        if notify:
+            LostFoundClaim.notify(claim, 'active', claim['poster_id'])
+        return claim
+
+    @staticmethod
+    def _transition(db, claim, item_from, item_to, claim_from, claim_to):
+        """
+        Move the item and its active claim together
+
+        Returns:
+            dict: The claim after the change, or None if either was no longer in the expected state
+        """
+        update = {'$set': {'status': item_to, 'updated_at': datetime.utcnow()}}
+        if item_to == 'open':
+            update['$unset'] = {'claim_id': ''}
+        item = db.lost_found_items.find_one_and_update(
+            {'_id': claim['item_id'], 'status': {'$in': list(item_from)}, 'claim_id': str(claim['_id'])},
+            update,
+            return_document=ReturnDocument.AFTER
+        )
+        if not item:
+            return None
+        claim = LostFoundClaim.collection(db).find_one_and_update(
+            {'_id': claim['_id'], 'status': {'$in': list(claim_from)}},
+            {'$set': {'status': claim_to, 'live': claim_to in (PENDING, ACTIVE, VERIFIED),
+                      'updated_at': datetime.utcnow()}},
+            return_document=ReturnDocument.AFTER
+        )
+        LostFoundClaim._item_changed(db, item)
+        return claim
+
+    @staticmethod
+    def verify(db, claim):
+        """The poster accepts the active claim's proof: claimed -> verified"""
+        claim = LostFoundClaim._transition(db, claim, ['claimed'], 'verified', [ACTIVE], VERIFIED)
+        if claim:
+            LostFoundClaim.notify(claim, 'verified', claim['claimant_id'])
+        return claim
+
+    @staticmethod
+    def mark_returned(db, claim):
+        """The item was handed over: verified -> returned, closing the rest of the queue"""
+        claim = LostFoundClaim._transition(db, claim, ['verified'], 'returned', [VERIFIED], RETURNED)
+        if claim:
+            LostFoundClaim.notify(claim, 'returned', claim['claimant_id'])
+            LostFoundClaim.close_item(db, claim['item_id'])
+        return claim
+
+    @staticmethod
+    def reject(db, claim):
+        """
+        The poster turns down a claim: a pending one leaves the queue, an
+        active or verified one releases the item to the next claim
+        """
+        claims = LostFoundClaim.collection(db)
+        if claim['status'] == PENDING:
+            claim = claims.find_one_and_update(
+                {'_id': claim['_id'], 'status': PENDING},
+                {'$set': {'status': REJECTED, 'live': False, 'updated_at': datetime.utcnow()}},
+                return_document=ReturnDocument.AFTER
+            )
+        else:
+            claim = LostFoundClaim._transition(
+                db, claim, ['claimed', 'verified'], 'open', [ACTIVE, VERIFIED], REJECTED
+            )
+            if claim:
+                LostFoundClaim.advance(db, claim['item_id'])
+        if claim:
+            LostFoundClaim.notify(claim, 'rejected', claim['claimant_id'])
+        return claim
+
+    @staticmethod
+    def withdraw(db, claim):
+        """The claimant drops their claim; an item it held goes to the next claim"""
+        claims = LostFoundClaim.collection(db)
+        if claim['status'] == PENDING:
+            claim = claims.find_one_and_update(
+                {'_id': claim['_id'], 'status': PENDING},
+                {'$set': {'status': WITHDRAWN, 'live': False, 'updated_at': datetime.utcnow()}},
+                return_document=ReturnDocument.AFTER
+            )
+        else:
+            claim = LostFoundClaim._transition(
+                db, claim, ['claimed', 'verified'], 'open', [ACTIVE, VERIFIED], WITHDRAWN
+            )
+            if claim:
+                LostFoundClaim.advance(db, claim['item_id'])
+        if claim:
+            LostFoundClaim.notify(claim, 'withdrawn', claim['poster_id'])
+        return claim
+
+    @staticmethod
+    def close_item(db, item_id):
+        """Close the claims still queued on an item that was returned or deleted"""
+        claims = LostFoundClaim.collection(db)
+        closing = list(claims.find({'item_id': item_id, 'status': {'$in': [PENDING, ACTIVE, VERIFIED]}}))
+        if not closing:
+            return 0
+        claims.update_many(
+            {'_id': {'$in': [claim['_id'] for claim in closing]}, 'status': {'$in': [PENDING, ACTIVE, VERIFIED]}},
+            {'$set': {'status': CLOSED, 'live': False, 'updated_at': datetime.utcnow()}}
+        )
+        for claim in closing:
+            LostFoundClaim.notify(dict(claim, status=CLOSED), 'closed', claim['claimant_id'])
+        return len(closing)
+
+    @staticmethod
+    def position(db, claim):
+        """1-based place of a pending claim in its item's queue, 0 for any other claim"""
+        if claim['status'] != PENDING:
+            return 0
+        ahead = LostFoundClaim.collection(db).count_documents({
+            'item_id': claim['item_id'],
+            'status': PENDING,
+            '$or': [
+                {'created_at': {'$lt': claim['created_at']}},
+                {'created_at': claim['created_at'], '_id': {'$lt': claim['_id']}}
+            ]
+        })
+        return ahead + 1
+
+    @staticmethod
+    def for_item(db, item_id):
+        """An item's claims in queue order"""
+        return list(LostFoundClaim.collection(db).find({'item_id': ObjectId(item_id)})
+                    .sort([('created_at', 1), ('_id', 1)]))
+
+    @staticmethod
+    def encode_cursor(claim):
+        return f"{claim['created_at'].isoformat()}_{claim['_id']}"
+
+    @staticmethod
+    def decode_cursor(cursor):
+        try:
+            created_at, claim_id = cursor.rsplit('_', 1)
+            return datetime.fromisoformat(created_at), ObjectId(claim_id)
+        except (ValueError, InvalidId):
+            raise ValueError('Invalid cursor')
+
+    @staticmethod
+    def history(db, status=None, item_id=None, claimant_id=None, limit=DEFAULT_PAGE_SIZE, cursor=None):
+        """
+        One page of claims, newest first, for admins
+
+        Each filter is served by its own index, so a page is one range read.
+
+        Returns:
+            tuple: (list of claims, cursor of the next page or None)
+
+        Raises:
+            ValueError: If the cursor or an id is invalid
+        """
+        limit = max(1, min(int(limit or DEFAULT_PAGE_SIZE), MAX_PAGE_SIZE))
+        query = {}
+        if status:
+            query['status'] = status
+        if item_id:
+            query['item_id'] = ObjectId(item_id)
+        if claimant_id:
+            query['claimant_id'] = to_object_id(claimant_id)
+        if cursor:
+            created_at, claim_id = LostFoundClaim.decode_cursor(cursor)
+            query['$or'] = [
+                {'created_at': {'$lt': created_at}},
+                {'created_at': created_at, '_id': {'$lt': claim_id}}
+            ]
+        claims = list(LostFoundClaim.collection(db).find(query)
+                      .sort([('created_at', DESCENDING), ('_id', DESCENDING)])
+                      .limit(limit + 1))
+        next_cursor = None
+        if len(claims) > limit:
+            claims = claims[:limit]
+            next_cursor = LostFoundClaim.encode_cursor(claims[-1])
+        return claims, next_cursor
+
+    @staticmethod
+    def _item_changed(db, item):
+        # Claimed items leave the matcher; reopened ones come back
+        lost_found_matcher.update(db, item)
+
+    @staticmethod
+    def notify(claim, event, user_id):
+        """Push a claim event to a user's room"""
+        if user_id is None:
+            return
+        socketio.emit('lost_found_claim', {'event': event, 'claim': serialize_claim(claim)}, room=str(user_id))
@@ -0,0 +1,145 @@
+"""
+Listing of lost & found reports
+
+The public listing used to read the whole collection and look up the creator
+of every item. Reports now carry a snapshot of their creator's name and email
+(`creator_name`, `creator_email`), written when the report is created and
+refreshed when the user edits their profile, and the listing is read one
+page at a time with a cursor on (created_at, _id), so a page is one indexed
+range read.
+"""
+from datetime import datetime, timedelta
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import DESCENDING
+from app.utils.ids import to_object_id, stringify_ids
+from app.utils.image_variants import thumbnail_urls
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 100
+ANONYMOUS = {'creator_name': 'Anonymous', 'creator_email': 'No email provided'}
+
+# Equality filters first, then the sort keys, then the date range
+INDEXES = [
+    ([('created_at', DESCENDING), ('_id', DESCENDING)], {}),
+    ([('item_type', 1), ('created_at', DESCENDING), ('_id', DESCENDING), ('date', 1)], {}),
+    ([('status', 1), ('item_type', 1), ('created_at', DESCENDING), ('_id', DESCENDING), ('date', 1)], {}),
+    ([('category', 1), ('status', 1), ('created_at', DESCENDING), ('_id', DESCENDING), ('date', 1)], {}),
+]
+
+_indexes_ready = False
+
+def creator_fields(user):
+    """Creator snapshot stored on a report, from its user document (or None)"""
+    if not user:
+        return dict(ANONYMOUS)
+    return {
+        'creator_name': user.get('name', ANONYMOUS['creator_name']),
+        'creator_email': user.get('email', ANONYMOUS['creator_email']),
+    }
+
+class LostFoundItem:
+    """
+    Reads of lost & found reports for the public listing
+    """
+
+    @staticmethod
+    def collection(db):
+        global _indexes_ready
+        collection = db.lost_found_items
+        if not _indexes_ready:
+            for keys, options in INDEXES:
+                collection.create_index(keys, **options)
+            _indexes_ready = True
+        return collection
+
+    @staticmethod
+    def creator_snapshot(db, user_id):
+        """Creator fields for a new report by `user_id`"""
+        return creator_fields(db.users.find_one({'_id': to_object_id(user_id)}, {'name': 1, 'email': 1}))
+
+    @staticmethod
+    def refresh_creator(db, user):
+        """Rewrite the creator snapshot on every report of a user after a profile change"""
+        return db.lost_found_items.update_many({'user_id': user['_id']}, {'$set': creator_fields(user)}).modified_count
+
+    @staticmethod
+    def encode_cursor(item):
+        return f"{item['created_at'].isoformat()}_{item['_id']}"
+
+    @staticmethod
+    def decode_cursor(cursor):
+        try:
+            created_at, item_id = cursor.rsplit('_', 1)
+            return datetime.fromisoformat(created_at), ObjectId(item_id)
+        except (ValueError, InvalidId):
+            raise ValueError('Invalid cursor')
+
+    @staticmethod
+    def list_page(db, item_type=None, status=None, category=None, date_from=None, date_to=None,
+                  limit=None, cursor=None):
+        """
+        Get reports, newest first
+
+        Without a limit or cursor every matching report is returned, as the
+        listing pages that do not page expect; otherwise one page of at most
+        MAX_PAGE_SIZE reports.
+
+        Args:
+            item_type: 'lost' or 'found'
+            status: e.g. 'open' or 'claimed'
+            category: Exact category
+            date_from, date_to: Inclusive bounds on the reported date ('YYYY-MM-DD')
+            limit: Page size (capped at MAX_PAGE_SIZE)
+            cursor: The cursor returned with the previous page, if any
+
+        Returns:
+            tuple: (list of serialized reports, cursor of the next page or None)
+
+        Raises:
+            ValueError: If date_to or the cursor is malformed
+        """
+        paged = bool(limit or cursor)
+        limit = max(1, min(int(limit or DEFAULT_PAGE_SIZE), MAX_PAGE_SIZE))
+        query = {}
+        for field, value in (('item_type', item_type), ('status', status), ('category', category)):
+            if value:
+                query[field] = value
+        if date_from or date_to:
+            query['date'] = {}
+            if date_from:
+                query['date']['$gte'] = date_from
+            if date_to:
+                # Stored dates may be full ISO timestamps; anything before the next day is on date_to
+                try:
+                    next_day = datetime.strptime(date_to, '%Y-%m-%d') + timedelta(days=1)
+                except ValueError:
+                    raise ValueError('date_to must be YYYY-MM-DD')
+                query['date']['$lt'] = next_day.strftime('%Y-%m-%d')
+        if cursor:
+            created_at, item_id = LostFoundItem.decode_cursor(cursor)
+            query['$or'] = [
+                {'created_at': {'$lt': created_at}},
+                {'created_at': created_at, '_id': {'$lt': item_id}}
+            ]
+
+        items = (LostFoundItem.collection(db).find(query)
+                 .sort([('created_at', DESCENDING), ('_id', DESCENDING)]))
+        items = list(items.limit(limit + 1) if paged else items)
+        next_cursor = None
+        if paged and len(items) > limit:
+            items = items[:limit]
+            next_cursor = LostFoundItem.encode_cursor(items[-1])
+
+        # Reports from before the snapshot that the backfill has not reached yet
+        missing = {item['user_id'] for item in items if 'user_id' in item and 'creator_name' not in item}
+        if missing:
+            users = db.users.find({'_id': {'$in': list(missing)}}, {'name': 1, 'email': 1})
+            users = {user['_id']: user for user in users}
+            for item in items:
+                if item.get('user_id') in missing:
+                    item.update(creator_fields(users.get(item['user_id'])))
+
+        for item in items:
+            item['thumbnail'] = thumbnail_urls(item, 'image')
+        return [stringify_ids(item) for item in items], next_cursor
@@ -1,6 +1,7 @@
 from datetime import datetime
 from bson import ObjectId
-from pymongo import MongoClient, DESCENDING
+from pymongo import MongoClient, DESCENDING, ReturnDocument
+from app.models.purchase_history import PurchaseHistory
 
 client = MongoClient('mongodb://localhost:27017/')
 db = client.bracu_circle
@@ -24,10 +25,12 @@ class Order:
         result = db.orders.insert_one(order)
         if result.inserted_id:
             # Mark the item as sold
-            db.marketplace_items.update_one(
+            item = db.marketplace_items.find_one_and_update(
                 {"_id": ObjectId(data["item_id"])},
-                {"$set": {"status": "sold", "sold_at": datetime.utcnow()}}
+                {"$set": {"status": "sold", "sold_at": datetime.utcnow()}},
+                return_document=ReturnDocument.AFTER
             )
+            PurchaseHistory.record_order(result.inserted_id, order, item)
             return str(result.inserted_id)
         return None
 
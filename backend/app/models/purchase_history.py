@@ -0,0 +1,225 @@
+"""
+Materialized purchase history, one entry per buyer and item
+
+Purchases used to be spread over `user_purchases`, the legacy `purchases`
+collection, `orders` and `marketplace_items.sold`. Every write path that
+completes a purchase now records it here, so a buyer's history is a single
+indexed range read on (buyer_id, purchase_date).
+"""
+from datetime import datetime
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import DESCENDING, ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+from app.db import get_db
+from app.utils.ids import to_object_id, match_user_id, stringify_ids
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 100
+
+_indexes_ready = False
+
+def parse_purchase_date(value):
+    """Accept datetimes and ISO strings (as sent by the payment page); fall back to now"""
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, str) and value:
+        try:
+            parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+            # Stored dates are naive UTC like the rest of the database
+            if parsed.tzinfo is not None:
+                parsed = (parsed - parsed.utcoffset()).replace(tzinfo=None)
+            return parsed
+        except ValueError:
+            pass
+    return datetime.utcnow()
+
+class PurchaseHistory:
+    """
+    Read model of completed purchases
+    """
+
+    @staticmethod
+    def ensure_indexes(collection):
+        """Create the indexes behind buyer lookups and item de-duplication"""
+        collection.create_index([('buyer_id', 1), ('purchase_date', DESCENDING), ('_id', DESCENDING)])
+        collection.create_index(
+            [('buyer_id', 1), ('item_id', 1)],
+            unique=True,
+            partialFilterExpression={'item_id': {'$exists': True}}
+        )
+
+    @staticmethod
+    def collection():
+        global _indexes_ready
+        collection = get_db().purchase_history
+        if not _indexes_ready:
+            PurchaseHistory.ensure_indexes(collection)
+            _indexes_ready = True
+        return collection
+
+    @staticmethod
+    def build_upsert(buyer_id, item_id=None, source=None, purchase_date=None, **details):
+        """
+        Build the (filter, update) pair that records one purchase
+
+        Entries are keyed by buyer and item, so the same purchase reported by an
+        order, a "mark as sold" and a purchase record collapses into one entry.
+        Purchases without an item are always inserted.
+        """
+        buyer_id = to_object_id(buyer_id)
+        item_id = to_object_id(item_id) if item_id else None
+        fields = {key: value for key, value in details.items() if value is not None}
+        for key in ('seller_id', 'order_id'):
+            if key in fields:
+                fields[key] = to_object_id(fields[key])
+        fields['updated_at'] = datetime.utcnow()
+
+        if item_id is not None:
+            key = {'buyer_id': buyer_id, 'item_id': item_id}
+        else:
+            key = {'_id': ObjectId(), 'buyer_id': buyer_id}
+
+        update = {
+            '$set': fields,
+            '$min': {'purchase_date': parse_purchase_date(purchase_date)},
+            '$setOnInsert': {'created_at': datetime.utcnow()}
+        }
+        if source:
+            update['$addToSet'] = {'sources': source}
+        return key, update
+
+    @staticmethod
+    def upsert_operation(buyer_id, item_id=None, source=None, purchase_date=None, **details):
+        """The purchase as a bulk write operation, for backfills"""
+        key, update = PurchaseHistory.build_upsert(buyer_id, item_id, source, purchase_date, **details)
+        return UpdateOne(key, update, upsert=True)
+
+    @staticmethod
+    def record(buyer_id, item_id=None, source=None, purchase_date=None, **details):
+        """
+        Record a purchase for a buyer
+
+        Returns:
+            str: The ID of the history entry
+        """
+        collection = PurchaseHistory.collection()
+        key, update = PurchaseHistory.build_upsert(buyer_id, item_id, source, purchase_date, **details)
+        try:
+            entry = collection.find_one_and_update(
+                key, update, projection={'_id': 1}, upsert=True, return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            # A concurrent write inserted the same buyer/item entry first; update it instead
+            entry = collection.find_one_and_update(
+                key, update, projection={'_id': 1}, return_document=ReturnDocument.AFTER
+            )
+        return str(entry['_id']) if entry else None
+
+    @staticmethod
+    def entry_from_item(item, buyer_id, payment_method=None, purchase_date=None):
+        """Fields of a history entry for a marketplace item bought by `buyer_id`"""
+        images = item.get('images') or []
+        return {
+            'buyer_id': buyer_id,
+            'item_id': item.get('_id'),
+            'seller_id': item.get('user_id'),
+            'title': item.get('title'),
+            'description': item.get('description'),
+            'price': item.get('price'),
+            'images': images,
+            'image': images[0] if images else None,
+            'payment_method': payment_method,
+            'purchase_date': purchase_date
+        }
+
+    @staticmethod
+    def record_order(order_id, order, item=None):
+        """Record the purchase made by a new order"""
+        payment_info = order.get('payment_info')
+        details = PurchaseHistory.entry_from_item(item, order['buyer_id']) if item else {
+            'buyer_id': order['buyer_id'],
+            'item_id': order['item_id']
+        }
+        details.update({
+            'seller_id': order.get('seller_id'),
+            'order_id': order_id,
+            'price': order.get('total_amount', details.get('price')),
+            'payment_method': payment_info.get('paymentMethod') if isinstance(payment_info, dict) else None,
+            'purchase_date': order.get('created_at')
+        })
+        return PurchaseHistory.record(source='order', **details)
+
+    @staticmethod
+    def record_sold_item(item, buyer_id, payment_method=None):
+        """Record the purchase of an item that was marked as sold"""
+        details = PurchaseHistory.entry_from_item(item, buyer_id, payment_method, item.get('sold_date'))
+        return PurchaseHistory.record(source='sold', **details)
+
+    @staticmethod
+    def record_purchase(data):
+        """Record a purchase reported by the client after payment"""
+        details = {key: data.get(key) for key in (
+            'item_id', 'seller_id', 'title', 'description', 'price', 'images',
+            'payment_method', 'delivery_option', 'purchase_date'
+        )}
+        images = details.get('images') or []
+        details['image'] = images[0] if images else None
+        return PurchaseHistory.record(data['buyer_id'], source='purchase_record', **details)
+
+    @staticmethod
+    def encode_cursor(entry):
+        return f"{entry['purchase_date'].isoformat()}_{entry['_id']}"
+
+    @staticmethod
+    def decode_cursor(cursor):
+        """
+        Raises:
+            ValueError: If the cursor was not issued by encode_cursor
+        """
+        try:
+            purchase_date, entry_id = cursor.rsplit('_', 1)
+            return datetime.fromisoformat(purchase_date), ObjectId(entry_id)
+        except (ValueError, InvalidId):
+            raise ValueError('Invalid cursor')
+
+    @staticmethod
+    def get_for_buyer(buyer_id, limit=None, cursor=None):
+        """
+        Get a buyer's purchases, newest first
+
+        Without a limit or cursor the whole history is returned, as clients that
+        do not page expect; otherwise one page of at most MAX_PAGE_SIZE entries.
+
+        Args:
+            buyer_id: The buyer's user ID
+            limit: Page size (capped at MAX_PAGE_SIZE)
+            cursor: The cursor returned with the previous page, if any
+
+        Returns:
+            tuple: (list of serialized entries, cursor of the next page or None)
+
+        Raises:
+            ValueError: If the cursor is malformed
+        """
+        query = {'buyer_id': match_user_id(buyer_id)}
+        sort = [('purchase_date', DESCENDING), ('_id', DESCENDING)]
+        if not limit and not cursor:
+            entries = PurchaseHistory.collection().find(query).sort(sort)
+            return [stringify_ids(entry) for entry in entries], None
+
+        limit = max(1, min(int(limit or DEFAULT_PAGE_SIZE), MAX_PAGE_SIZE))
+        if cursor:
+            purchase_date, entry_id = PurchaseHistory.decode_cursor(cursor)
+            query['$or'] = [
+                {'purchase_date': {'$lt': purchase_date}},
+                {'purchase_date': purchase_date, '_id': {'$lt': entry_id}}
+            ]
+
+        entries = list(PurchaseHistory.collection().find(query).sort(sort).limit(limit + 1))
+        next_cursor = None
+        if len(entries) > limit:
+            entries = entries[:limit]
+            next_cursor = PurchaseHistory.encode_cursor(entries[-1])
+
+        return [stringify_ids(entry) for entry in entries], next_cursor
@@ -2,6 +2,7 @@ from datetime import datetime
 from bson import ObjectId
 from pymongo import MongoClient
 from flask import current_app
+from app.utils.carpool import carpool_matcher
 
 class Ride:
     def __init__(self):
@@ -41,6 +42,7 @@ class Ride:
             'updated_at': datetime.utcnow()
         }
         result = self.collection.insert_one(ride)
+        carpool_matcher.update_request(ride)
         return str(result.inserted_id)
 
     def get_ride(self, ride_id):
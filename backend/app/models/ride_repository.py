@@ -0,0 +1,264 @@
+"""
+Single store for ride offers
+
+Ride offers used to live in two collections: `share_rides`, written by the
+/api/ride endpoints, and `ride_posts`, written by the RideShare model and the
+ride-post routes, each with its own unindexed queries. Every ride now lives in
+`share_rides` and all reads and writes go through RideRepository, which
+creates the indexes its queries use and keeps the in-process views of the
+rides (location autocomplete, carpool matcher, seat push) in step with every
+write. Searches for bookable rides are served from the versioned
+ride_search_cache, which the same writes invalidate.
+
+The ride-post routes name a few fields differently (creator_id, creator_name,
+creator_email, contact_number). `from_post` maps them to the stored names on
+the way in and `as_post` adds them back on the way out, so those clients keep
+their response shape.
+
+Existing ride posts are moved over by the merge_ride_posts migration. Until it
+has run, a ride that is looked up or written by id and only exists in
+`ride_posts` is moved on the spot, so old posts stay bookable meanwhile.
+"""
+import threading
+from datetime import datetime
+from bson import ObjectId
+from pymongo import ReturnDocument
+from app.db import get_db
+from app.utils.ids import to_object_id, match_user_id
+from app.utils.seats import reserve_seats, release_seats
+from app.utils.locations import location_fields, add_location_filters, location_index
+from app.utils.geo import find_nearby_rides, ensure_geo_indexes, DEFAULT_RADIUS_M, DEFAULT_LIMIT
+from app.utils.carpool import carpool_matcher
+from app.utils.seat_updates import seat_updates
+from app.utils.ride_search_cache import ride_search_cache
+from app.utils.ride_expiry import departure_fields
+
+RIDES = 'share_rides'
+LEGACY_RIDES = 'ride_posts'
+FULL_STATUS = 'booked'
+OPEN_STATUS = 'active'
+
+# ride_posts field name -> stored field name
+POST_ALIASES = {
+    'creator_id': 'user_id',
+    'creator_name': 'user_name',
+    'creator_email': 'user_email',
+    'contact_number': 'phone_number',
+}
+
+INDEXES = [
+    ([('status', 1), ('date', 1), ('time', 1)], {}),
+    ([('user_id', 1), ('created_at', -1)], {}),
+    # Each token array gets its own index: a compound index cannot hold two multikey fields
+    ([('from_tokens', 1), ('status', 1)], {}),
+    ([('to_tokens', 1), ('status', 1)], {}),
+    # Change feed: every write stamps updated_at
+    ([('updated_at', 1)], {}),
+]
+
+_indexes_ready = False
+_indexes_lock = threading.Lock()
+
+def from_post(fields):
+    """Rename ride-post field names in a ride or an update to the stored names (in place)"""
+    for alias, name in POST_ALIASES.items():
+        if alias in fields:
+            value = fields.pop(alias)
+            fields.setdefault(name, value)
+    if 'user_id' in fields:
+        fields['user_id'] = to_object_id(fields['user_id'])
+    return fields
+
+def as_post(ride):
+    """Add the ride-post field names to a stored ride (in place)"""
+    for alias, name in POST_ALIASES.items():
+        if name in ride:
+            ride.setdefault(alias, ride[name])
+    return ride
+
+def touched(update=None):
+    """An update document that also stamps updated_at"""
+    update = dict(update or {})
+    update['$set'] = dict(update.get('$set', {}), updated_at=datetime.utcnow())
+    return update
+
+def legacy_ride(post):
+    """
+    A ride_posts document in the stored shape, with its derived fields filled in
+
+    The ride is stamped as updated now, so readers that follow changes by
+    updated_at (e.g. app.utils.ride_feed) pick it up in its new collection.
+    """
+    ride = from_post(dict(post))
+    ride['updated_at'] = datetime.utcnow()
+    if 'from_tokens' not in ride:
+        ride.update(location_fields(ride.get('from_location') or '', ride.get('to_location') or ''))
+    if 'departure_at' not in ride:
+        ride.update(departure_fields(ride.get('date'), ride.get('time')))
+    return ride
+
+
+class RideRepository:
+    """
+    Reads and writes of ride offers over the one rides collection
+    """
+
+    def __init__(self, db=None):
+        self._db = db
+
+    @property
+    def db(self):
+        return self._db if self._db is not None else get_db()
+
+    def collection(self):
+        """The rides collection, with its indexes created on first use"""
+        global _indexes_ready
+        collection = self.db[RIDES]
+        if not _indexes_ready:
+            with _indexes_lock:
+                if not _indexes_ready:
+                    for keys, options in INDEXES:
+                        collection.create_index(keys, **options)
+                    ensure_geo_indexes(collection)
+                    _indexes_ready = True
+        return collection
+
+    # Reads
+
+    def get(self, ride_id, projection=None):
+        """A ride by id, or None"""
+        return self._by_id(ride_id, lambda: self.collection().find_one({'_id': ObjectId(ride_id)}, projection))
+
+    def find(self, query=None, projection=None, sort=None, limit=0):
+        cursor = self.collection().find(query or {}, projection)
+        if sort:
+            cursor = cursor.sort(sort)
+        return list(cursor.limit(limit))
+
+    def find_active(self, from_location=None, to_location=None, date=None):
+        """Bookable rides, optionally on a date and matching from/to text, soonest first (cached)"""
+        query = {'status': OPEN_STATUS}
+        add_location_filters(query, from_location, to_location)
+        if date:
+            query['date'] = date
+        return ride_search_cache.get_or_load(
+            from_location, to_location, date, lambda: self.find(query, sort=[('date', 1), ('time', 1)])
+        )
+
+    def find_by_user(self, user_id):
+        """Rides offered by a user, newest first"""
+        return self.find({'user_id': match_user_id(user_id)}, sort=[('created_at', -1)])
+
+    def find_nearby(self, origin, destination, radius=DEFAULT_RADIUS_M, query=None, departure=None,
+                    limit=DEFAULT_LIMIT):
+        return find_nearby_rides(self.collection(), origin, destination, radius, query, departure, limit)
+
+    def count(self, query=None):
+        return self.collection().count_documents(query or {})
+
+    # Writes
+
+    def insert(self, ride):
+        """Store a new ride; returns its id"""
+        ride.setdefault('updated_at', datetime.utcnow())
+        ride['_id'] = self.collection().insert_one(ride).inserted_id
+        location_index.add_ride(ride)
+        self._changed(ride)
+        return ride['_id']
+
+    def update(self, ride_id, fields, query=None):
+        """
+        Set fields on a ride
+
+        The search tokens and `departure_at` are recomputed from changed
+        locations, date or time, so every edit path keeps them in step.
+
+        Returns:
+            dict: The ride with the new fields, or None if it did not match `query`
+        """
+        fields = dict(fields, updated_at=datetime.utcnow())
+        fields.update(location_fields(fields.get('from_location'), fields.get('to_location')))
+        if 'date' in fields or 'time' in fields:
+            current = fields
+            if 'date' not in fields or 'time' not in fields:
+                current = dict(self.get(ride_id, {'date': 1, 'time': 1}) or {}, **fields)
+            fields.update(departure_fields(current.get('date'), current.get('time')))
+        ride_query = dict(query or {}, _id=ObjectId(ride_id))
+        before = self._by_id(ride_id, lambda: self.collection().find_one_and_update(
+            ride_query, {'$set': fields}, return_document=ReturnDocument.BEFORE
+        ))
+        if before is None:
+            return None
+        ride = dict(before, **fields)
+        if 'from_location' in fields or 'to_location' in fields:
+            location_index.remove_ride(before)
+            location_index.add_ride(ride)
+        # The old date's results lose the ride; _changed refreshes the new date's
+        ride_search_cache.invalidate(before.get('date'))
+        self._changed(ride)
+        return ride
+
+    def delete(self, ride_id, query=None):
+        """Delete a ride; returns the deleted ride, or None if it did not match `query`"""
+        ride_query = dict(query or {}, _id=ObjectId(ride_id))
+        ride = self._by_id(ride_id, lambda: self.collection().find_one_and_delete(ride_query))
+        if ride:
+            location_index.remove_ride(ride)
+            carpool_matcher.remove(ride['_id'])
+            ride_search_cache.invalidate(ride.get('date'))
+            seat_updates.publish(ride, deleted=True)
+        return ride
+
+    def reserve(self, ride_id, seats, query=None, update=None):
+        """Take seats atomically (see reserve_seats); a ride that fills up becomes booked"""
+        ride = self._by_id(ride_id, lambda: reserve_seats(
+            self.collection(), ObjectId(ride_id), seats, query, touched(update), full_status=FULL_STATUS
+        ))
+        if ride:
+            self._changed(ride)
+        return ride
+
+    def release(self, ride_id, seats, update=None, array_filters=None):
+        """Give seats back (see release_seats), reopening a booked ride"""
+        ride = self._by_id(ride_id, lambda: release_seats(
+            self.collection(), ObjectId(ride_id), seats, touched(update),
+            full_status=FULL_STATUS, open_status=OPEN_STATUS, array_filters=array_filters
+        ))
+        if ride:
+            self._changed(ride)
+        return ride
+
+    # Compatibility with ride_posts
+
+    def adopt_legacy(self, ride_id):
+        """
+        Move one ride from ride_posts into the rides collection
+
+        The copy is an upsert that never overwrites, and the original is only
+        deleted afterwards, so concurrent or repeated calls are harmless.
+
+        Returns:
+            bool: True if the ride was found in ride_posts
+        """
+        legacy = self.db[LEGACY_RIDES]
+        post = legacy.find_one({'_id': ObjectId(ride_id)})
+        if post is None:
+            return False
+        ride = legacy_ride(post)
+        del ride['_id']
+        self.collection().update_one({'_id': post['_id']}, {'$setOnInsert': ride}, upsert=True)
+        legacy.delete_one({'_id': post['_id']})
+        ride_search_cache.invalidate(ride.get('date'))
+        return True
+
+    def _by_id(self, ride_id, operation):
+        """Run a by-id operation, retrying once if the ride first had to be moved from ride_posts"""
+        result = operation()
+        if result is None and self.adopt_legacy(ride_id):
+            result = operation()
+        return result
+
+    def _changed(self, ride):
+        ride_search_cache.invalidate(ride.get('date'))
+        carpool_matcher.update_offer(ride)
+        seat_updates.publish(ride)
@@ -0,0 +1,100 @@
+"""
+Ride requests: students looking for a ride on a route, date and time
+
+Requests are stored in the `rides` collection with type 'request' (the shape
+the old ride request model used, with the date as a local-midnight datetime).
+While a request is active it is on the request side of the carpool matcher;
+cancelling or matching it here, or its expiry in the ride sweep, takes it
+off again.
+"""
+from datetime import datetime
+from bson import ObjectId
+from app.utils.carpool import carpool_matcher
+from app.utils.geo import departure_datetime
+from app.utils.ids import to_object_id, match_user_id, stringify_ids
+
+OPEN_STATUS = 'active'
+CLOSED_STATUSES = ('cancelled', 'matched')
+REQUIRED_FIELDS = ('pickup_location', 'dropoff_location', 'date', 'time', 'needed_seats', 'contact_info')
+
+def serialize_request(ride):
+    """A request for JSON responses"""
+    stringify_ids(ride)
+    if isinstance(ride.get('date'), datetime):
+        ride['date'] = ride['date'].strftime('%Y-%m-%d')
+    return ride
+
+class RideRequest:
+    """
+    Ride requests: active -> cancelled / matched, or expired by the sweep
+    """
+
+    @staticmethod
+    def create(db, user_id, data):
+        """
+        Store a new request and add it to the carpool matcher
+
+        Returns:
+            dict: The stored request
+
+        Raises:
+            ValueError: If a field is missing or malformed
+        """
+        for field in REQUIRED_FIELDS:
+            if not data.get(field):
+                raise ValueError(f'Missing required field: {field}')
+        if departure_datetime(data['date'], data['time']) is None:
+            raise ValueError('Date and time must be YYYY-MM-DD and HH:MM')
+        try:
+            needed_seats = int(data['needed_seats'])
+        except (TypeError, ValueError):
+            needed_seats = 0
+        if needed_seats < 1:
+            raise ValueError('needed_seats must be a positive number')
+
+        user = db.users.find_one({'_id': to_object_id(user_id)}, {'name': 1})
+        ride = {
+            'type': 'request',
+            'user_id': to_object_id(user_id),
+            'user_name': user.get('name', 'Unknown User') if user else 'Unknown User',
+            'pickup_location': data['pickup_location'],
+            'dropoff_location': data['dropoff_location'],
+            'date': datetime.strptime(data['date'], '%Y-%m-%d'),
+            'time': data['time'],
+            'needed_seats': needed_seats,
+            'contact_info': data['contact_info'],
+            'status': OPEN_STATUS,
+            'created_at': datetime.utcnow(),
+            'updated_at': datetime.utcnow()
+        }
+        ride['_id'] = db.rides.insert_one(ride).inserted_id
+        carpool_matcher.update_request(ride)
+        return ride
+
+    @staticmethod
+    def close(db, request_id, user_id, status):
+        """
+        Close an active request of `user_id` as cancelled or matched
+
+        Returns:
+            bool: Whether the request was active and is now closed
+        """
+        if status not in CLOSED_STATUSES:
+            raise ValueError('Status must be cancelled or matched')
+        if not ObjectId.is_valid(request_id):
+            return False
+        result = db.rides.update_one(
+            {'_id': ObjectId(request_id), 'type': 'request', 'user_id': match_user_id(user_id),
+             'status': OPEN_STATUS},
+            {'$set': {'status': status, 'closed_at': datetime.utcnow(), 'updated_at': datetime.utcnow()}}
+        )
+        if not result.modified_count:
+            return False
+        carpool_matcher.remove(request_id)
+        return True
+
+    @staticmethod
+    def for_user(db, user_id):
+        """A user's requests, newest first"""
+        requests = db.rides.find({'type': 'request', 'user_id': match_user_id(user_id)}).sort('created_at', -1)
+        return [serialize_request(ride) for ride in requests]
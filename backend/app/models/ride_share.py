@@ -1,9 +1,26 @@
 """
 Database schema for Ride Share system
+
+Ride posts are stored with every other ride offer through RideRepository;
+this model keeps the ride-post field names (creator_id, contact_number, ...)
+for its callers.
 """
 from datetime import datetime
 from bson import ObjectId
 from app.db import get_db
+from app.utils.ids import to_object_id, match_user_id, user_id_forms, same_user, stringify_ids
+from app.utils.locations import location_fields
+from app.utils.geo import to_point, DEFAULT_RADIUS_M
+from app.utils.ride_expiry import departure_fields
+from app.utils.bookings import ride_snapshot
+from app.models.ride_repository import RideRepository, as_post, from_post
+from app.models.ride_waitlist import RideWaitlist
+
+def serialize_posts(rides):
+    """Ride posts as returned to clients: ride-post field names and string ids"""
+    for ride in rides:
+        stringify_ids(as_post(ride))
+    return rides
 
 class RideShare:
     """
@@ -13,15 +30,16 @@ class RideShare:
     @staticmethod
     def create_ride_post(user_id, user_email, user_name, from_location, to_location, 
                          date, time, seats_available, description=None, is_paid=False, 
-                         fee_per_seat=0, payment_method=None, contact_number=None):
+                         fee_per_seat=0, payment_method=None, contact_number=None,
+                         from_coordinates=None, to_coordinates=None):
         """
         Create a new ride share post
         """
-        db = get_db()
+        user_id = to_object_id(user_id)
         ride_post = {
-            "creator_id": user_id,
-            "creator_email": user_email,
-            "creator_name": user_name,
+            "user_id": user_id,
+            "user_email": user_email,
+            "user_name": user_name,
             "from_location": from_location,
             "to_location": to_location,
             "date": date,
@@ -31,46 +49,50 @@ class RideShare:
             "is_paid": is_paid,
             "fee_per_seat": fee_per_seat if is_paid else 0,
             "payment_method": payment_method if is_paid else None,
-            "contact_number": contact_number,
+            "phone_number": contact_number,
             "status": "active",
             "created_at": datetime.utcnow(),
             "updated_at": datetime.utcnow()
         }
-        
-        result = db.ride_posts.insert_one(ride_post)
-        return str(result.inserted_id)
+        ride_post.update(location_fields(from_location, to_location))
+        ride_post.update(departure_fields(date, time))
+        if from_coordinates:
+            ride_post["from_point"] = to_point(from_coordinates)
+        if to_coordinates:
+            ride_post["to_point"] = to_point(to_coordinates)
+        
+        return str(RideRepository().insert(ride_post))
     
     @staticmethod
     def get_all_rides(filters=None):
         """
         Get all available rides with optional filtering
         """
-        db = get_db()
+        filters = filters or {}
+        # Token match on the normalized locations stored at write time
+        rides = RideRepository().find_active(filters.get('from'), filters.get('to'), filters.get('date'))
+        return serialize_posts(rides)
+
+    @staticmethod
+    def get_nearby_rides(from_coordinates, to_coordinates, radius=DEFAULT_RADIUS_M, date=None, departure=None):
+        """
+        Get active rides starting near `from_coordinates` and ending near
+        `to_coordinates`, best match first
+        """
         query = {"status": "active"}
-        
-        if filters:
-            if filters.get('from'):
-                query['from_location'] = {"$regex": filters['from'], "$options": 'i'}
-            if filters.get('to'):
-                query['to_location'] = {"$regex": filters['to'], "$options": 'i'}
-            if filters.get('date'):
-                query['date'] = filters['date']
-        
-        rides = list(db.ride_posts.find(query))
-        for ride in rides:
-            ride['_id'] = str(ride['_id'])
-        return rides
+        if date:
+            query["date"] = date
+        rides = RideRepository().find_nearby(
+            to_point(from_coordinates), to_point(to_coordinates), radius, query, departure
+        )
+        return serialize_posts(rides)
 
     @staticmethod
     def get_my_rides(user_id):
         """
         Get rides posted by a specific user
         """
-        db = get_db()
-        rides = list(db.ride_posts.find({"creator_id": user_id}))
-        for ride in rides:
-            ride['_id'] = str(ride['_id'])
-        return rides
+        return serialize_posts(RideRepository().find_by_user(user_id))
 
     @staticmethod
     def book_ride(ride_id, user_id, user_email, user_name, seats):
@@ -78,13 +100,15 @@ class RideShare:
         Book a ride
         """
         db = get_db()
-        ride = db.ride_posts.find_one({"_id": ObjectId(ride_id)})
+        rides = RideRepository(db)
+        user_id = to_object_id(user_id)
+        ride = rides.reserve(ride_id, seats, update={"$set": {"updated_at": datetime.utcnow()}})
         
         if not ride:
-            raise ValueError("Ride not found")
-            
-        if ride['seats_available'] < seats:
+            if not rides.get(ride_id, {"_id": 1}):
+                raise ValueError("Ride not found")
             raise ValueError("Not enough seats available")
+        as_post(ride)
             
         booking = {
             "ride_id": ride_id,
@@ -97,21 +121,21 @@ class RideShare:
             "time": ride['time'],
             "from_location": ride['from_location'],
             "to_location": ride['to_location'],
-            "creator_id": ride['creator_id'],
+            "creator_id": to_object_id(ride['creator_id']),
             "fee_per_seat": ride['fee_per_seat'],
             "payment_method": ride['payment_method'],
             "contact_number": ride['contact_number'],
             "created_at": datetime.utcnow()
         }
         
-        # Update available seats
-        db.ride_posts.update_one(
-            {"_id": ObjectId(ride_id)},
-            {"$inc": {"seats_available": -seats}}
-        )
-        
-        result = db.bookings.insert_one(booking)
-        booking["_id"] = str(result.inserted_id)
+        try:
+            result = db.bookings.insert_one(booking)
+        except Exception:
+            # Compensate: the booking was not stored, so give the seats back
+            rides.release(ride_id, seats)
+            raise
+        booking["_id"] = result.inserted_id
+        stringify_ids(booking)
         
         return {
             "booking": booking,
@@ -127,9 +151,10 @@ class RideShare:
         Get bookings made by a specific user
         """
         db = get_db()
-        bookings = list(db.bookings.find({"user_id": user_id}))
+        user_id = to_object_id(user_id)
+        bookings = list(db.bookings.find({"user_id": match_user_id(user_id)}))
         for booking in bookings:
-            booking['_id'] = str(booking['_id'])
+            stringify_ids(booking)
         return bookings
 
     @staticmethod
@@ -138,20 +163,10 @@ class RideShare:
         Cancel a booking
         """
         db = get_db()
-        booking = db.bookings.find_one({"_id": ObjectId(booking_id), "user_id": user_id})
-        
-        if not booking:
-            raise ValueError("Booking not found or unauthorized")
-            
-        # Return seats to ride post
-        db.ride_posts.update_one(
-            {"_id": ObjectId(booking['ride_id'])},
-            {"$inc": {"seats_available": booking['seats']}}
-        )
-        
-        # Update booking status
-        db.bookings.update_one(
-            {"_id": ObjectId(booking_id)},
+        user_id = to_object_id(user_id)
+        # Flip the status first; only the request that wins it returns the seats
+        booking = db.bookings.find_one_and_update(
+            {"_id": ObjectId(booking_id), "user_id": match_user_id(user_id), "status": {"$ne": "cancelled"}},
             {"$set": {
                 "status": "cancelled",
                 "cancel_reason": reason,
@@ -159,6 +174,16 @@ class RideShare:
             }}
         )
         
+        if not booking:
+            raise ValueError("Booking not found or unauthorized")
+            
+        # Return seats to ride post and hand them to the waitlist
+        RideRepository(db).release(booking['ride_id'], booking['seats'])
+        try:
+            RideWaitlist.promote(db, booking['ride_id'])
+        except Exception as e:
+            print(f"Error promoting waitlist: {str(e)}")
+        
         return True
 
     @staticmethod
@@ -166,19 +191,18 @@ class RideShare:
         """
         Delete a ride post
         """
-        db = get_db()
-        result = db.ride_posts.delete_one({"_id": ObjectId(ride_id), "creator_id": user_id})
-        if result.deleted_count == 0:
+        ride = RideRepository().delete(ride_id, {"user_id": match_user_id(user_id)})
+        if not ride:
             raise ValueError("Ride not found or unauthorized")
         return True
-            
-        ride_posts = list(db.ride_posts.find(query).sort("created_at", -1))
-        
-        # Convert ObjectId to string for JSON serialization
-        for post in ride_posts:
-            post['_id'] = str(post['_id'])
-            
-        return ride_posts
+
+    @staticmethod
+    def get_all_ride_posts(query=None):
+        """
+        Get ride posts matching a raw query, newest first
+        """
+        ride_posts = RideRepository().find(from_post(dict(query or {})), sort=[("created_at", -1)])
+        return serialize_posts(ride_posts)
     
     @staticmethod
     def book_ride(ride_id, user_id, user_email, user_name):
@@ -186,20 +210,7 @@ class RideShare:
         Book a ride
         """
         db = get_db()
-        ride_post = db.ride_posts.find_one({"_id": ObjectId(ride_id)})
-        
-        if not ride_post:
-            return None, "Ride post not found"
-        
-        if ride_post['user_id'] == user_id:
-            return None, "You cannot book your own ride"
-        
-        if ride_post['seats_available'] <= 0:
-            return None, "No seats available"
-        
-        if any(booking['user_id'] == user_id for booking in ride_post['booked_by']):
-            return None, "You have already booked this ride"
-        
+        user_id = to_object_id(user_id)
         booking = {
             "user_id": user_id,
             "user_email": user_email,
@@ -208,33 +219,44 @@ class RideShare:
             "status": "pending"
         }
         
-        # Update the ride post
-        result = db.ride_posts.update_one(
-            {"_id": ObjectId(ride_id)},
-            {
-                "$push": {"booked_by": booking},
-                "$inc": {"seats_available": -1},
-                "$set": {"updated_at": datetime.utcnow()}
-            }
+        # Take the seat and register the passenger in one conditional write
+        rides = RideRepository(db)
+        ride_post = rides.reserve(
+            ride_id,
+            1,
+            query={"user_id": {"$nin": user_id_forms(user_id)}, "booked_by.user_id": {"$nin": user_id_forms(user_id)}},
+            update={"$push": {"booked_by": booking}, "$set": {"updated_at": datetime.utcnow()}}
         )
         
-        if result.modified_count > 0:
-            # Also create a booking record
-            booking_record = {
-                "ride_id": ride_id,
-                "ride_details": ride_post,
-                "user_id": user_id,
-                "user_email": user_email,
-                "user_name": user_name,
-                "booking_date": datetime.utcnow(),
-                "status": "pending",
-                "cancellation_reason": None
-            }
+        if not ride_post:
+            ride_post = rides.get(ride_id)
+            if not ride_post:
+                return None, "Ride post not found"
+            if same_user(ride_post.get('user_id'), user_id):
+                return None, "You cannot book your own ride"
+            if any(same_user(booked['user_id'], user_id) for booked in ride_post.get('booked_by', [])):
+                return None, "You have already booked this ride"
+            return None, "No seats available"
+        
+        # Also create a booking record
+        booking_record = {
+            "ride_id": ride_id,
+            "ride_details": ride_snapshot(as_post(ride_post)),
+            "user_id": user_id,
+            "user_email": user_email,
+            "user_name": user_name,
+            "booking_date": datetime.utcnow(),
+            "status": "pending",
+            "cancellation_reason": None
+        }
+        try:
             db.bookings.insert_one(booking_record)
-            
-            return True, "Ride booked successfully"
+        except Exception:
+            # Compensate: undo the reservation and the passenger entry
+            rides.release(ride_id, 1, update={"$pull": {"booked_by": {"user_id": user_id}}})
+            return None, "Booking failed"
         
-        return None, "Booking failed"
+        return True, "Ride booked successfully"
     
     @staticmethod
     def cancel_booking(booking_id, user_id, cancellation_reason):
@@ -242,14 +264,13 @@ class RideShare:
         Cancel a booking
         """
         db = get_db()
-        booking = db.bookings.find_one({"_id": ObjectId(booking_id), "user_id": user_id})
-        
-        if not booking:
+        user_id = to_object_id(user_id)
+        if not db.bookings.find_one({"_id": ObjectId(booking_id), "user_id": match_user_id(user_id)}, {"_id": 1}):
             return None, "Booking not found or you don't have permission"
         
-        # Update booking status
-        result = db.bookings.update_one(
-            {"_id": ObjectId(booking_id)},
+        # Update booking status; the status guard makes sure the seat is returned only once
+        booking = db.bookings.find_one_and_update(
+            {"_id": ObjectId(booking_id), "user_id": match_user_id(user_id), "status": {"$ne": "cancelled"}},
             {
                 "$set": {
                     "status": "cancelled",
@@ -259,19 +280,21 @@ class RideShare:
             }
         )
         
-        if result.modified_count > 0:
+        if booking:
             # Update the ride post to increase available seats
-            db.ride_posts.update_one(
-                {"_id": ObjectId(booking["ride_id"])},
-                {
-                    "$inc": {"seats_available": 1},
-                    "$set": {
-                        "booked_by.$[elem].status": "cancelled",
-                        "updated_at": datetime.utcnow()
-                    }
-                },
-                array_filters=[{"elem.user_id": user_id}]
+            RideRepository(db).release(
+                booking["ride_id"],
+                1,
+                update={"$set": {
+                    "booked_by.$[elem].status": "cancelled",
+                    "updated_at": datetime.utcnow()
+                }},
+                array_filters=[{"elem.user_id": match_user_id(user_id)}]
             )
+            try:
+                RideWaitlist.promote(db, booking["ride_id"])
+            except Exception as e:
+                print(f"Error promoting waitlist: {str(e)}")
             
             return True, "Booking cancelled successfully"
         
@@ -283,11 +306,12 @@ class RideShare:
         Get bookings made by a specific user
         """
         db = get_db()
-        bookings = list(db.bookings.find({"user_id": user_id}).sort("booking_date", -1))
+        user_id = to_object_id(user_id)
+        bookings = list(db.bookings.find({"user_id": match_user_id(user_id)}).sort("booking_date", -1))
         
         # Convert ObjectId to string for JSON serialization
         for booking in bookings:
-            booking['_id'] = str(booking['_id'])
+            stringify_ids(booking)
             
         return bookings
     
@@ -296,36 +320,28 @@ class RideShare:
         """
         Get ride posts created by a specific user
         """
-        db = get_db()
-        ride_posts = list(db.ride_posts.find({"user_id": user_id}).sort("created_at", -1))
-        
-        # Convert ObjectId to string for JSON serialization
-        for post in ride_posts:
-            post['_id'] = str(post['_id'])
-            
-        return ride_posts
+        return serialize_posts(RideRepository().find_by_user(user_id))
     
     @staticmethod
     def delete_ride_post(ride_id, user_id):
         """
         Delete a ride post
         """
-        db = get_db()
-        ride_post = db.ride_posts.find_one({"_id": ObjectId(ride_id)})
+        rides = RideRepository()
+        user_id = to_object_id(user_id)
+        ride_post = rides.get(ride_id)
         
         if not ride_post:
             return None, "Ride post not found"
         
-        if ride_post['user_id'] != user_id:
+        if not same_user(ride_post['user_id'], user_id):
             return None, "You don't have permission to delete this post"
         
         # Check if anyone has booked this ride
-        if ride_post['booked_by'] and any(booking['status'] == 'pending' for booking in ride_post['booked_by']):
+        if ride_post.get('booked_by') and any(booking['status'] == 'pending' for booking in ride_post['booked_by']):
             return None, "Cannot delete ride with active bookings"
         
-        result = db.ride_posts.delete_one({"_id": ObjectId(ride_id), "user_id": user_id})
-        
-        if result.deleted_count > 0:
+        if rides.delete(ride_id, {"user_id": match_user_id(user_id)}):
             return True, "Ride post deleted successfully"
         
         return None, "Deletion failed"
@@ -335,13 +351,14 @@ class RideShare:
         """
         Update a ride post
         """
-        db = get_db()
-        ride_post = db.ride_posts.find_one({"_id": ObjectId(ride_id)})
+        rides = RideRepository()
+        user_id = to_object_id(user_id)
+        ride_post = rides.get(ride_id)
         
         if not ride_post:
             return None, "Ride post not found"
         
-        if ride_post['user_id'] != user_id:
+        if not same_user(ride_post['user_id'], user_id):
             return None, "You don't have permission to update this post"
         
         # Don't allow updating if already fully booked
@@ -349,14 +366,10 @@ class RideShare:
             return None, "Cannot update a fully booked ride"
         
         # Add updated timestamp
+        from_post(updates)
         updates['updated_at'] = datetime.utcnow()
         
-        result = db.ride_posts.update_one(
-            {"_id": ObjectId(ride_id), "user_id": user_id},
-            {"$set": updates}
-        )
-        
-        if result.modified_count > 0:
+        if rides.update(ride_id, updates, {"user_id": match_user_id(user_id)}):
             return True, "Ride post updated successfully"
         
         return None, "Update failed"
@@ -0,0 +1,214 @@
+"""
+FIFO waitlist for full share rides
+
+Students join the waitlist of a ride instead of polling it. When a
+cancellation frees seats, `promote` hands them to the oldest waiting entries:
+each entry is claimed with a conditional update so only one request can
+promote it, the seats are taken with the same atomic reservation as a normal
+booking, and the new booking is pushed to the user's Socket.IO room. Entries left in `promoting`
+by a promotion that died midway are recovered by the ride sweep.
+"""
+import os
+from datetime import datetime, timedelta
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from app.db import get_db
+from app.extensions import socketio
+from app.utils.bookings import new_share_booking
+from app.utils.ids import to_object_id, stringify_ids
+from app.models.ride_repository import RideRepository
+
+# A promotion takes milliseconds; entries claimed longer ago than this were abandoned
+PROMOTING_TIMEOUT = timedelta(seconds=int(os.environ.get('WAITLIST_PROMOTING_TIMEOUT_SECONDS', 300)))
+
+_indexes_ready = False
+
+class RideWaitlist:
+    """
+    Waitlist entries: waiting -> promoting -> promoted, or left / expired
+    """
+
+    @staticmethod
+    def collection():
+        global _indexes_ready
+        collection = get_db().ride_waitlist
+        if not _indexes_ready:
+            collection.create_index([('ride_id', 1), ('status', 1), ('created_at', 1), ('_id', 1)])
+            # One waiting entry per user and ride
+            collection.create_index(
+                [('ride_id', 1), ('user_id', 1)],
+                unique=True,
+                partialFilterExpression={'status': 'waiting'}
+            )
+            _indexes_ready = True
+        return collection
+
+    @staticmethod
+    def join(ride_id, user_id, seats=1):
+        """
+        Add a user to the end of a ride's waitlist
+
+        Returns:
+            dict: The entry with its 1-based `position`
+
+        Raises:
+            ValueError: If the user is already waiting for this ride
+        """
+        entry = {
+            'ride_id': ObjectId(ride_id),
+            'user_id': to_object_id(user_id),
+            'seats': seats,
+            'status': 'waiting',
+            'created_at': datetime.utcnow()
+        }
+        try:
+            RideWaitlist.collection().insert_one(entry)
+        except DuplicateKeyError:
+            raise ValueError('You are already on the waitlist for this ride')
+        entry['position'] = RideWaitlist.position(entry)
+        return stringify_ids(entry)
+
+    @staticmethod
+    def leave(ride_id, user_id, status='left'):
+        """Take a user off a ride's waitlist; returns True if they were waiting"""
+        result = RideWaitlist.collection().update_one(
+            {'ride_id': ObjectId(ride_id), 'user_id': to_object_id(user_id), 'status': 'waiting'},
+            {'$set': {'status': status, 'updated_at': datetime.utcnow()}}
+        )
+        return result.modified_count > 0
+
+    @staticmethod
+    def get_entry(ride_id, user_id):
+        """The user's waiting entry for a ride with its position, or None"""
+        entry = RideWaitlist.collection().find_one(
+            {'ride_id': ObjectId(ride_id), 'user_id': to_object_id(user_id), 'status': 'waiting'}
+        )
+        if not entry:
+            return None
+        entry['position'] = RideWaitlist.position(entry)
+        return stringify_ids(entry)
+
+    @staticmethod
+    def position(entry):
+        """1-based place of a waiting entry in its ride's queue"""
+        ahead = RideWaitlist.collection().count_documents({
+            'ride_id': entry['ride_id'],
+            'status': 'waiting',
+            '$or': [
+                {'created_at': {'$lt': entry['created_at']}},
+                {'created_at': entry['created_at'], '_id': {'$lt': entry['_id']}}
+            ]
+        })
+        return ahead + 1
+
+    @staticmethod
+    def promote(db, ride_id):
+        """
+        Give freed seats on a ride to the waitlist, oldest entry first
+
+        Stops at the first entry whose seats cannot be reserved, so a large
+        request at the head of the queue is not overtaken.
+
+        Args:
+            db: The database holding the rides and bookings
+            ride_id: The ride that got seats back
+
+        Returns:
+            list: (booking, ride) pairs created for promoted users
+        """
+        waitlist = RideWaitlist.collection()
+        rides = RideRepository(db)
+        ride_id = ObjectId(ride_id)
+        promoted = []
+        while True:
+            # Claim the head of the queue; concurrent promotions claim different entries
+            entry = waitlist.find_one_and_update(
+                {'ride_id': ride_id, 'status': 'waiting'},
+                {'$set': {'status': 'promoting', 'updated_at': datetime.utcnow()}},
+                sort=[('created_at', 1), ('_id', 1)],
+                return_document=ReturnDocument.AFTER
+            )
+            if not entry:
+                return promoted
+
+            ride = rides.reserve(ride_id, entry['seats'], query={'status': 'active'})
+            if not ride:
+                # Not enough seats for the head of the queue; put it back in place
+                RideWaitlist.requeue(waitlist, entry)
+                return promoted
+
+            try:
+                booking = new_share_booking(db, ride, entry['user_id'], entry['seats'])
+                booking['from_waitlist'] = True
+                booking['_id'] = db.bookings.insert_one(booking).inserted_id
+            except Exception:
+                rides.release(ride_id, entry['seats'])
+                RideWaitlist.requeue(waitlist, entry)
+                raise
+
+            waitlist.update_one(
+                {'_id': entry['_id']},
+                {'$set': {'status': 'promoted', 'booking_id': booking['_id'], 'updated_at': datetime.utcnow()}}
+            )
+            RideWaitlist.notify_promoted(booking)
+            promoted.append((booking, ride))
+
+    @staticmethod
+    def requeue(waitlist, entry):
+        """
+        Put a claimed entry back in its place in the queue
+
+        If the user joined the same ride again meanwhile, the newer entry is the
+        one that stays and this one is marked `left`.
+        """
+        try:
+            waitlist.update_one(
+                {'_id': entry['_id'], 'status': 'promoting'},
+                {'$set': {'status': 'waiting', 'updated_at': datetime.utcnow()}}
+            )
+        except DuplicateKeyError:
+            waitlist.update_one(
+                {'_id': entry['_id'], 'status': 'promoting'},
+                {'$set': {'status': 'left', 'updated_at': datetime.utcnow()}}
+            )
+
+    @staticmethod
+    def recover_stale(db, now=None):
+        """
+        Settle entries a promotion claimed but never finished
+
+        An entry whose booking was written is marked promoted; any other goes
+        back to the queue.
+
+        Returns:
+            int: Number of entries settled
+        """
+        now = now or datetime.utcnow()
+        waitlist = db.ride_waitlist
+        stale = list(waitlist.find(
+            {'status': 'promoting', 'updated_at': {'$lt': now - PROMOTING_TIMEOUT}}
+        ))
+        for entry in stale:
+            booking = db.bookings.find_one({
+                'ride_id': str(entry['ride_id']),
+                'user_id': entry['user_id'],
+                'from_waitlist': True,
+                'created_at': {'$gte': entry['updated_at']}
+            }, {'_id': 1})
+            if booking:
+                waitlist.update_one(
+                    {'_id': entry['_id'], 'status': 'promoting'},
+                    {'$set': {'status': 'promoted', 'booking_id': booking['_id'], 'updated_at': now}}
+                )
+            else:
+                RideWaitlist.requeue(waitlist, entry)
+        return len(stale)
+
+    @staticmethod
+    def notify_promoted(booking):
+        """Push the new booking to the promoted user's room"""
+        payload = stringify_ids(dict(booking, ride=stringify_ids(dict(booking['ride']))))
+        payload['created_at'] = payload['created_at'].isoformat()
+        payload['updated_at'] = payload['updated_at'].isoformat()
+        socketio.emit('waitlist_promoted', payload, room=payload['user_id'])
@@ -0,0 +1,41 @@
+"""
+API routes for carpool matching
+"""
+from flask import Blueprint, request, jsonify
+from flask_jwt_extended import jwt_required
+from app.db import get_db
+from app.utils.carpool import carpool_matcher, DEFAULT_WINDOW_MINUTES, MAX_WINDOW_MINUTES
+
+carpool_bp = Blueprint('carpool', __name__)
+
+def get_window():
+    window = request.args.get('window', DEFAULT_WINDOW_MINUTES, type=int)
+    return max(1, min(window, MAX_WINDOW_MINUTES))
+
+@carpool_bp.route('/groups', methods=['GET'])
+@jwt_required()
+def get_carpool_groups():
+    """Proposed carpool groups for a date, optionally for one from/to route"""
+    date = request.args.get('date')
+    if not date:
+        return jsonify({'error': 'Missing date'}), 400
+
+    try:
+        groups = carpool_matcher.groups(
+            get_db(), date, request.args.get('from'), request.args.get('to'), get_window()
+        )
+        return jsonify(groups), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@carpool_bp.route('/matches/<ride_id>', methods=['GET'])
+@jwt_required()
+def get_carpool_matches(ride_id):
+    """Offers and requests on the same route leaving close to a given ride or request"""
+    try:
+        entry, matches = carpool_matcher.matches_for(get_db(), ride_id, get_window())
+        if entry is None:
+            return jsonify({'error': 'Ride not found or not active'}), 404
+        return jsonify({'ride': entry, 'matches': matches}), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
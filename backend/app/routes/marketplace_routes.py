@@ -2,8 +2,10 @@ from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from ..models.order import Order
 from ..models.message import Message
+from ..models.purchase_history import PurchaseHistory
 from bson import ObjectId
 from .. import limiter
+from ..utils.ids import to_object_id, match_user_id
 import datetime
 
 # Import the marketplace controller functions
@@ -89,7 +91,7 @@ def mark_item_as_sold(item_id):
     try:
         user_id = get_jwt_identity()
         data = request.get_json()
-        buyer_id = data.get('buyer_id')
+        buyer_id = to_object_id(data.get('buyer_id'))
         payment_info = data.get('payment_info', {})
         
         # Get the item from database
@@ -108,32 +110,22 @@ def mark_item_as_sold(item_id):
             return jsonify({'error': 'Item not found'}), 404
             
         # Update the item to mark as sold
+        sold_fields = {
+            'sold': True,
+            'buyer_id': buyer_id,
+            'sold_date': datetime.datetime.utcnow(),
+            'payment_info': payment_info
+        }
         result = db.marketplace_items.update_one(
             {'_id': item_obj_id},
-            {'$set': {
-                'sold': True,
-                'buyer_id': buyer_id,
-                'sold_date': datetime.datetime.utcnow(),
-                'payment_info': payment_info
-            }}
+            {'$set': sold_fields}
         )
         
         if result.modified_count > 0:
-            # Create a purchase record
-            purchase_data = {
-                'item_id': item_id,
-                'buyer_id': buyer_id,
-                'seller_id': str(item.get('user_id')),
-                'price': item.get('price'),
-                'title': item.get('title'),
-                'description': item.get('description'),
-                'images': item.get('images', []),
-                'payment_method': payment_info.get('paymentMethod', 'unknown'),
-                'purchase_date': datetime.datetime.utcnow()
-            }
-            
-            # Insert purchase record
-            db.user_purchases.insert_one(purchase_data)
+            # Record the purchase in the buyer's history
+            item.update(sold_fields)
+            if buyer_id:
+                PurchaseHistory.record_sold_item(item, buyer_id, payment_info.get('paymentMethod', 'unknown'))
             
             return jsonify({
                 'success': True,
@@ -146,6 +138,21 @@ def mark_item_as_sold(item_id):
         print(f"Error marking item as sold: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+def purchase_history_response(user_id):
+    """A buyer's purchase history; when paged, the next page's cursor is in X-Next-Cursor"""
+    try:
+        purchases, next_cursor = PurchaseHistory.get_for_buyer(
+            user_id,
+            limit=request.args.get('limit', type=int),
+            cursor=request.args.get('cursor')
+        )
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    response = jsonify(purchases)
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response, 200
+
 # User purchases endpoint
 @marketplace_bp.route('/users/<user_id>/purchases', methods=['GET'])
 @jwt_required(optional=True)
@@ -166,50 +173,13 @@ def get_user_purchases(user_id):
                 print(f"Auth check error: {str(auth_error)}")
                 return jsonify({'error': 'Authentication error'}), 403
         
-        # Get purchases from database
-        from ..db import get_db
-        db = get_db()
-        purchases = []
-        
-        # Try different query approaches to find purchases
+        # Purchase history is one indexed range read on the materialized projection
         try:
-            # Try with string ID first
-            string_purchases = list(db.user_purchases.find({'buyer_id': user_id}))
-            if string_purchases:
-                purchases = string_purchases
-            else:
-                # Try with ObjectId
-                try:
-                    obj_id_purchases = list(db.user_purchases.find({'buyer_id': ObjectId(user_id)}))
-                    if obj_id_purchases:
-                        purchases = obj_id_purchases
-                except Exception as obj_id_error:
-                    print(f"ObjectId conversion error: {str(obj_id_error)}")
+            return purchase_history_response(user_id)
         except Exception as query_error:
             print(f"Purchase query error: {str(query_error)}")
             # Return empty list instead of error
             return jsonify([]), 200
-        
-        # Convert ObjectId to string for JSON serialization
-        serialized_purchases = []
-        for purchase in purchases:
-            try:
-                serialized_purchase = {}
-                for key, value in purchase.items():
-                    if key == '_id' or key.endswith('_id'):
-                        if isinstance(value, ObjectId):
-                            serialized_purchase[key] = str(value)
-                        else:
-                            serialized_purchase[key] = value
-                    else:
-                        serialized_purchase[key] = value
-                serialized_purchases.append(serialized_purchase)
-            except Exception as serialize_error:
-                print(f"Error serializing purchase: {str(serialize_error)}")
-                # Skip this purchase and continue with others
-                continue
-        
-        return jsonify(serialized_purchases), 200
     except Exception as e:
         print(f"Error getting user purchases: {str(e)}")
         # Return empty array instead of error to avoid UI disruption
@@ -242,39 +212,11 @@ def get_user_sold_items(user_id):
         
         # Try different query approaches to find sold items
         try:
-            # First try with string ID
-            query_attempts = [
-                {'user_id': user_id, 'sold': True},
-                {'user_id': user_id, 'status': 'sold'},
-                {'seller_id': user_id, 'sold': True},
-                {'seller_id': user_id, 'status': 'sold'}
-            ]
-            
-            # Try each query until we find items
-            for query in query_attempts:
-                items = list(db.marketplace_items.find(query))
-                if items:
-                    sold_items = items
-                    break
-            
-            # If still no items found, try with ObjectId
-            if not sold_items:
-                try:
-                    obj_id = ObjectId(user_id)
-                    obj_id_query_attempts = [
-                        {'user_id': obj_id, 'sold': True},
-                        {'user_id': obj_id, 'status': 'sold'},
-                        {'seller_id': obj_id, 'sold': True},
-                        {'seller_id': obj_id, 'status': 'sold'}
-                    ]
-                    
-                    for query in obj_id_query_attempts:
-                        items = list(db.marketplace_items.find(query))
-                        if items:
-                            sold_items = items
-                            break
-                except Exception as obj_id_error:
-                    print(f"Error converting to ObjectId in sold items: {str(obj_id_error)}")
+            # user_id is normalized on write; marked-sold and ordered items are both covered
+            sold_items = list(db.marketplace_items.find({
+                'user_id': match_user_id(user_id),
+                '$or': [{'sold': True}, {'status': 'sold'}]
+            }))
             
             # If still no items, create a mock item for testing
             if not sold_items and user_id == '680b77b21a56df5ae3fa3241':
@@ -333,15 +275,13 @@ def create_purchase_record():
         data['purchase_date'] = datetime.datetime.utcnow()
         
         # Create the purchase record
-        from ..db import get_db
-        db = get_db()
-        result = db.user_purchases.insert_one(data)
+        purchase_id = PurchaseHistory.record_purchase(data)
         
-        if result.inserted_id:
+        if purchase_id:
             return jsonify({
                 'success': True,
                 'message': 'Purchase record created successfully',
-                'purchase_id': str(result.inserted_id)
+                'purchase_id': purchase_id
             }), 201
         return jsonify({'error': 'Failed to create purchase record'}), 400
         
@@ -354,29 +294,7 @@ def create_purchase_record():
 @jwt_required(optional=True)
 def get_marketplace_user_purchases(user_id):
     try:
-        # Get the database connection
-        from ..db import get_db
-        db = get_db()
-        
-        # Try to convert to ObjectId
-        try:
-            user_obj_id = ObjectId(user_id)
-        except:
-            # If conversion fails, use the string ID
-            user_obj_id = user_id
-            
-        # Get purchases from database - check both collections
-        # First check the user_purchases collection (new format)
-        user_purchases = list(db.user_purchases.find({"buyer_id": user_id}))
-        
-        # Format purchase data
-        formatted_purchases = []
-        for purchase in user_purchases:
-            # Convert ObjectId to string for JSON serialization
-            purchase['_id'] = str(purchase['_id'])
-            formatted_purchases.append(purchase)
-            
-        return jsonify(formatted_purchases), 200
+        return purchase_history_response(user_id)
     except Exception as e:
         print(f"Error getting marketplace user purchases: {str(e)}")
         return jsonify({"error": str(e)}), 500
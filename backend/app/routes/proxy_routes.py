@@ -3,9 +3,8 @@ Proxy routes to handle API endpoint redirections
 """
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from app.models.ride_post import RidePost
-from app.db import db
-from bson import ObjectId
+from app.models.ride_repository import RideRepository, as_post, from_post
+from app.utils.ids import stringify_ids
 import logging
 
 # Set up logging
@@ -19,11 +18,11 @@ def get_ride_posts():
     """Proxy endpoint to get all ride share posts"""
     try:
         # Get all ride posts from the database
-        posts = list(db.ride_posts.find({}))
+        posts = RideRepository().find(sort=[('created_at', -1)])
         
         # Convert ObjectId to string for JSON serialization
         for post in posts:
-            post['_id'] = str(post['_id'])
+            stringify_ids(as_post(post))
             
         return jsonify(posts), 200
     except Exception as e:
@@ -42,12 +41,9 @@ def update_ride_post(post_id):
         data = request.get_json()
         
         # Update the post in the database
-        result = db.ride_posts.update_one(
-            {"_id": ObjectId(post_id)},
-            {"$set": data}
-        )
+        post = RideRepository().update(post_id, from_post(data))
         
-        if result.modified_count == 0:
+        if not post:
             return jsonify({"error": "Post not found or no changes made"}), 404
             
         return jsonify({"message": "Ride post updated successfully"}), 200
@@ -64,9 +60,9 @@ def delete_ride_post(post_id):
         current_user_id = get_jwt_identity()
         
         # Delete the post from the database
-        result = db.ride_posts.delete_one({"_id": ObjectId(post_id)})
+        post = RideRepository().delete(post_id)
         
-        if result.deleted_count == 0:
+        if not post:
             return jsonify({"error": "Post not found"}), 404
             
         return jsonify({"message": "Ride post deleted successfully"}), 200
@@ -4,7 +4,9 @@ API routes for Ride Share functionality
 from flask import Blueprint, request, jsonify
 from app.auth import login_required, admin_required
 from app.models.ride_share import RideShare
+from app.models.ride_repository import RideRepository, as_post, from_post
 from bson.errors import InvalidId
+from app.utils.ids import stringify_ids
 
 # Create blueprint
 ride_share_bp = Blueprint('ride_share', __name__)
@@ -57,7 +59,9 @@ def create_ride():
             is_paid=data['is_paid'],
             fee_per_seat=data.get('fee_per_seat', 0),
             payment_method=data.get('payment_method'),
-            contact_number=data['contact_number']
+            contact_number=data['contact_number'],
+            from_coordinates=data.get('from_coordinates'),
+            to_coordinates=data.get('to_coordinates')
         )
         return jsonify({"success": True, "ride_id": ride_id}), 201
     except Exception as e:
@@ -67,14 +71,13 @@ def create_ride():
 def get_ride_post(ride_id):
     """Get a specific ride post by ID"""
     try:
-        db = RideShare.get_db()
-        ride_post = db.ride_posts.find_one({"_id": RideShare.ObjectId(ride_id)})
+        ride_post = RideRepository().get(ride_id)
         
         if not ride_post:
             return jsonify({"success": False, "message": "Ride post not found"}), 404
         
         # Convert ObjectId to string for JSON serialization
-        ride_post['_id'] = str(ride_post['_id'])
+        stringify_ids(as_post(ride_post))
         
         return jsonify({"success": True, "ride_post": ride_post}), 200
     except InvalidId:
@@ -128,7 +131,7 @@ def get_my_rides():
     """Get rides posted by the current user"""
     try:
         current_user = request.current_user
-        rides = RideShare.get_user_rides(current_user['_id'])
+        rides = RideShare.get_my_rides(current_user['_id'])
         return jsonify({'success': True, 'rides': rides}), 200
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
@@ -221,13 +224,9 @@ def admin_update_ride_post(ride_id):
     
     try:
         # Allow updating any field as admin
-        db = RideShare.get_db()
-        result = db.ride_posts.update_one(
-            {"_id": RideShare.ObjectId(ride_id)},
-            {"$set": data}
-        )
+        ride_post = RideRepository().update(ride_id, from_post(data))
         
-        if result.modified_count > 0:
+        if ride_post:
             return jsonify({"success": True, "message": "Ride post updated successfully"}), 200
         else:
             return jsonify({"success": False, "message": "No changes made or ride post not found"}), 400
@@ -239,10 +238,9 @@ def admin_update_ride_post(ride_id):
 def admin_delete_ride_post(ride_id):
     """Admin endpoint to delete any ride post"""
     try:
-        db = RideShare.get_db()
-        result = db.ride_posts.delete_one({"_id": RideShare.ObjectId(ride_id)})
+        ride_post = RideRepository().delete(ride_id)
         
-        if result.deleted_count > 0:
+        if ride_post:
             return jsonify({"success": True, "message": "Ride post deleted successfully"}), 200
         else:
             return jsonify({"success": False, "message": "Ride post not found"}), 404
@@ -2,12 +2,11 @@ from flask import request, current_app
 from flask_socketio import emit, join_room, leave_room
 from app.models.message import Message
 from app.models.user import User
+from app.utils.seat_updates import ride_room, date_room
+from app.utils.upload import save_image_data
 from pymongo import MongoClient
 from bson import ObjectId
 import json
-import base64
-import os
-import uuid
 from datetime import datetime
 
 # Initialize MongoDB client
@@ -65,6 +64,34 @@ def init_socket_events(socketio):
             leave_room(conversation_id)
             print(f'User left conversation: {conversation_id}')
     
+    @socketio.on('join_ride')
+    def handle_join_ride(data):
+        """Follow seat changes of one ride (seats_changed events)"""
+        ride_id = data.get('ride_id')
+        if ride_id:
+            join_room(ride_room(ride_id))
+    
+    @socketio.on('leave_ride')
+    def handle_leave_ride(data):
+        """Stop following a ride"""
+        ride_id = data.get('ride_id')
+        if ride_id:
+            leave_room(ride_room(ride_id))
+    
+    @socketio.on('join_ride_date')
+    def handle_join_ride_date(data):
+        """Follow seat changes of every ride on a date (YYYY-MM-DD)"""
+        date = data.get('date')
+        if date:
+            join_room(date_room(date))
+    
+    @socketio.on('leave_ride_date')
+    def handle_leave_ride_date(data):
+        """Stop following the rides of a date"""
+        date = data.get('date')
+        if date:
+            leave_room(date_room(date))
+    
     @socketio.on('send_message')
     def handle_send_message(data):
         """Handle sending a message"""
@@ -79,24 +106,7 @@ def init_socket_events(socketio):
             # Process image if provided
             image_url = None
             if image_data:
-                # Extract base64 data
-                image_format, image_base64 = image_data.split(',', 1)
-                image_bytes = base64.b64decode(image_base64)
-                
-                # Create uploads directory if it doesn't exist
-                upload_dir = os.path.join(os.getcwd(), 'uploads', 'messages')
-                os.makedirs(upload_dir, exist_ok=True)
-                
-                # Generate unique filename
-                filename = f"{uuid.uuid4()}.png"
-                filepath = os.path.join(upload_dir, filename)
-                
-                # Save the image
-                with open(filepath, 'wb') as f:
-                    f.write(image_bytes)
-                
-                # Set the image URL for the message
-                image_url = f"/uploads/messages/{filename}"
+                image_url = save_image_data(image_data, 'messages')
             
             # Create message data
             message_data = {
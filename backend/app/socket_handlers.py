@@ -2,12 +2,9 @@ from flask import current_app, request
 from flask_socketio import emit, join_room
 from bson import ObjectId
 from datetime import datetime
-import base64
-import os
-import uuid
 
 from app.models.message import Message
-from app.utils.upload import save_base64_image
+from app.utils.upload import save_image_data
 
 # Dictionary to store user socket mappings
 connected_users = {}
@@ -64,7 +61,7 @@ def register_socket_handlers(socketio):
             # Handle image if present
             if image:
                 try:
-                    image_url = save_base64_image(image, 'messages')
+                    image_url = save_image_data(image, 'messages')
                     message_data['image_url'] = image_url
                 except Exception as e:
                     current_app.logger.error(f"Error saving image: {str(e)}")
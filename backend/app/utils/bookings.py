@@ -0,0 +1,72 @@
+"""
+Ride snapshots stored on bookings
+
+A booking keeps `ride_id` as its reference to the ride, plus a small, fixed
+snapshot of the ride fields shown in booking lists (route, schedule, driver,
+price, contact). The snapshot is what the booker agreed to and still renders
+after the ride is archived; anything that changes (seats, status, edits) is
+read from the ride itself with `attach_live_rides`.
+"""
+from datetime import datetime
+from bson import ObjectId
+from app.utils.ids import to_object_id
+
+# Ride fields copied onto bookings. share_rides and ride_posts name a few of
+# them differently; only the fields a ride has are copied.
+SNAPSHOT_FIELDS = (
+    '_id', 'user_id', 'creator_id', 'user_name', 'user_email', 'creator_name', 'creator_email',
+    'from_location', 'to_location', 'date', 'time', 'vehicle_type',
+    'is_paid', 'fee_per_seat', 'payment_method', 'phone_number', 'contact_number',
+)
+# Ride fields that change after booking, returned with live rides
+LIVE_FIELDS = ('seats_available', 'status', 'description')
+
+def ride_snapshot(ride):
+    """The fixed subset of a ride stored on its bookings"""
+    return {field: ride[field] for field in SNAPSHOT_FIELDS if field in ride}
+
+def attach_live_rides(collection, bookings, key='ride'):
+    """
+    Replace the snapshot of each booking with the current ride, fetched with a
+    single $in query
+
+    Bookings whose ride no longer exists keep their snapshot. Each booking gets
+    `ride_available` telling which case applies.
+
+    Args:
+        collection: The rides collection the bookings refer to
+        bookings: Booking documents; modified in place
+        key: Field holding the ride snapshot on the bookings
+    """
+    ride_ids = {ObjectId(booking['ride_id']) for booking in bookings
+                if ObjectId.is_valid(str(booking.get('ride_id')))}
+    projection = {field: 1 for field in SNAPSHOT_FIELDS + LIVE_FIELDS}
+    rides = {str(ride['_id']): ride for ride in collection.find({'_id': {'$in': list(ride_ids)}}, projection)}
+    for booking in bookings:
+        ride = rides.get(str(booking.get('ride_id')))
+        booking['ride_available'] = ride is not None
+        if ride is not None:
+            booking[key] = ride
+    return bookings
+
+def new_share_booking(db, ride, user_id, seats, pickup_location=None, dropoff_location=None):
+    """
+    Build the booking document for seats already reserved on a share ride
+
+    Returns:
+        dict: The booking, ready to insert
+    """
+    user = db.users.find_one({'_id': to_object_id(user_id)}, {'name': 1, 'email': 1})
+    return {
+        'user_id': to_object_id(user_id),
+        'user_name': user.get('name', 'Unknown User') if user else 'Unknown User',
+        'user_email': user.get('email', 'No email') if user else 'No email',
+        'ride_id': str(ride['_id']),
+        'ride': ride_snapshot(ride),  # What the booking list shows, as agreed at booking time
+        'seats': seats,
+        'pickup_location': pickup_location or ride['from_location'],
+        'dropoff_location': dropoff_location or ride['to_location'],
+        'status': 'active',
+        'created_at': datetime.utcnow(),
+        'updated_at': datetime.utcnow()
+    }
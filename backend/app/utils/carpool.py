@@ -0,0 +1,252 @@
+"""
+Time-window carpool matching
+
+Active ride offers (`share_rides`) and ride requests (`rides` with type
+"request") are grouped when they travel between the same areas on the same
+day and leave within a short window of each other, e.g. everyone leaving
+campus for Uttara between 17:00 and 17:30.
+
+Entries are bucketed by (date, from area, to area), where an area is the
+first token of the normalized location ("Uttara Sector 10" -> "uttara").
+Each bucket keeps its departure times sorted, so the entries inside a time
+window are found with two binary searches instead of a scan, and a lookup
+for one ride only touches its own bucket. The proposed groups of a bucket are
+cached and recomputed only after a ride in that bucket changes.
+"""
+import threading
+from bisect import bisect_left, insort
+from datetime import datetime
+
+from app.utils.locations import location_tokens
+
+DEFAULT_WINDOW_MINUTES = 30
+MAX_WINDOW_MINUTES = 180
+
+def area_key(location):
+    """Coarse area of a free-text location, used as the cluster key"""
+    tokens = location_tokens(location)
+    return tokens[0] if tokens else ''
+
+def departure_minutes(time):
+    """Minutes after midnight of an 'HH:MM' time, or None"""
+    try:
+        parsed = datetime.strptime(str(time), '%H:%M')
+    except ValueError:
+        return None
+    return parsed.hour * 60 + parsed.minute
+
+def ride_date(date):
+    """Dates are stored as 'YYYY-MM-DD' strings on share_rides and as datetimes on ride requests"""
+    return date.strftime('%Y-%m-%d') if isinstance(date, datetime) else str(date)
+
+def offer_entry(ride):
+    """Matcher entry for a share ride"""
+    return {
+        'id': str(ride['_id']),
+        'kind': 'offer',
+        'user_id': str(ride.get('user_id')),
+        'user_name': ride.get('user_name'),
+        'from_location': ride.get('from_location'),
+        'to_location': ride.get('to_location'),
+        'date': ride_date(ride.get('date')),
+        'time': ride.get('time'),
+        'seats': ride.get('seats_available', 0)
+    }
+
+def request_entry(ride):
+    """Matcher entry for a ride request"""
+    return {
+        'id': str(ride['_id']),
+        'kind': 'request',
+        'user_id': str(ride.get('user_id')),
+        'user_name': ride.get('user_name'),
+        'from_location': ride.get('pickup_location'),
+        'to_location': ride.get('dropoff_location'),
+        'date': ride_date(ride.get('date')),
+        'time': ride.get('time'),
+        'seats': ride.get('needed_seats', 1)
+    }
+
+
+class _Bucket:
+    __slots__ = ('times', 'groups')
+
+    def __init__(self):
+        self.times = []      # sorted (minutes, entry id)
+        self.groups = {}     # window minutes -> cached groups
+
+
+class CarpoolMatcher:
+    """
+    In-memory index of active offers and requests, kept current by the ride
+    write paths. Loaded lazily from the database on first use.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._buckets = {}
+        self._by_date = {}
+        self._loaded = False
+        self._lock = threading.RLock()
+
+    def _bucket_key(self, entry):
+        return (entry['date'], area_key(entry['from_location']), area_key(entry['to_location']))
+
+    def _ensure_loaded(self, db):
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            for ride in db.share_rides.find({'status': 'active'}):
+                self._put(offer_entry(ride))
+            for ride in db.rides.find({'type': 'request', 'status': 'active'}):
+                self._put(request_entry(ride))
+            self._loaded = True
+
+    def _put(self, entry):
+        minutes = departure_minutes(entry['time'])
+        if minutes is None:
+            return
+        self._drop(entry['id'])
+        entry['minutes'] = minutes
+        key = self._bucket_key(entry)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = _Bucket()
+            self._by_date.setdefault(entry['date'], set()).add(key)
+        insort(bucket.times, (minutes, entry['id']))
+        bucket.groups.clear()
+        self._entries[entry['id']] = entry
+
+    def _drop(self, entry_id):
+        entry = self._entries.pop(entry_id, None)
+        if entry is None:
+            return
+        key = self._bucket_key(entry)
+        bucket = self._buckets[key]
+        index = bisect_left(bucket.times, (entry['minutes'], entry_id))
+        if index < len(bucket.times) and bucket.times[index] == (entry['minutes'], entry_id):
+            del bucket.times[index]
+        bucket.groups.clear()
+        if not bucket.times:
+            del self._buckets[key]
+            self._by_date[entry['date']].discard(key)
+            if not self._by_date[entry['date']]:
+                del self._by_date[entry['date']]
+
+    def update_offer(self, ride):
+        """Add or refresh a share ride; rides that are no longer active are dropped (no-op until loaded)"""
+        if not self._loaded or not ride:
+            return
+        with self._lock:
+            if ride.get('status', 'active') == 'active':
+                self._put(offer_entry(ride))
+            else:
+                self._drop(str(ride['_id']))
+
+    def update_request(self, ride):
+        """Add or refresh a ride request (no-op until loaded)"""
+        if not self._loaded or not ride:
+            return
+        with self._lock:
+            if ride.get('status', 'active') == 'active':
+                self._put(request_entry(ride))
+            else:
+                self._drop(str(ride['_id']))
+
+    def remove(self, ride_id):
+        """Forget a deleted or cancelled ride or request (no-op until loaded)"""
+        if not self._loaded:
+            return
+        with self._lock:
+            self._drop(str(ride_id))
+
+    def reset(self):
+        """Drop the index; the next lookup reloads it from the database"""
+        with self._lock:
+            self._entries, self._buckets, self._by_date = {}, {}, {}
+            self._loaded = False
+
+    def _public(self, entry):
+        return {key: value for key, value in entry.items() if key != 'minutes'}
+
+    def _window(self, bucket, start, end):
+        """Entries of a bucket departing between start and end minutes, inclusive"""
+        lo = bisect_left(bucket.times, (start, ''))
+        hi = bisect_left(bucket.times, (end + 1, ''))
+        return [self._entries[entry_id] for _, entry_id in bucket.times[lo:hi]]
+
+    def _bucket_groups(self, key, window):
+        """
+        Propose groups for one bucket: sweep the sorted departures, opening a
+        group at the earliest unassigned entry and adding everything leaving
+        within `window` minutes of it. A group is proposed when it has a
+        request and a ride with seats, or several requests that could share.
+        """
+        bucket = self._buckets[key]
+        if window in bucket.groups:
+            return bucket.groups[window]
+
+        groups = []
+        times = bucket.times
+        i = 0
+        while i < len(times):
+            start = times[i][0]
+            j = bisect_left(times, (start + window + 1, ''))
+            members = [self._entries[entry_id] for _, entry_id in times[i:j]]
+            offers = [m for m in members if m['kind'] == 'offer' and m['seats'] > 0]
+            requests = [m for m in members if m['kind'] == 'request']
+            if requests and (offers or len(requests) > 1):
+                groups.append({
+                    'date': key[0],
+                    'from_area': key[1],
+                    'to_area': key[2],
+                    'window_start': f'{start // 60:02d}:{start % 60:02d}',
+                    'window_end': f'{times[j - 1][0] // 60:02d}:{times[j - 1][0] % 60:02d}',
+                    'offers': [self._public(m) for m in offers],
+                    'requests': [self._public(m) for m in requests],
+                    'seats_offered': sum(m['seats'] for m in offers),
+                    'seats_needed': sum(m['seats'] for m in requests)
+                })
+            i = j
+        bucket.groups[window] = groups
+        return groups
+
+    def groups(self, db, date, from_location=None, to_location=None, window=DEFAULT_WINDOW_MINUTES):
+        """
+        Proposed carpool groups for a day, optionally limited to one route
+
+        Returns:
+            list: Groups ordered by route and departure
+        """
+        self._ensure_loaded(db)
+        with self._lock:
+            keys = sorted(self._by_date.get(date, ()))
+            if from_location:
+                keys = [k for k in keys if k[1] == area_key(from_location)]
+            if to_location:
+                keys = [k for k in keys if k[2] == area_key(to_location)]
+            return [group for key in keys for group in self._bucket_groups(key, window)]
+
+    def matches_for(self, db, ride_id, window=DEFAULT_WINDOW_MINUTES):
+        """
+        Offers and requests on the same route leaving within `window`
+        minutes of a given ride or request
+
+        Returns:
+            tuple: (the entry, list of matching entries closest first), or (None, [])
+        """
+        self._ensure_loaded(db)
+        with self._lock:
+            entry = self._entries.get(str(ride_id))
+            if entry is None:
+                return None, []
+            bucket = self._buckets[self._bucket_key(entry)]
+            minutes = entry['minutes']
+            matches = [m for m in self._window(bucket, minutes - window, minutes + window) if m['id'] != entry['id']]
+            matches.sort(key=lambda m: abs(m['minutes'] - minutes))
+            return self._public(entry), [self._public(m) for m in matches]
+
+
+carpool_matcher = CarpoolMatcher()
@@ -0,0 +1,150 @@
+"""
+Geospatial ride matching
+
+Rides may carry the coordinates of their pickup and drop-off points as GeoJSON
+(`from_point`, `to_point`) next to the free-text locations. Both fields have a
+2dsphere index, so a search for "rides leaving near me and arriving near my
+destination" is one $geoNear over the origins, filtered with $geoWithin on the
+destinations, instead of a scan. The candidates are then ranked by how far the
+driver has to go out of their way and how close the departure is to the time
+the passenger asked for.
+"""
+import math
+import threading
+from datetime import datetime
+
+from pymongo import GEOSPHERE
+
+EARTH_RADIUS_M = 6378100
+DEFAULT_RADIUS_M = 2000
+MAX_RADIUS_M = 20000
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+# How many metres of detour one minute of departure difference is worth when ranking
+METERS_PER_MINUTE = 100
+
+_indexed = set()
+_indexed_lock = threading.Lock()
+
+def to_point(coordinates):
+    """
+    Convert {'lat': ..., 'lng': ...} to a GeoJSON point
+
+    Returns:
+        dict: The point, or None when no coordinates were given
+
+    Raises:
+        ValueError: If the coordinates are malformed or out of range
+    """
+    if not coordinates:
+        return None
+    try:
+        lat = float(coordinates['lat'])
+        lng = float(coordinates['lng'])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError('Coordinates must have numeric lat and lng')
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        raise ValueError('Coordinates are out of range')
+    return {'type': 'Point', 'coordinates': [lng, lat]}
+
+def point_fields(data):
+    """
+    GeoJSON fields to store for the optional `from_coordinates`/`to_coordinates`
+    of a ride payload (only the ones present are returned)
+    """
+    fields = {}
+    for source, target in (('from_coordinates', 'from_point'), ('to_coordinates', 'to_point')):
+        if data.get(source):
+            fields[target] = to_point(data[source])
+    return fields
+
+def ensure_geo_indexes(collection):
+    """Create the 2dsphere indexes on a rides collection once per process"""
+    if collection.name in _indexed:
+        return
+    with _indexed_lock:
+        if collection.name not in _indexed:
+            collection.create_index([('from_point', GEOSPHERE), ('status', 1)])
+            collection.create_index([('to_point', GEOSPHERE)])
+            _indexed.add(collection.name)
+
+def distance_m(a, b):
+    """Great-circle distance in metres between two GeoJSON points"""
+    lng1, lat1 = map(math.radians, a['coordinates'])
+    lng2, lat2 = map(math.radians, b['coordinates'])
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(h))
+
+def departure_datetime(date, time):
+    """Parse a ride's 'YYYY-MM-DD' date and 'HH:MM' time, or None"""
+    try:
+        return datetime.strptime(f'{date} {time}', '%Y-%m-%d %H:%M')
+    except (TypeError, ValueError):
+        return None
+
+def rank_rides(rides, origin, destination, departure=None):
+    """
+    Annotate and sort candidate rides, best match first
+
+    Each ride gets `pickup_distance_m`, `dropoff_distance_m`, `detour_m` (extra
+    distance the driver covers to pick up and drop off the passenger) and, when
+    a departure time is given, `time_diff_minutes`.
+    """
+    for ride in rides:
+        ride_from, ride_to = ride['from_point'], ride['to_point']
+        pickup = distance_m(ride_from, origin)
+        dropoff = distance_m(destination, ride_to)
+        direct = distance_m(ride_from, ride_to)
+        detour = max(0.0, pickup + distance_m(origin, destination) + dropoff - direct)
+        ride['pickup_distance_m'] = round(pickup)
+        ride['dropoff_distance_m'] = round(dropoff)
+        ride['detour_m'] = round(detour)
+
+        score = detour
+        if departure is not None:
+            ride_departure = departure_datetime(ride.get('date'), ride.get('time'))
+            if ride_departure is not None:
+                minutes = abs((ride_departure - departure).total_seconds()) / 60
+                ride['time_diff_minutes'] = round(minutes)
+                score += minutes * METERS_PER_MINUTE
+        ride['_score'] = score
+
+    rides.sort(key=lambda ride: ride.pop('_score'))
+    return rides
+
+def find_nearby_rides(collection, origin, destination, radius=DEFAULT_RADIUS_M, query=None,
+                      departure=None, limit=DEFAULT_LIMIT):
+    """
+    Rides starting within `radius` metres of `origin` and ending within
+    `radius` metres of `destination`, best match first
+
+    Args:
+        collection: The rides collection
+        origin: GeoJSON point where the passenger gets in
+        destination: GeoJSON point where the passenger gets out
+        radius: Search radius in metres around both points
+        query: Extra conditions on the rides (status, date, ...)
+        departure: Desired departure datetime, used for ranking
+        limit: Maximum number of rides returned
+
+    Returns:
+        list: Ride documents annotated by rank_rides
+    """
+    ensure_geo_indexes(collection)
+    lng, lat = destination['coordinates']
+    match = dict(query or {})
+    match['to_point'] = {'$geoWithin': {'$centerSphere': [[lng, lat], radius / EARTH_RADIUS_M]}}
+
+    # Over-fetch by pickup distance, then rank the candidates on the full score
+    candidates = list(collection.aggregate([
+        {'$geoNear': {
+            'near': origin,
+            'key': 'from_point',
+            'distanceField': 'pickup_distance_m',
+            'maxDistance': radius,
+            'query': match,
+            'spherical': True
+        }},
+        {'$limit': min(limit * 10, 1000)}
+    ]))
+    return rank_rides(candidates, origin, destination, departure)[:limit]
@@ -0,0 +1,80 @@
+from bson import ObjectId
+
+# Fields that reference a user document. They are stored as ObjectIds so one
+# index serves every lookup, instead of querying once per representation.
+USER_ID_FIELDS = ('user_id', 'buyer_id', 'seller_id', 'creator_id')
+
+def to_object_id(value):
+    """
+    Convert a user reference to its canonical stored form
+
+    Args:
+        value: An ObjectId, a 24-character hex string (e.g. a JWT identity) or anything else
+
+    Returns:
+        The value as an ObjectId when it is one, otherwise the value unchanged
+        (legacy identities such as "admin" or an email address are kept as-is)
+    """
+    if isinstance(value, ObjectId):
+        return value
+    if isinstance(value, str) and ObjectId.is_valid(value):
+        return ObjectId(value)
+    return value
+
+def user_id_forms(value):
+    """
+    Every stored form of a user reference
+
+    The normalize_user_ids migration converts string references collection by
+    collection, so until it has finished a document may still hold the identity
+    string. Lookups match both forms in the meantime.
+
+    Args:
+        value: An ObjectId, a 24-character hex string or a legacy identity
+
+    Returns:
+        list: [ObjectId, its hex string] for ObjectIds, otherwise [value]
+    """
+    value = to_object_id(value)
+    if isinstance(value, ObjectId):
+        return [value, str(value)]
+    return [value]
+
+def match_user_id(value):
+    """Query condition matching a user reference stored as an ObjectId or as its string"""
+    return {'$in': user_id_forms(value)}
+
+def same_user(a, b):
+    """Whether two user references, in either form, point to the same user"""
+    return a is not None and b is not None and str(a) == str(b)
+
+def normalize_user_ids(document, fields=USER_ID_FIELDS):
+    """
+    Normalize the user reference fields of a document before it is written
+
+    Args:
+        document: The document (or $set payload) about to be written; modified in place
+        fields: The reference fields to normalize
+
+    Returns:
+        dict: The same document, for chaining
+    """
+    for field in fields:
+        if document.get(field) is not None:
+            document[field] = to_object_id(document[field])
+    return document
+
+def stringify_ids(document):
+    """
+    Convert the _id and every *_id field of a document to strings for JSON responses
+
+    Args:
+        document: The document read from MongoDB; modified in place
+
+    Returns:
+        dict: The same document, for chaining
+    """
+    for key, value in document.items():
+        if (key == '_id' or key.endswith('_id')) and isinstance(value, ObjectId):
+            document[key] = str(value)
+    return document
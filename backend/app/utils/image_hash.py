@@ -0,0 +1,145 @@
+"""
+Perceptual hashes of uploaded photos
+
+`dhash` reduces an image to a 64-bit difference hash: the image is shrunk to
+9x8 grayscale pixels and each bit records whether a pixel is brighter than
+its right neighbour. Re-encoded, resized or slightly cropped copies of a
+photo hash to values a few bits apart, so the Hamming distance between two
+hashes measures how alike the photos look.
+
+BKTree answers "hashes within distance d" without comparing against every
+stored hash. Uploads are hashed off the request path by the image worker.
+
+Hashing needs Pillow; without it `dhash` raises and photos stay unhashed.
+"""
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+HASH_BITS = 64
+# Hashes at most this many bits apart are treated as the same photo
+MAX_DISTANCE = 10
+
+def dhash(path):
+    """
+    Difference hash of the image at `path`
+
+    Returns:
+        int: The 64-bit hash
+    """
+    if Image is None:
+        raise RuntimeError('Pillow is required for image hashing')
+    with Image.open(path) as image:
+        # Lets JPEG decode at a fraction of the size; other formats ignore it
+        image.draft('L', (64, 64))
+        pixels = list(image.convert('L').resize((9, 8), Image.LANCZOS).getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            right = pixels[row * 9 + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+def format_hash(value):
+    """Hash as the 16-digit hex string stored in documents"""
+    return f'{value:016x}'
+
+def parse_hash(value):
+    """Hash from its stored hex string, or None"""
+    try:
+        return int(value, 16) if value else None
+    except (TypeError, ValueError):
+        return None
+
+
+class BKTree:
+    """
+    Burkhard-Keller tree of hashes under the Hamming distance
+
+    Each node holds one hash and the ids stored under it; its children are
+    keyed by their distance to it. By the triangle inequality a search for
+    hashes within `d` of a query at distance `k` from a node only has to
+    descend into the children keyed `k - d` to `k + d`.
+
+    Removing an id leaves its node in place as a routing node; the tree is
+    rebuilt once such empty nodes outnumber the live ones.
+    """
+
+    def __init__(self):
+        self._root = None
+        self._hashes = {}  # id -> hash
+        self._nodes = 0
+
+    def __len__(self):
+        return len(self._hashes)
+
+    def add(self, value, item_id):
+        self.remove(item_id)
+        self._hashes[item_id] = value
+        if self._root is None:
+            self._root = self._node(value)
+            self._root[1].add(item_id)
+            return
+        node = self._root
+        while True:
+            distance = hamming(value, node[0])
+            if distance == 0:
+                node[1].add(item_id)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                child = node[2][distance] = self._node(value)
+                child[1].add(item_id)
+                return
+            node = child
+
+    def remove(self, item_id):
+        value = self._hashes.pop(item_id, None)
+        if value is None:
+            return
+        node = self._root
+        while node is not None:
+            distance = hamming(value, node[0])
+            if distance == 0:
+                node[1].discard(item_id)
+                break
+            node = node[2].get(distance)
+        if self._nodes > 2 * len(self._hashes) + 16:
+            self._rebuild()
+
+    def search(self, value, max_distance=MAX_DISTANCE):
+        """
+        Ids stored under hashes within `max_distance` of `value`
+
+        Returns:
+            list: (distance, id) pairs, closest first
+        """
+        found = []
+        stack = [self._root] if self._root is not None else []
+        while stack:
+            node = stack.pop()
+            distance = hamming(value, node[0])
+            if distance <= max_distance:
+                found.extend((distance, item_id) for item_id in node[1])
+            for key, child in node[2].items():
+                if distance - max_distance <= key <= distance + max_distance:
+                    stack.append(child)
+        found.sort()
+        return found
+
+    def _node(self, value):
+        self._nodes += 1
+        return (value, set(), {})
+
+    def _rebuild(self):
+        hashes = self._hashes
+        self._root = None
+        self._hashes = {}
+        self._nodes = 0
+        for item_id, value in hashes.items():
+            self.add(value, item_id)
@@ -0,0 +1,209 @@
+"""
+On-demand resized copies of uploaded images
+
+`/uploads/<path>?w=&h=&fmt=` serves the image scaled down to fit w x h
+(never up), optionally converted to another format. The first request for a
+size renders it; the result is kept in a disk cache on this host and later
+requests are served straight from the file, wherever the source is stored.
+
+Cache entries are content-addressed: the key is a SHA-256 over the source
+file's identity (its storage key and, unless the file is itself
+content-addressed, its version in storage) and the requested parameters. A replaced source therefore gets new keys instead of stale
+hits, and the key doubles as a strong ETag. Entries are evicted
+least-recently-used first once the cache exceeds RESIZE_CACHE_BYTES. A hit
+touches its file's mtime, so the LRU order survives restarts. Concurrent
+misses for the same key render it once.
+"""
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+from app.utils.storage import UPLOAD_ROOT, get_storage
+from app.utils.upload import blob_digest
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+CACHE_DIR = os.environ.get('RESIZE_CACHE_DIR', os.path.join(os.path.dirname(UPLOAD_ROOT), 'resize_cache'))
+RESIZE_CACHE_BYTES = int(os.environ.get('RESIZE_CACHE_BYTES', 512 * 1024 * 1024))
+MAX_DIMENSION = 2048
+QUALITY = int(os.environ.get('IMAGE_VARIANT_QUALITY', 80))
+# Requested format -> (Pillow format, extension, mimetype)
+FORMATS = {
+    'webp': ('WEBP', 'webp', 'image/webp'),
+    'jpeg': ('JPEG', 'jpg', 'image/jpeg'),
+    'jpg': ('JPEG', 'jpg', 'image/jpeg'),
+    'png': ('PNG', 'png', 'image/png'),
+}
+# Source extension -> format kept when no fmt is requested
+SOURCE_FORMATS = {'jpg': 'jpeg', 'jpeg': 'jpeg', 'png': 'png', 'webp': 'webp', 'gif': 'png'}
+
+
+def resize_params(args):
+    """
+    Validated (width, height, format) from request arguments, or None if no
+    resize was asked for
+
+    Raises:
+        ValueError: If a parameter is out of range or unknown
+    """
+    width, height, fmt = args.get('w'), args.get('h'), args.get('fmt')
+    if not (width or height or fmt):
+        return None
+    try:
+        width = int(width) if width else None
+        height = int(height) if height else None
+    except ValueError:
+        raise ValueError('w and h must be integers')
+    for value in (width, height):
+        if value is not None and not 0 < value <= MAX_DIMENSION:
+            raise ValueError(f'w and h must be between 1 and {MAX_DIMENSION}')
+    fmt = fmt.lower() if fmt else None
+    if fmt is not None and fmt not in FORMATS:
+        raise ValueError(f"fmt must be one of {', '.join(sorted(FORMATS))}")
+    return width, height, fmt
+
+
+class ResizeCache:
+    """Disk cache of rendered sizes, bounded by total bytes"""
+
+    def __init__(self, directory=CACHE_DIR, max_bytes=RESIZE_CACHE_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # relative path -> size, least recently used first
+        self._total = 0
+        self._loaded = False
+        self._lock = threading.Lock()
+        self._rendering = {}  # key -> lock held while the key is rendered
+
+    @property
+    def enabled(self):
+        return Image is not None
+
+    def _load(self):
+        """Index the files already in the cache, oldest mtime first"""
+        files = []
+        for folder, _, names in os.walk(self.directory):
+            for name in names:
+                if name.endswith('.part'):
+                    continue
+                path = os.path.join(folder, name)
+                stat = os.stat(path)
+                files.append((stat.st_mtime, os.path.relpath(path, self.directory), stat.st_size))
+        for _, relative, size in sorted(files):
+            self._entries[relative] = size
+            self._total += size
+        self._loaded = True
+
+    @staticmethod
+    def key(source, width, height, fmt):
+        """
+        Cache key of a rendering of the upload with storage key `source`
+
+        Raises:
+            FileNotFoundError: If the source is not stored
+        """
+        if blob_digest(f'/uploads/{source}'):
+            version = ''
+        else:
+            version = get_storage().identity(source)
+            if version is None:
+                raise FileNotFoundError(source)
+        identity = '|'.join(map(str, (source, version, width, height, fmt, QUALITY)))
+        return hashlib.sha256(identity.encode()).hexdigest()
+
+    def get(self, source, width=None, height=None, fmt=None):
+        """
+        The cached rendering of the upload with storage key `source` at the
+        requested size, rendering it on a miss
+
+        Returns:
+            tuple: (path of the rendered file, key to use as ETag, mimetype)
+
+        Raises:
+            FileNotFoundError: If the source is not stored
+            OSError: If the source is not an image
+        """
+        if fmt is None:
+            fmt = SOURCE_FORMATS.get(source.rsplit('.', 1)[-1].lower(), 'png')
+        pillow_format, ext, mimetype = FORMATS[fmt]
+        key = self.key(source, width, height, fmt)
+        relative = os.path.join(key[:2], f'{key}.{ext}')
+        path = os.path.join(self.directory, relative)
+
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            render_lock = self._rendering.setdefault(key, threading.Lock())
+        with render_lock:
+            try:
+                if self._touch(relative, path):
+                    return path, key, mimetype
+                self._render(source, path, width, height, pillow_format)
+                self._add(relative, os.path.getsize(path))
+            finally:
+                with self._lock:
+                    self._rendering.pop(key, None)
+        return path, key, mimetype
+
+    def _touch(self, relative, path):
+        """Mark a cached entry as just used; False if it is not cached"""
+        with self._lock:
+            if relative not in self._entries:
+                return False
+            self._entries.move_to_end(relative)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            # Removed behind our back (e.g. the cache directory was cleared)
+            with self._lock:
+                self._total -= self._entries.pop(relative, 0)
+            return False
+        return True
+
+    def _add(self, relative, size):
+        evicted = []
+        with self._lock:
+            self._total += size - self._entries.pop(relative, 0)
+            self._entries[relative] = size
+            while self._total > self.max_bytes and len(self._entries) > 1:
+                old, old_size = self._entries.popitem(last=False)
+                self._total -= old_size
+                evicted.append(old)
+        for old in evicted:
+            try:
+                os.remove(os.path.join(self.directory, old))
+            except FileNotFoundError:
+                pass
+
+    @staticmethod
+    def _render(source, path, width, height, pillow_format):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with get_storage().local_file(source) as source_path, Image.open(source_path) as original:
+            bounds = (width or MAX_DIMENSION, height or MAX_DIMENSION)
+            # Square, since the EXIF orientation may still swap width and height
+            original.draft('RGB', (max(bounds),) * 2)
+            image = ImageOps.exif_transpose(original)
+            if pillow_format == 'JPEG':
+                image = image.convert('RGB')
+            elif image.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+                image = image.convert('RGBA')
+            image.thumbnail(bounds, Image.LANCZOS)
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.part')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    image.save(f, pillow_format, quality=QUALITY, optimize=True)
+                os.replace(temp_path, path)
+            except BaseException:
+                os.remove(temp_path)
+                raise
+
+    def total_bytes(self):
+        return self._total
+
+
+resize_cache = ResizeCache()
@@ -0,0 +1,127 @@
+"""
+Resized variants of uploaded images
+
+Originals are stored as uploaded, often several MB straight from a phone.
+After an upload the image worker writes smaller copies next to the original
+(`<name>_thumb.webp`, `<name>_medium.webp`): rotated upright from the EXIF
+orientation, stripped of EXIF and other metadata, and re-encoded at
+VARIANT_QUALITY (WebP, or JPEG where Pillow lacks WebP support).
+
+Their URLs are recorded on the document under `variants.<field>`, one entry
+per source URL in the same order as the field:
+
+    {'images': [...], 'variants': {'images': [{'source': ..., 'thumb': ..., 'medium': ...}]}}
+
+The entry is only written if the field still holds the same URLs, so a
+re-upload racing the worker never gets the previous image's variants. List
+endpoints return `thumbnail_urls(document, field)`, which falls back to the
+original until the variants exist.
+"""
+import io
+import os
+
+from app.utils.image_worker import image_worker
+from app.utils.storage import get_storage
+from app.utils.upload import BLOB_CACHE_CONTROL, blob_digest, upload_key
+
+try:
+    from PIL import Image, ImageOps, features
+except ImportError:
+    Image = None
+
+# Variant name -> longest side in pixels
+VARIANTS = {'thumb': 320, 'medium': 1280}
+VARIANT_QUALITY = int(os.environ.get('IMAGE_VARIANT_QUALITY', 80))
+VARIANT_FORMAT = 'WEBP' if Image is not None and features.check('webp') else 'JPEG'
+VARIANT_EXT = 'webp' if VARIANT_FORMAT == 'WEBP' else 'jpg'
+VARIANT_CONTENT_TYPE = 'image/webp' if VARIANT_FORMAT == 'WEBP' else 'image/jpeg'
+
+def variant_url(url, name):
+    """URL of one variant of an uploaded image"""
+    return f"{url.rsplit('.', 1)[0]}_{name}.{VARIANT_EXT}"
+
+def make_variants(url):
+    """
+    Write the variants of an uploaded image
+
+    Returns:
+        dict: {'source': url, <variant name>: variant URL, ...}, or None if the file is missing
+    """
+    if Image is None:
+        raise RuntimeError('Pillow is required for image variants')
+    key = upload_key(url)
+    if not key:
+        return None
+    storage = get_storage()
+    # Variants of a content-addressed image never change either
+    cache_control = BLOB_CACHE_CONTROL if blob_digest(url) else None
+    entry = {'source': url}
+    try:
+        with storage.local_file(key) as path:
+            _write_variants(storage, url, path, entry, cache_control)
+    except FileNotFoundError:
+        return None
+    return entry
+
+def _write_variants(storage, url, path, entry, cache_control):
+    with Image.open(path) as original:
+        # Decode large JPEGs straight at a reduced scale
+        original.draft('RGB', (max(VARIANTS.values()),) * 2)
+        image = ImageOps.exif_transpose(original)
+        has_alpha = image.mode in ('RGBA', 'LA', 'P') and VARIANT_FORMAT == 'WEBP'
+        image = image.convert('RGBA' if has_alpha else 'RGB')
+        for name, size in sorted(VARIANTS.items(), key=lambda pair: -pair[1]):
+            # Largest first, so each smaller variant is resized from the previous one
+            image.thumbnail((size, size), Image.LANCZOS)
+            target = upload_key(variant_url(url, name))
+            if not storage.exists(target):
+                # Otherwise made for an earlier upload of the same content
+                data = io.BytesIO()
+                # Saved without exif/icc arguments, so no metadata is carried over
+                image.save(data, VARIANT_FORMAT, quality=VARIANT_QUALITY, optimize=True)
+                data.seek(0)
+                storage.save(target, data, VARIANT_CONTENT_TYPE, cache_control)
+            entry[name] = variant_url(url, name)
+
+def build_variants(db, collection, document_id, field, value):
+    """Make the variants of the images in `field` and record them if the field is unchanged"""
+    urls = value if isinstance(value, list) else [value]
+    entries = [make_variants(url) or {'source': url} for url in urls if url]
+    db[collection].update_one(
+        {'_id': document_id, field: value},
+        {'$set': {f'variants.{field}': entries}}
+    )
+
+def queue_variants(db, collection, document_id, field, value):
+    """
+    Build the variants of a document's image field in the background
+
+    Args:
+        collection: Collection name, e.g. 'marketplace_items'
+        field: The image field, holding one URL or a list of URLs
+        value: The field's value as just written
+    """
+    if value:
+        image_worker.submit(build_variants, db, collection, document_id, field, value)
+
+def variant_keys(value):
+    """Storage keys of the variants an image field may have, for deleting them with the originals"""
+    urls = value if isinstance(value, list) else [value]
+    keys = []
+    for url in urls:
+        if url:
+            keys.extend(upload_key(variant_url(url, name)) for name in VARIANTS)
+    return [key for key in keys if key]
+
+def thumbnail_urls(document, field, name='thumb'):
+    """
+    The `name` variant of each image in `field`, or the original where it is
+    not built yet (a list for list fields, else a single URL or None)
+    """
+    value = document.get(field)
+    entries = {entry['source']: entry for entry in (document.get('variants') or {}).get(field, [])}
+    if isinstance(value, list):
+        return [entries.get(url, {}).get(name, url) for url in value]
+    if not value:
+        return None
+    return entries.get(value, {}).get(name, value)
@@ -0,0 +1,63 @@
+"""
+Background processing of uploaded images
+
+Decoding and re-encoding photos takes far longer than storing them, so
+uploads only queue the work (perceptual hashes, resized variants) and return.
+ImageWorker runs the queued jobs one at a time in a daemon thread.
+
+The jobs need Pillow. Without it the worker drops them, so uploads keep
+working and images are simply served as uploaded.
+"""
+import queue
+import threading
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+class ImageWorker:
+    """Queue of image jobs, worked through by one daemon thread"""
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._start_lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def enabled(self):
+        return Image is not None
+
+    def submit(self, job, *args):
+        """Run `job(*args)` in the background (dropped when Pillow is missing)"""
+        if not self.enabled:
+            return
+        self._start()
+        self._queue.put((job, args))
+
+    def _start(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                thread = threading.Thread(target=self._run, name='image-worker', daemon=True)
+                thread.start()
+                self._thread = thread
+
+    def _run(self):
+        while True:
+            job, args = self._queue.get()
+            try:
+                job(*args)
+            except Exception as e:
+                print(f"Image job {getattr(job, '__name__', job)} failed: {str(e)}")
+            finally:
+                self._queue.task_done()
+
+    def join(self):
+        """Wait until every submitted job has run"""
+        self._queue.join()
+
+
+image_worker = ImageWorker()
@@ -0,0 +1,233 @@
+"""
+Location normalization, token search and autocomplete for rides
+
+Pickup and drop-off places are free text. At write time every ride stores the
+normalized tokens of both places (`from_tokens`, `to_tokens`), which multikey
+indexes serve. Searches then match whole tokens, plus an anchored prefix for
+the last word being typed, instead of an unanchored case-insensitive regex
+over the raw text that no index can use.
+
+Autocomplete suggestions come from an in-memory trie of the places used by
+live rides. It is loaded once from the database and then kept up to date by
+the ride write paths, which add and remove places as rides change.
+"""
+import re
+import threading
+import unicodedata
+
+SUGGEST_LIMIT = 10
+MAX_SUGGEST_LIMIT = 25
+
+# Rides whose places are offered as suggestions
+LIVE_STATUSES = ['active', 'booked']
+
+_NON_WORD = re.compile(r'[\W_]+', re.UNICODE)
+
+def normalize_location(text):
+    """
+    Canonical form of a place name: lowercase, accents stripped, punctuation
+    replaced by single spaces
+    """
+    if not text:
+        return ''
+    decomposed = unicodedata.normalize('NFKD', str(text))
+    stripped = ''.join(ch for ch in decomposed if not unicodedata.combining(ch))
+    return _NON_WORD.sub(' ', stripped.lower()).strip()
+
+def location_tokens(text):
+    """Distinct tokens of a place name, in order of appearance"""
+    return list(dict.fromkeys(normalize_location(text).split()))
+
+def location_fields(from_location=None, to_location=None):
+    """
+    Derived search fields to store next to the raw locations of a ride
+
+    Only the locations that are given are returned, so the result can be
+    merged into a partial update.
+    """
+    fields = {}
+    if from_location is not None:
+        fields['from_tokens'] = location_tokens(from_location)
+    if to_location is not None:
+        fields['to_tokens'] = location_tokens(to_location)
+    return fields
+
+def token_query(field, text):
+    """
+    Query conditions matching rides whose `field` tokens contain the search text
+
+    Every complete word must match a token exactly; the last word also matches
+    as a prefix so partially typed input works. The prefix is an escaped,
+    anchored, case-sensitive regex over already normalized tokens, which the
+    index on `field` can answer with a range scan.
+
+    Returns:
+        list: Conditions to combine with $and (empty when the text has no tokens)
+    """
+    tokens = location_tokens(text)
+    if not tokens:
+        return []
+    *complete, last = tokens
+    conditions = [{field: token} for token in complete]
+    conditions.append({field: {'$regex': '^' + re.escape(last)}})
+    return conditions
+
+def token_matcher(text):
+    """
+    In-memory counterpart of token_query: a predicate over a ride's token list
+    with the same complete-word and last-word-prefix rules
+    """
+    tokens = location_tokens(text)
+    if not tokens:
+        return lambda ride_tokens: True
+    *complete, last = tokens
+
+    def matches(ride_tokens):
+        ride_tokens = ride_tokens or ()
+        return all(token in ride_tokens for token in complete) and any(
+            token.startswith(last) for token in ride_tokens
+        )
+    return matches
+
+def add_location_filters(query, from_text=None, to_text=None):
+    """Add from/to token conditions to a ride query in place"""
+    conditions = token_query('from_tokens', from_text) + token_query('to_tokens', to_text)
+    if conditions:
+        query.setdefault('$and', []).extend(conditions)
+    return query
+
+
+class _Node:
+    __slots__ = ('children', 'places')
+
+    def __init__(self):
+        self.children = {}
+        self.places = set()
+
+
+class LocationTrie:
+    """
+    Prefix tree of place names weighted by how many live rides use them
+
+    Each place is reachable from the start of every word in its normalized
+    name, so "sec" suggests "Uttara Sector 10". Places keep their most recent
+    display spelling.
+    """
+
+    def __init__(self):
+        self._root = _Node()
+        self._counts = {}
+        self._display = {}
+        self._lock = threading.Lock()
+
+    def _suffixes(self, key):
+        words = key.split()
+        return [' '.join(words[i:]) for i in range(len(words))]
+
+    def add(self, location):
+        key = normalize_location(location)
+        if not key:
+            return
+        with self._lock:
+            self._display[key] = location.strip()
+            self._counts[key] = self._counts.get(key, 0) + 1
+            if self._counts[key] > 1:
+                return
+            for suffix in self._suffixes(key):
+                node = self._root
+                for ch in suffix:
+                    node = node.children.setdefault(ch, _Node())
+                    node.places.add(key)
+
+    def remove(self, location):
+        key = normalize_location(location)
+        with self._lock:
+            if key not in self._counts:
+                return
+            self._counts[key] -= 1
+            if self._counts[key] > 0:
+                return
+            del self._counts[key]
+            del self._display[key]
+            for suffix in self._suffixes(key):
+                self._discard(self._root, suffix, 0, key)
+
+    def _discard(self, node, suffix, depth, key):
+        """Remove `key` along the path of `suffix`, pruning nodes left empty"""
+        if depth == len(suffix):
+            return
+        child = node.children.get(suffix[depth])
+        if child is None:
+            return
+        child.places.discard(key)
+        self._discard(child, suffix, depth + 1, key)
+        if not child.places:
+            del node.children[suffix[depth]]
+
+    def suggest(self, prefix, limit=SUGGEST_LIMIT):
+        """Most used places with a word starting with `prefix`"""
+        key = normalize_location(prefix)
+        if not key:
+            return []
+        with self._lock:
+            node = self._root
+            for ch in key:
+                node = node.children.get(ch)
+                if node is None:
+                    return []
+            ranked = sorted(node.places, key=lambda place: (-self._counts[place], place))[:limit]
+            return [{'location': self._display[place], 'rides': self._counts[place]} for place in ranked]
+
+    def __len__(self):
+        return len(self._counts)
+
+
+class LocationIndex:
+    """
+    Process-wide autocomplete index over the locations of live rides
+
+    Loaded lazily from the given collections on first use; afterwards the
+    ride write paths call `add_ride`/`remove_ride` so it never needs a full
+    rebuild.
+    """
+
+    def __init__(self):
+        self._trie = None
+        self._lock = threading.Lock()
+
+    def _ensure_loaded(self, db, collections):
+        if self._trie is not None:
+            return self._trie
+        with self._lock:
+            if self._trie is None:
+                trie = LocationTrie()
+                for name in collections:
+                    live = {'status': {'$in': LIVE_STATUSES}}
+                    for ride in db[name].find(live, {'from_location': 1, 'to_location': 1}):
+                        trie.add(ride.get('from_location') or '')
+                        trie.add(ride.get('to_location') or '')
+                self._trie = trie
+        return self._trie
+
+    def suggest(self, db, collections, prefix, limit=SUGGEST_LIMIT):
+        return self._ensure_loaded(db, collections).suggest(prefix, limit)
+
+    def add_ride(self, ride):
+        """Count the places of a new or reopened ride (no-op until loaded)"""
+        if self._trie is not None and ride:
+            self._trie.add(ride.get('from_location') or '')
+            self._trie.add(ride.get('to_location') or '')
+
+    def remove_ride(self, ride):
+        """Uncount the places of a deleted or closed ride (no-op until loaded)"""
+        if self._trie is not None and ride:
+            self._trie.remove(ride.get('from_location') or '')
+            self._trie.remove(ride.get('to_location') or '')
+
+    def reset(self):
+        """Drop the index; the next suggestion reloads it from the database"""
+        with self._lock:
+            self._trie = None
+
+
+location_index = LocationIndex()
@@ -0,0 +1,315 @@
+"""
+Automatic matching of lost and found reports
+
+Open lost and found items are kept in a process-wide inverted index from
+terms to item ids, one per item type. Terms are the words of the title and
+description, the words of the location (`loc:` prefix) and the category
+(`cat:` prefix). A new item only has to look at the items of the opposite
+type that share at least one term with it, and scores them on:
+
+- text: idf-weighted overlap of the title and description words, so rare
+  words like a brand count more than "black" or "bag";
+- location: overlap of the location words;
+- category: same category;
+- date: how close the two dates are (a found report dated well before the
+  loss does not match);
+- photo: how close the perceptual hashes of the two photos are.
+
+Items whose photos look alike are candidates even when they share no term:
+each item type keeps a BK-tree of photo hashes next to its postings. Photos
+are hashed by a background worker after the upload (`hash_photo`), which
+stores `image_hash` on the item and re-matches it.
+
+The best TOP_K candidates are stored in `lost_found_matches` (one document
+per item, `_id` = the item's id), and the new item is offered to each
+candidate's own top-k list with a `$push`/`$sort`/`$slice`, so reading the
+matches of an item is a single lookup. Items without a stored list yet
+(reported before the matcher existed) are matched on first request.
+
+Like the carpool matcher, the index is loaded lazily and then kept up to
+date by the lost & found write paths.
+"""
+import math
+import re
+import threading
+from datetime import datetime
+
+from bson import ObjectId
+from pymongo import ReturnDocument, UpdateOne
+
+from app.utils.image_hash import BKTree, MAX_DISTANCE, dhash, format_hash, hamming, parse_hash
+from app.utils.image_worker import image_worker
+from app.utils.locations import location_tokens, normalize_location
+from app.utils.storage import get_storage
+from app.utils.upload import upload_key
+
+TOP_K = 10
+MIN_SCORE = 0.15
+WEIGHTS = {'text': 0.4, 'location': 0.15, 'category': 0.15, 'date': 0.1, 'photo': 0.2}
+# A day apart scores ~0.87, a week apart ~0.37
+DATE_SCALE_DAYS = 7
+# Found reports may be dated up to this many days before the loss (typos, time zones)
+DATE_SLACK_DAYS = 1
+OPPOSITE = {'lost': 'found', 'found': 'lost'}
+
+_WORD = re.compile(r'[a-z0-9]+')
+STOPWORDS = frozenset(
+    'a an and are at by for from has have i in is it its my near of on or our the this to was were with '
+    'lost found item please contact if any someone'.split()
+)
+
+_indexes_ready = False
+
+def text_terms(*texts):
+    """Distinct significant words of some free text"""
+    words = _WORD.findall(normalize_location(' '.join(text or '' for text in texts)))
+    return {word for word in words if len(word) > 1 and word not in STOPWORDS}
+
+def item_date(value):
+    """Date of an item ('YYYY-MM-DD', an ISO timestamp or a datetime), or None"""
+    if isinstance(value, datetime):
+        return value.date()
+    try:
+        return datetime.strptime(str(value)[:10], '%Y-%m-%d').date()
+    except ValueError:
+        return None
+
+def item_entry(item):
+    """Matcher entry for a lost & found item"""
+    category = normalize_location(item.get('category'))
+    entry = {
+        'id': str(item['_id']),
+        'item_type': item.get('item_type'),
+        'text': text_terms(item.get('title'), item.get('description')),
+        'location': set(location_tokens(item.get('location'))),
+        'category': category or None,
+        'date': item_date(item.get('date')),
+        'photo': parse_hash(item.get('image_hash')),
+    }
+    entry['terms'] = entry['text'] | {f'loc:{token}' for token in entry['location']}
+    if category:
+        entry['terms'].add(f'cat:{category}')
+    return entry
+
+def matches_collection(db):
+    global _indexes_ready
+    collection = db.lost_found_matches
+    if not _indexes_ready:
+        # Finds the lists an item appears in when it is removed
+        collection.create_index([('matches.item_id', 1)])
+        _indexes_ready = True
+    return collection
+
+
+class LostFoundMatcher:
+    """Inverted index over open lost & found items"""
+
+    def __init__(self, top_k=TOP_K):
+        self.top_k = top_k
+        self._entries = {}
+        self._postings = {'lost': {}, 'found': {}}
+        self._photos = {'lost': BKTree(), 'found': BKTree()}
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def _ensure_loaded(self, db):
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            projection = {
+                'item_type': 1, 'title': 1, 'description': 1, 'location': 1, 'category': 1, 'date': 1,
+                'image_hash': 1,
+            }
+            for item in db.lost_found_items.find({'status': 'open'}, projection):
+                self._index(item_entry(item))
+            self._loaded = True
+
+    def _index(self, entry):
+        if entry['item_type'] not in self._postings:
+            return
+        self._unindex(entry['id'])
+        postings = self._postings[entry['item_type']]
+        for term in entry['terms']:
+            postings.setdefault(term, set()).add(entry['id'])
+        if entry['photo'] is not None:
+            self._photos[entry['item_type']].add(entry['photo'], entry['id'])
+        self._entries[entry['id']] = entry
+
+    def _unindex(self, item_id):
+        entry = self._entries.pop(item_id, None)
+        if entry is None:
+            return
+        postings = self._postings[entry['item_type']]
+        for term in entry['terms']:
+            ids = postings.get(term)
+            if ids is not None:
+                ids.discard(item_id)
+                if not ids:
+                    del postings[term]
+        self._photos[entry['item_type']].remove(item_id)
+
+    def _idf(self, term):
+        df = sum(len(postings.get(term, ())) for postings in self._postings.values())
+        return math.log(1 + len(self._entries) / max(df, 1))
+
+    def _score(self, entry, other):
+        """Similarity of two items in [0, 1]; symmetric, so both sides store the same score"""
+        score = 0.0
+        union = entry['text'] | other['text']
+        if union:
+            shared = entry['text'] & other['text']
+            score += WEIGHTS['text'] * sum(map(self._idf, shared)) / sum(map(self._idf, union))
+        if entry['location'] and other['location']:
+            score += WEIGHTS['location'] * (
+                len(entry['location'] & other['location']) / len(entry['location'] | other['location'])
+            )
+        if entry['category'] and entry['category'] == other['category']:
+            score += WEIGHTS['category']
+        if entry['date'] and other['date']:
+            lost, found = (entry, other) if entry['item_type'] == 'lost' else (other, entry)
+            days = (found['date'] - lost['date']).days
+            if days >= -DATE_SLACK_DAYS:
+                score += WEIGHTS['date'] * math.exp(-abs(days) / DATE_SCALE_DAYS)
+        if entry['photo'] is not None and other['photo'] is not None:
+            distance = hamming(entry['photo'], other['photo'])
+            if distance <= MAX_DISTANCE:
+                score += WEIGHTS['photo'] * (1 - distance / (MAX_DISTANCE + 1))
+        return score
+
+    def _top_matches(self, entry):
+        """Best open items of the opposite type, as (score, item id) pairs"""
+        opposite = OPPOSITE.get(entry['item_type'])
+        postings = self._postings.get(opposite, {})
+        candidates = set()
+        for term in entry['terms']:
+            candidates.update(postings.get(term, ()))
+        if entry['photo'] is not None and opposite:
+            candidates.update(other_id for _, other_id in self._photos[opposite].search(entry['photo']))
+        scored = [(self._score(entry, self._entries[other_id]), other_id) for other_id in candidates]
+        scored = [pair for pair in scored if pair[0] >= MIN_SCORE]
+        scored.sort(reverse=True)
+        return scored[:self.top_k]
+
+    def add(self, db, item):
+        """
+        Index an open item, store its best matches and offer it to each of
+        them (no-op for items that are not open)
+
+        Returns:
+            list: The stored matches, best first
+        """
+        if item.get('status', 'open') != 'open' or item.get('item_type') not in OPPOSITE:
+            return []
+        self._ensure_loaded(db)
+        with self._lock:
+            entry = item_entry(item)
+            self._index(entry)
+            top = self._top_matches(entry)
+
+        item_id = ObjectId(entry['id'])
+        matches = [{'item_id': ObjectId(other_id), 'score': round(score, 4)} for score, other_id in top]
+        collection = matches_collection(db)
+        collection.update_one(
+            {'_id': item_id},
+            {'$set': {'matches': matches, 'updated_at': datetime.utcnow()}},
+            upsert=True
+        )
+        operations = []
+        for match in matches:
+            offer = {'item_id': item_id, 'score': match['score']}
+            # Drop a previous score of this item first (it is re-added on updates)
+            operations.append(UpdateOne({'_id': match['item_id']}, {'$pull': {'matches': {'item_id': item_id}}}))
+            operations.append(UpdateOne(
+                {'_id': match['item_id']},
+                {'$push': {'matches': {'$each': [offer], '$sort': {'score': -1}, '$slice': self.top_k}}}
+            ))
+        if operations:
+            collection.bulk_write(operations)
+        return matches
+
+    def remove(self, db, item_id):
+        """Forget a deleted or closed item, including its place in other items' matches"""
+        with self._lock:
+            self._unindex(str(item_id))
+        item_id = ObjectId(item_id)
+        collection = matches_collection(db)
+        collection.delete_one({'_id': item_id})
+        collection.update_many({'matches.item_id': item_id}, {'$pull': {'matches': {'item_id': item_id}}})
+
+    def update(self, db, item):
+        """Re-match an edited item, or remove it once it is no longer open"""
+        self.remove(db, item['_id'])
+        return self.add(db, item)
+
+    def matches_for(self, db, item):
+        """
+        Stored matches of an item, best first, as (item, score) pairs of the
+        candidates that are still open
+        """
+        stored = matches_collection(db).find_one({'_id': item['_id']})
+        matches = stored['matches'] if stored else self.add(db, item)
+        if not matches:
+            return []
+        scores = {match['item_id']: match['score'] for match in matches}
+        items = db.lost_found_items.find({'_id': {'$in': list(scores)}, 'status': 'open'})
+        pairs = [(other, scores[other['_id']]) for other in items]
+        pairs.sort(key=lambda pair: pair[1], reverse=True)
+        return pairs
+
+    def similar_photos(self, db, item, max_distance=MAX_DISTANCE, limit=TOP_K):
+        """
+        Open items of either type whose photo looks like this item's, closest
+        first, as (item, distance) pairs
+        """
+        photo = parse_hash(item.get('image_hash'))
+        if photo is None:
+            return []
+        self._ensure_loaded(db)
+        item_id = str(item['_id'])
+        with self._lock:
+            found = [pair for photos in self._photos.values() for pair in photos.search(photo, max_distance)]
+        distances = {ObjectId(other_id): distance for distance, other_id in sorted(found) if other_id != item_id}
+        if not distances:
+            return []
+        items = db.lost_found_items.find({'_id': {'$in': list(distances)}, 'status': 'open'})
+        pairs = sorted(((other, distances[other['_id']]) for other in items), key=lambda pair: pair[1])
+        return pairs[:limit]
+
+    def hash_photo(self, db, item):
+        """
+        Hash the item's photo in the background, then store `image_hash` and
+        re-match the item with it (skipped if the photo changed meanwhile)
+        """
+        image = item.get('image')
+        key = upload_key(image)
+        if not key:
+            return
+
+        def hash_and_store():
+            try:
+                with get_storage().local_file(key) as path:
+                    image_hash = format_hash(dhash(path))
+            except FileNotFoundError:
+                return
+            updated = db.lost_found_items.find_one_and_update(
+                {'_id': item['_id'], 'image': image},
+                {'$set': {'image_hash': image_hash}},
+                return_document=ReturnDocument.AFTER
+            )
+            if updated:
+                self.update(db, updated)
+
+        image_worker.submit(hash_and_store)
+
+    def reset(self):
+        """Drop the index; the next lookup reloads it from the database"""
+        with self._lock:
+            self._entries = {}
+            self._postings = {'lost': {}, 'found': {}}
+            self._photos = {'lost': BKTree(), 'found': BKTree()}
+            self._loaded = False
+
+
+lost_found_matcher = LostFoundMatcher()
@@ -0,0 +1,148 @@
+"""
+Batched, resumable data migrations
+
+A migration walks one collection in _id order, rewriting the documents that
+need it with unordered bulk writes. After every batch the last processed _id
+is checkpointed in the `migrations` collection, so an interrupted run resumes
+where it stopped and a finished migration is skipped. Migrations run online:
+the application keeps serving while they progress, and the write paths
+already store documents in the migrated shape.
+"""
+import time
+from datetime import datetime
+from pymongo import UpdateOne
+
+class Migration:
+    """
+    Base class for a migration over a single collection
+
+    Subclasses set `name` and `collection` and implement `migrate_document`.
+    """
+    name = None
+    collection = None
+    batch_size = 1000
+
+    def query(self):
+        """Filter selecting the documents that may need migrating"""
+        return {}
+
+    def projection(self):
+        """Fields to fetch for each candidate document (None fetches everything)"""
+        return None
+
+    def migrate_document(self, document):
+        """
+        Build the update for one document
+
+        Returns:
+            dict: An update document such as {'$set': {...}}, or None to leave it untouched
+        """
+        raise NotImplementedError
+
+    def apply_batch(self, collection, documents):
+        """
+        Write one batch of migrated documents
+
+        The default rewrites each document in place with its `migrate_document`
+        update. Migrations that populate another collection override this.
+
+        Returns:
+            int: The number of documents modified
+        """
+        operations = []
+        for document in documents:
+            update = self.migrate_document(document)
+            if update:
+                operations.append(UpdateOne({'_id': document['_id']}, update))
+        if not operations:
+            return 0
+        return collection.bulk_write(operations, ordered=False).modified_count
+
+    def indexes(self):
+        """Indexes to create once the collection has been migrated, as (keys, options) pairs"""
+        return []
+
+def get_state(db, name):
+    """Get the stored progress of a migration, or None if it never ran"""
+    return db.migrations.find_one({'_id': name})
+
+def reset_state(db, name):
+    """Forget the progress of a migration so it runs again from the start"""
+    db.migrations.delete_one({'_id': name})
+
+def ensure_indexes(db, migration):
+    """Create the indexes declared by a migration"""
+    collection = db[migration.collection]
+    for keys, options in migration.indexes():
+        collection.create_index(keys, **options)
+
+def run_migration(db, migration, batch_size=None, max_batches=None, pause=0, log=print):
+    """
+    Run a migration until it completes or `max_batches` batches have been processed
+
+    Args:
+        db: The database to migrate
+        migration: A Migration instance
+        batch_size: Documents per batch (defaults to the migration's own batch size)
+        max_batches: Stop after this many batches; the next run resumes from the checkpoint
+        pause: Seconds to sleep between batches, to throttle load on a live database
+        log: Callable used to report progress
+
+    Returns:
+        dict: The migration state after the run
+    """
+    state = get_state(db, migration.name) or {}
+    if state.get('status') == 'done':
+        ensure_indexes(db, migration)
+        log(f"{migration.name}: already done ({state.get('modified', 0)} documents modified)")
+        return state
+
+    collection = db[migration.collection]
+    batch_size = batch_size or migration.batch_size
+    last_id = state.get('last_id')
+    processed = state.get('processed', 0)
+    modified = state.get('modified', 0)
+    batches = 0
+
+    db.migrations.update_one(
+        {'_id': migration.name},
+        {'$set': {'status': 'running', 'collection': migration.collection, 'updated_at': datetime.utcnow()},
+         '$setOnInsert': {'started_at': datetime.utcnow()}},
+        upsert=True
+    )
+
+    while max_batches is None or batches < max_batches:
+        query = {'$and': [migration.query(), {'_id': {'$gt': last_id}}]} if last_id is not None else migration.query()
+        documents = list(collection.find(query, migration.projection()).sort('_id', 1).limit(batch_size))
+        if not documents:
+            break
+
+        modified += migration.apply_batch(collection, documents)
+
+        processed += len(documents)
+        last_id = documents[-1]['_id']
+        batches += 1
+        db.migrations.update_one(
+            {'_id': migration.name},
+            {'$set': {
+                'last_id': last_id,
+                'processed': processed,
+                'modified': modified,
+                'updated_at': datetime.utcnow()
+            }}
+        )
+        log(f"{migration.name}: {processed} processed, {modified} modified")
+
+        if pause:
+            time.sleep(pause)
+    else:
+        # Stopped by max_batches; leave the migration resumable
+        return get_state(db, migration.name)
+
+    ensure_indexes(db, migration)
+    db.migrations.update_one(
+        {'_id': migration.name},
+        {'$set': {'status': 'done', 'finished_at': datetime.utcnow(), 'updated_at': datetime.utcnow()}}
+    )
+    log(f"{migration.name}: done ({processed} processed, {modified} modified)")
+    return get_state(db, migration.name)
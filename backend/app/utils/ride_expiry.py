@@ -0,0 +1,267 @@
+"""
+Expiry and archival of past rides
+
+Every ride stores `departure_at`, its departure as a naive UTC datetime, next
+to the user-facing date and time strings. A periodic sweep then:
+
+1. moves live rides whose departure is past into `completed` (someone booked
+   it) or `expired` (nobody did), and completes their open bookings, with
+   batched update_many calls;
+2. moves rides that were closed longer than the archive age ago, together
+   with their bookings, into the `<collection>_archive` and `bookings_archive`
+   cold collections;
+3. settles waitlist entries a promotion left half done (see
+   app.models.ride_waitlist).
+
+Ride requests (`rides` of type 'request') store a local-midnight `date` and
+an 'HH:MM' time instead; active ones past their departure are marked
+`expired` and leave the carpool matcher.
+
+Only recent rides stay in the hot collections, and the partial indexes on
+`departure_at` cover just the live ones, so they stay small however much
+history accumulates.
+"""
+import os
+from datetime import datetime, timedelta
+
+from pymongo import ReplaceOne
+
+from app.utils.carpool import carpool_matcher
+from app.utils.geo import departure_datetime
+from app.utils.locations import location_index
+from app.utils.ride_search_cache import ride_search_cache
+
+RIDE_COLLECTIONS = ('share_rides',)
+LIVE_STATUSES = ['active', 'booked']
+FINISHED_STATUSES = ['completed', 'expired']
+OPEN_BOOKING_STATUSES = ['active', 'confirmed', 'pending']
+
+# Ride dates and times are entered in local (Dhaka) time
+UTC_OFFSET = timedelta(hours=float(os.environ.get('RIDE_UTC_OFFSET_HOURS', 6)))
+# A ride stays listed for a while after its departure time in case it runs late
+EXPIRE_GRACE = timedelta(minutes=int(os.environ.get('RIDE_EXPIRE_GRACE_MINUTES', 30)))
+ARCHIVE_AFTER = timedelta(days=int(os.environ.get('RIDE_ARCHIVE_AFTER_DAYS', 30)))
+SWEEP_INTERVAL_SECONDS = int(os.environ.get('RIDE_SWEEP_INTERVAL_SECONDS', 300))
+BATCH_SIZE = 500
+
+def departure_fields(date, time):
+    """
+    Derived departure field to store with a ride's date and time
+
+    Returns:
+        dict: {'departure_at': <UTC datetime>}, or {} if the date/time cannot be parsed
+    """
+    local = departure_datetime(date, time)
+    return {'departure_at': local - UTC_OFFSET} if local else {}
+
+def ensure_sweep_indexes(db):
+    """
+    Indexes behind the sweep, each covering only the rides it looks for:
+    active rides and full rides by departure, and closed rides by closing time
+    """
+    for name in RIDE_COLLECTIONS:
+        db[name].create_index(
+            [('departure_at', 1)],
+            name='departure_at_active',
+            partialFilterExpression={'status': 'active'}
+        )
+        # Partial indexes need distinct key patterns, hence the leading status
+        db[name].create_index(
+            [('status', 1), ('departure_at', 1)],
+            name='departure_at_booked',
+            partialFilterExpression={'status': 'booked'}
+        )
+        db[name].create_index([('closed_at', 1)], sparse=True)
+    db.rides.create_index(
+        [('date', 1)],
+        name='request_date_active',
+        partialFilterExpression={'type': 'request', 'status': 'active'}
+    )
+    db.bookings.create_index([('ride_id', 1), ('status', 1)])
+    db.ride_waitlist.create_index(
+        [('updated_at', 1)],
+        name='updated_at_promoting',
+        partialFilterExpression={'status': 'promoting'}
+    )
+
+def expire_rides(db, collection, now=None, batch_size=BATCH_SIZE):
+    """
+    Close the live rides of a collection whose departure has passed
+
+    Returns:
+        dict: Number of rides marked completed and expired
+    """
+    now = now or datetime.utcnow()
+    cutoff = now - EXPIRE_GRACE
+    counts = {'completed': 0, 'expired': 0}
+    for live_status in LIVE_STATUSES:
+        while _expire_batch(db, collection, live_status, cutoff, now, batch_size, counts):
+            pass
+    return counts
+
+def _expire_batch(db, collection, live_status, cutoff, now, batch_size, counts):
+    """Close one batch of past rides with the given live status; returns False when none are left"""
+    rides = list(db[collection].find(
+        {'status': live_status, 'departure_at': {'$lt': cutoff}},
+        {'from_location': 1, 'to_location': 1, 'date': 1, 'status': 1}
+    ).limit(batch_size))
+    if not rides:
+        return False
+
+    ride_ids = [str(ride['_id']) for ride in rides]
+    booked = set(db.bookings.distinct(
+        'ride_id', {'ride_id': {'$in': ride_ids}, 'status': {'$in': OPEN_BOOKING_STATUSES}}
+    ))
+    completed = [ride['_id'] for ride in rides if ride['status'] == 'booked' or str(ride['_id']) in booked]
+    expired = [ride['_id'] for ride in rides if ride['status'] != 'booked' and str(ride['_id']) not in booked]
+
+    # The status guard keeps a concurrent edit from being overwritten
+    for status, ids in (('completed', completed), ('expired', expired)):
+        if ids:
+            result = db[collection].update_many(
+                {'_id': {'$in': ids}, 'status': {'$in': LIVE_STATUSES}},
+                {'$set': {'status': status, 'closed_at': now, 'updated_at': now}}
+            )
+            counts[status] += result.modified_count
+    if booked:
+        db.bookings.update_many(
+            {'ride_id': {'$in': list(booked)}, 'status': {'$in': OPEN_BOOKING_STATUSES}},
+            {'$set': {'status': 'completed', 'updated_at': now}}
+        )
+    db.ride_waitlist.update_many(
+        {'ride_id': {'$in': [ride['_id'] for ride in rides]}, 'status': 'waiting'},
+        {'$set': {'status': 'expired', 'updated_at': now}}
+    )
+
+    for ride in rides:
+        location_index.remove_ride(ride)
+        carpool_matcher.remove(ride['_id'])
+    ride_search_cache.invalidate(*{ride.get('date') for ride in rides})
+    return True
+
+def expire_ride_requests(db, now=None, batch_size=BATCH_SIZE):
+    """
+    Close the active ride requests whose departure has passed
+
+    A request without a parseable time stays open until its day is over.
+
+    Returns:
+        int: Number of requests marked expired
+    """
+    now = now or datetime.utcnow()
+    # Request dates and times are local
+    cutoff = now + UTC_OFFSET - EXPIRE_GRACE
+    requests = db.rides.find(
+        {'type': 'request', 'status': 'active', 'date': {'$lt': cutoff}}, {'date': 1, 'time': 1}
+    ).batch_size(batch_size)
+    past = []
+    for ride in requests:
+        date = ride['date']
+        departure = departure_datetime(date.strftime('%Y-%m-%d'), ride.get('time')) or date + timedelta(days=1)
+        if departure < cutoff:
+            past.append(ride['_id'])
+
+    expired = 0
+    for start in range(0, len(past), batch_size):
+        ids = past[start:start + batch_size]
+        result = db.rides.update_many(
+            {'_id': {'$in': ids}, 'status': 'active'},
+            {'$set': {'status': 'expired', 'closed_at': now, 'updated_at': now}}
+        )
+        expired += result.modified_count
+        for ride_id in ids:
+            carpool_matcher.remove(ride_id)
+    return expired
+
+def archive_rides(db, collection, now=None, batch_size=BATCH_SIZE):
+    """
+    Move rides closed more than ARCHIVE_AFTER ago, and their bookings, into
+    the cold archive collections
+
+    Copies are upserted before the originals are deleted, so an interrupted
+    run is safe to repeat.
+
+    Returns:
+        int: Number of rides archived
+    """
+    now = now or datetime.utcnow()
+    cutoff = now - ARCHIVE_AFTER
+    archive = db[f'{collection}_archive']
+    archived = 0
+    while True:
+        rides = list(db[collection].find(
+            {'closed_at': {'$lt': cutoff}, 'status': {'$in': FINISHED_STATUSES}}
+        ).limit(batch_size))
+        if not rides:
+            return archived
+
+        ride_ids = [str(ride['_id']) for ride in rides]
+        bookings = list(db.bookings.find({'ride_id': {'$in': ride_ids}}))
+        if bookings:
+            db.bookings_archive.bulk_write(
+                [ReplaceOne({'_id': booking['_id']}, dict(booking, archived_at=now), upsert=True)
+                 for booking in bookings],
+                ordered=False
+            )
+            db.bookings.delete_many({'_id': {'$in': [booking['_id'] for booking in bookings]}})
+
+        archive.bulk_write(
+            [ReplaceOne({'_id': ride['_id']}, dict(ride, archived_at=now), upsert=True) for ride in rides],
+            ordered=False
+        )
+        db[collection].delete_many({'_id': {'$in': [ride['_id'] for ride in rides]}})
+        archived += len(rides)
+
+def sweep(db, now=None, batch_size=BATCH_SIZE, archive=True, log=print):
+    """
+    Expire past rides and archive old ones in every ride collection
+
+    Returns:
+        dict: Per collection counts
+    """
+    now = now or datetime.utcnow()
+    results = {}
+    for collection in RIDE_COLLECTIONS:
+        counts = expire_rides(db, collection, now, batch_size)
+        if archive:
+            counts['archived'] = archive_rides(db, collection, now, batch_size)
+        results[collection] = counts
+        if any(counts.values()):
+            log(f"{collection}: {counts}")
+    expired = expire_ride_requests(db, now, batch_size)
+    results['ride_requests'] = {'expired': expired}
+    if expired:
+        log(f"ride_requests: {results['ride_requests']}")
+
+    # Imported here: the waitlist model depends on the ride repository, which imports this module
+    from app.models.ride_waitlist import RideWaitlist
+    recovered = RideWaitlist.recover_stale(db, now)
+    results['ride_waitlist'] = {'recovered': recovered}
+    if recovered:
+        log(f"ride_waitlist: {results['ride_waitlist']}")
+    return results
+
+def start_sweeper(app, socketio, interval=SWEEP_INTERVAL_SECONDS):
+    """
+    Run the sweep every `interval` seconds in a Socket.IO background task
+
+    A non-positive interval disables the sweeper (e.g. when sweep_rides.py
+    runs from cron instead).
+    """
+    if interval <= 0:
+        return None
+
+    def run():
+        indexed = False
+        while True:
+            try:
+                with app.app_context():
+                    if not indexed:
+                        ensure_sweep_indexes(app.db)
+                        indexed = True
+                    sweep(app.db, log=app.logger.info)
+            except Exception as e:
+                app.logger.error(f"Ride sweep failed: {str(e)}")
+            socketio.sleep(interval)
+
+    return socketio.start_background_task(run)
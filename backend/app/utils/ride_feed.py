@@ -0,0 +1,170 @@
+"""
+In-memory ride feed for read-heavy services
+
+RideFeed keeps a snapshot of the rides collection in memory and answers
+paged, filtered listings from it, so a request never waits on Mongo. A
+background thread keeps the snapshot current:
+
+- every refresh reads only the rides whose `updated_at` moved since the
+  newest one already seen (every ride write stamps it), re-reading a short
+  overlap so a write stamped just before a refresh but committed just after
+  it is not missed;
+- hard deletes leave nothing to find by `updated_at`, so every few
+  refreshes the ids in the snapshot are reconciled against an _id-only scan
+  of the collection.
+
+Writes are not handled here: the service sends them to the main store
+(RideRepository) and applies the result to the snapshot with `put` or
+`remove`, so its own writes show up immediately.
+"""
+import heapq
+import os
+import threading
+import time
+from datetime import timedelta
+
+from app.utils.ids import stringify_ids
+from app.utils.locations import location_tokens, token_matcher
+
+REFRESH_SECONDS = float(os.environ.get('RIDE_FEED_REFRESH_SECONDS', 5))
+# Compare the snapshot's ids with the collection every this many refreshes
+RECONCILE_EVERY = 12
+OVERLAP = timedelta(seconds=5)
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+class RideFeed:
+    """Snapshot of the rides collection, refreshed from updated_at deltas"""
+
+    def __init__(self, repository, serialize=None, refresh_seconds=REFRESH_SECONDS):
+        """
+        Args:
+            repository: RideRepository to read from
+            serialize: Called on each ride before it is stored (e.g. as_post)
+            refresh_seconds: Delay between background refreshes
+        """
+        self.repository = repository
+        self.serialize = serialize
+        self.refresh_seconds = refresh_seconds
+        self._rides = {}
+        self._ordered = None  # rides by date and time, rebuilt after a change
+        self._since = None    # newest updated_at seen
+        self._refreshes = 0
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._thread = None
+
+    def _put(self, ride):
+        updated_at = ride.get('updated_at')
+        if updated_at and (self._since is None or updated_at > self._since):
+            self._since = updated_at
+        # Derived from the locations here, so tokens stored before an edit cannot go stale
+        if 'from_location' in ride or 'from_tokens' not in ride:
+            ride['from_tokens'] = location_tokens(ride.get('from_location'))
+        if 'to_location' in ride or 'to_tokens' not in ride:
+            ride['to_tokens'] = location_tokens(ride.get('to_location'))
+        if self.serialize:
+            ride = self.serialize(ride)
+        stringify_ids(ride)
+        self._rides[ride['_id']] = ride
+        self._ordered = None
+
+    def load(self):
+        """Replace the snapshot with the whole collection"""
+        rides = self.repository.find()
+        with self._lock:
+            self._rides = {}
+            self._since = None
+            for ride in rides:
+                self._put(ride)
+            self._ordered = None
+
+    def refresh(self):
+        """Apply the rides changed since the last refresh; returns how many were read"""
+        since = self._since
+        query = {'updated_at': {'$gte': since - OVERLAP}} if since else {'updated_at': {'$exists': True}}
+        changed = self.repository.find(query)
+        with self._lock:
+            for ride in changed:
+                self._put(ride)
+        self._refreshes += 1
+        if self._refreshes % RECONCILE_EVERY == 0:
+            self.reconcile()
+        return len(changed)
+
+    def reconcile(self):
+        """Drop rides that were deleted from the collection"""
+        ids = {str(ride['_id']) for ride in self.repository.find(projection={'_id': 1})}
+        with self._lock:
+            for ride_id in [ride_id for ride_id in self._rides if ride_id not in ids]:
+                del self._rides[ride_id]
+                self._ordered = None
+
+    def put(self, ride):
+        """Apply a ride just written through the main store"""
+        with self._lock:
+            self._put(dict(ride))
+
+    def remove(self, ride_id):
+        """Apply a ride just deleted through the main store"""
+        with self._lock:
+            if self._rides.pop(str(ride_id), None) is not None:
+                self._ordered = None
+
+    def start(self):
+        """Load the snapshot and keep refreshing it in a daemon thread (once; later calls are no-ops)"""
+        if self._thread is not None:
+            return self._thread
+        with self._start_lock:
+            if self._thread is not None:
+                return self._thread
+            self.load()
+            thread = threading.Thread(target=self._run, name='ride-feed', daemon=True)
+            thread.start()
+            self._thread = thread
+        return thread
+
+    def _run(self):
+        while True:
+            time.sleep(self.refresh_seconds)
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Ride feed refresh failed: {str(e)}")
+
+    def query(self, from_location=None, to_location=None, date=None, status=None, offset=0, limit=PAGE_SIZE):
+        """
+        One page of the rides matching the filters, by date and time
+
+        Locations match like the indexed search (whole words, last word as a
+        prefix).
+
+        Returns:
+            tuple: (total number of matches, rides on the page)
+        """
+        with self._lock:
+            if self._ordered is None:
+                self._ordered = sorted(
+                    self._rides.values(),
+                    key=lambda ride: (str(ride.get('date') or ''), str(ride.get('time') or ''), ride['_id'])
+                )
+            ordered = self._ordered
+        from_matches = token_matcher(from_location)
+        to_matches = token_matcher(to_location)
+        matches = [
+            ride for ride in ordered
+            if (not date or ride.get('date') == date)
+            and (not status or ride.get('status') == status)
+            and from_matches(ride.get('from_tokens'))
+            and to_matches(ride.get('to_tokens'))
+        ]
+        return len(matches), matches[offset:offset + limit]
+
+    def count(self):
+        return len(self._rides)
+
+    def recent(self, limit=5):
+        """The most recently created rides"""
+        with self._lock:
+            return heapq.nlargest(limit, self._rides.values(), key=lambda ride: ride['_id'])
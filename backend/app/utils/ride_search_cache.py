@@ -0,0 +1,114 @@
+"""
+Cached ride search results
+
+The same origin/destination/date searches repeat many times a minute. Their
+results are cached per normalized query and validated with version counters
+instead of being deleted on writes. Every date has a counter, and there is
+one more for searches without a date. A ride create, edit, delete or booking
+change bumps the counter of the ride's date (and the undated one), so only
+the searches that could see that ride are recomputed.
+
+Misses are single-flight: while one request loads a query, concurrent
+requests for the same query wait for its result, so a stampede right after
+an invalidation costs one Mongo query. A short TTL bounds staleness from
+writes made by other processes.
+"""
+import copy
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from app.utils.locations import normalize_location
+
+TTL_SECONDS = float(os.environ.get('RIDE_SEARCH_CACHE_SECONDS', 60))
+MAX_ENTRIES = int(os.environ.get('RIDE_SEARCH_CACHE_SIZE', 1024))
+
+
+class _Flight:
+    """A load in progress that concurrent requests for the same query wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.rides = None
+        self.error = None
+
+
+class RideSearchCache:
+    """Process-wide LRU of search results, invalidated by per-date versions"""
+
+    def __init__(self, ttl=TTL_SECONDS, max_entries=MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (version, expires_at, rides)
+        self._versions = {}
+        self._undated_version = 0
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(from_location=None, to_location=None, date=None):
+        return (normalize_location(from_location or ''), normalize_location(to_location or ''), date or None)
+
+    def _version(self, date):
+        return self._versions.get(date, 0) if date else self._undated_version
+
+    def get_or_load(self, from_location, to_location, date, load):
+        """
+        Cached results of a search, calling `load()` at most once per
+        query and version when they are missing or stale
+
+        Callers get their own copy of the rides and may modify them.
+        """
+        if self.ttl <= 0:
+            return load()
+        key = self.key(from_location, to_location, date)
+        with self._lock:
+            version = self._version(key[2])
+            entry = self._entries.get(key)
+            if entry and entry[0] == version and entry[1] > time.monotonic():
+                self._entries.move_to_end(key)
+                return copy.deepcopy(entry[2])
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return copy.deepcopy(flight.rides)
+
+        try:
+            flight.rides = load()
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+                if flight.error is None:
+                    # Stored under the version seen before loading, so a write
+                    # that raced the load makes the next search reload
+                    self._entries[key] = (version, time.monotonic() + self.ttl, flight.rides)
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+            flight.done.set()
+        return copy.deepcopy(flight.rides)
+
+    def invalidate(self, *dates):
+        """Make cached searches over the given ride dates, and undated searches, stale"""
+        with self._lock:
+            self._undated_version += 1
+            for date in dates:
+                if date:
+                    self._versions[date] = self._versions.get(date, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+ride_search_cache = RideSearchCache()
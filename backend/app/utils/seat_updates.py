@@ -0,0 +1,72 @@
+"""
+Coalesced seat-availability push for ride viewers
+
+Clients viewing a ride join its `ride:<ride_id>` Socket.IO room; clients
+viewing the rides of a day join `rides:<date>`. Write paths that change a
+ride's seats or status call `seat_updates.publish(ride)`. Changes are held for
+a short interval and then emitted as one compact `seats_changed` event per
+room, carrying only the latest state of each changed ride, so a burst of
+bookings on a busy ride costs one emit instead of one per booking.
+
+Payload: {'rides': [{'ride_id', 'seats_available', 'status'}, ...]}; a
+deleted ride is sent with status 'deleted'.
+"""
+import os
+import threading
+
+from app.extensions import socketio
+
+COALESCE_SECONDS = float(os.environ.get('SEAT_UPDATES_COALESCE_SECONDS', 0.5))
+
+def ride_room(ride_id):
+    return f'ride:{ride_id}'
+
+def date_room(date):
+    return f'rides:{date}'
+
+
+class SeatUpdates:
+    """Buffers the latest seat state per ride and flushes it every interval"""
+
+    def __init__(self, interval=COALESCE_SECONDS):
+        self.interval = interval
+        self._pending = {}
+        self._scheduled = False
+        self._lock = threading.Lock()
+
+    def publish(self, ride, deleted=False):
+        """Queue the current seats and status of a ride for its viewers"""
+        if not ride or socketio.server is None:
+            return
+        delta = {
+            'ride_id': str(ride['_id']),
+            'seats_available': ride.get('seats_available'),
+            'status': 'deleted' if deleted else ride.get('status')
+        }
+        with self._lock:
+            self._pending[delta['ride_id']] = (delta, ride.get('date'))
+            if self._scheduled:
+                return
+            self._scheduled = True
+        socketio.start_background_task(self._flush_later)
+
+    def _flush_later(self):
+        socketio.sleep(self.interval)
+        self.flush()
+
+    def flush(self):
+        """Emit everything queued since the last flush"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._scheduled = False
+
+        by_date = {}
+        for ride_id, (delta, date) in pending.items():
+            socketio.emit('seats_changed', {'rides': [delta]}, room=ride_room(ride_id))
+            if date:
+                by_date.setdefault(date, []).append(delta)
+        for date, deltas in by_date.items():
+            socketio.emit('seats_changed', {'rides': deltas}, room=date_room(date))
+
+
+seat_updates = SeatUpdates()
@@ -0,0 +1,77 @@
+"""
+Atomic seat reservation for ride collections
+
+Seats are taken with a single conditional find_one_and_update: the filter only
+matches while enough seats are left, and the same write decrements them. Two
+concurrent bookings can therefore never both see the last seat, and a booking
+costs one round trip on the ride instead of a read followed by a write.
+"""
+from datetime import datetime
+from pymongo import ReturnDocument
+
+def reserve_seats(collection, ride_id, seats, query=None, update=None, full_status=None):
+    """
+    Take seats on a ride if enough are still available
+
+    Args:
+        collection: The rides collection
+        ride_id: The ride's ObjectId
+        seats: Number of seats to take (must be positive)
+        query: Extra conditions the ride must meet (e.g. status, not owned by the booker)
+        update: Extra update operators applied in the same write (e.g. $push, $set)
+        full_status: Status to give the ride once its last seat is taken
+
+    Returns:
+        dict: The ride after the reservation, or None if it did not match
+        (missing, not bookable or not enough seats)
+    """
+    if seats <= 0:
+        raise ValueError('Seats must be a positive number')
+
+    ride_query = dict(query or {})
+    ride_query.update({'_id': ride_id, 'seats_available': {'$gte': seats}})
+    ride_update = dict(update or {})
+    ride_update['$inc'] = dict(ride_update.get('$inc', {}), seats_available=-seats)
+
+    ride = collection.find_one_and_update(ride_query, ride_update, return_document=ReturnDocument.AFTER)
+    if ride and full_status and ride['seats_available'] == 0:
+        # Guarded by the seat count so a release racing in between keeps the ride open
+        collection.update_one(
+            {'_id': ride_id, 'seats_available': 0, 'status': ride.get('status')},
+            {'$set': {'status': full_status, 'updated_at': datetime.utcnow()}}
+        )
+        ride['status'] = full_status
+    return ride
+
+def release_seats(collection, ride_id, seats, update=None, full_status=None, open_status=None, array_filters=None):
+    """
+    Give seats back to a ride, reopening it if it was full
+
+    Also used as the compensating write when a booking cannot be stored after
+    its seats were reserved.
+
+    Args:
+        collection: The rides collection
+        ride_id: The ride's ObjectId
+        seats: Number of seats to give back
+        update: Extra update operators applied in the same write
+        full_status: Status a full ride has
+        open_status: Status to restore when a full ride gets seats back
+        array_filters: Array filters for positional operators in `update`
+
+    Returns:
+        dict: The ride after the release, or None if it no longer exists
+    """
+    ride_update = dict(update or {})
+    ride_update['$inc'] = dict(ride_update.get('$inc', {}), seats_available=seats)
+
+    ride = collection.find_one_and_update(
+        {'_id': ride_id}, ride_update, array_filters=array_filters, return_document=ReturnDocument.AFTER
+    )
+    if ride and full_status and ride.get('status') == full_status and ride['seats_available'] > 0:
+        collection.update_one(
+            {'_id': ride_id, 'status': full_status, 'seats_available': {'$gt': 0}},
+            {'$set': {'status': open_status, 'updated_at': datetime.utcnow()}}
+        )
+        ride['status'] = open_status
+    return ride
@@ -0,0 +1,288 @@
+"""
+Where uploaded files are kept
+
+Uploads are addressed by a key relative to the uploads root, e.g.
+`blobs/ab/<digest>.jpg`, and their URL is always `/uploads/<key>` whatever
+the backend. UPLOAD_STORAGE picks the backend:
+
+- `local` (default): files under UPLOAD_ROOT on this host's disk, served by
+  the app (see app.utils.upload_serving).
+- `s3`: objects in S3_BUCKET on an S3-compatible service (AWS S3, MinIO,
+  ...). Writes are streamed to the bucket in multipart chunks,
+  `/uploads/<key>` redirects to the object (under S3_PUBLIC_URL, or
+  presigned), and clients can PUT images straight into the bucket with
+  `presigned_upload`. Needs boto3.
+
+To run against a local MinIO:
+
+    docker run -p 9000:9000 minio/minio server /data
+    UPLOAD_STORAGE=s3 S3_BUCKET=uploads S3_ENDPOINT_URL=http://localhost:9000 \\
+        S3_ACCESS_KEY_ID=minioadmin S3_SECRET_ACCESS_KEY=minioadmin
+
+The bucket is created on first use if it does not exist.
+"""
+import base64
+import os
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+
+try:
+    import boto3
+    from boto3.s3.transfer import TransferConfig
+    from botocore.config import Config
+    from botocore.exceptions import ClientError
+except ImportError:
+    boto3 = None
+
+UPLOAD_ROOT = os.environ.get(
+    'UPLOAD_ROOT',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'uploads')
+)
+UPLOAD_STORAGE = os.environ.get('UPLOAD_STORAGE', 'local').lower()
+# Bytes per part of a multipart upload to S3, and the size from which parts are used
+S3_PART_BYTES = int(os.environ.get('S3_PART_BYTES', 8 * 1024 * 1024))
+# Lifetime of presigned URLs
+S3_URL_EXPIRES = int(os.environ.get('S3_URL_EXPIRES', 3600))
+COPY_CHUNK = 64 * 1024
+
+
+class LocalStorage:
+    """Uploads as files under `root`"""
+
+    # Served by the app, which also answers ranges and revalidations
+    download_url_expires = None
+
+    def __init__(self, root=UPLOAD_ROOT):
+        self.root = os.path.abspath(root)
+
+    def path(self, key):
+        """Path of a key's file, or None if the key points outside the root"""
+        path = os.path.normpath(os.path.join(self.root, key))
+        return path if path.startswith(self.root + os.sep) else None
+
+    def exists(self, key):
+        path = self.path(key)
+        return path is not None and os.path.isfile(path)
+
+    def identity(self, key):
+        """A string that changes whenever the file does, or None if it is missing"""
+        try:
+            stat = os.stat(self.path(key))
+        except (FileNotFoundError, TypeError):
+            return None
+        return f'{stat.st_size}-{stat.st_mtime_ns}'
+
+    def checksum(self, key):
+        """SHA-256 recorded by the backend for the file; the local disk records none"""
+        return None
+
+    def save(self, key, fileobj, content_type=None, cache_control=None):
+        """Write `fileobj` to `key`, replacing it atomically"""
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                shutil.copyfileobj(fileobj, f, COPY_CHUNK)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    def move(self, key, target):
+        """Rename `key` to `target`; False if `key` does not exist"""
+        try:
+            os.replace(self.path(key), self.path(target))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def delete(self, key):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    @contextmanager
+    def local_file(self, key):
+        """
+        Path of a local file holding the key's content, for the duration of the block
+
+        Raises:
+            FileNotFoundError: If the key does not exist
+        """
+        path = self.path(key)
+        if path is None or not os.path.isfile(path):
+            raise FileNotFoundError(key)
+        yield path
+
+    def download_url(self, key):
+        return None
+
+    def presigned_upload(self, key, content_type, size, sha256, cache_control=None):
+        """Direct uploads need an object store; files on disk go through the app"""
+        return None
+
+
+class S3Storage:
+    """Uploads as objects in an S3-compatible bucket"""
+
+    def __init__(self, bucket, endpoint_url=None, region=None, access_key=None, secret_key=None,
+                 public_url=None, url_expires=S3_URL_EXPIRES, part_bytes=S3_PART_BYTES):
+        if boto3 is None:
+            raise RuntimeError('boto3 is required for S3 upload storage')
+        self.bucket = bucket
+        self.public_url = public_url.rstrip('/') if public_url else None
+        self.url_expires = url_expires
+        # Public URLs do not expire; presigned ones must not be cached past their lifetime
+        self.download_url_expires = None if self.public_url else url_expires
+        self.client = boto3.client(
+            's3',
+            endpoint_url=endpoint_url,
+            region_name=region,
+            aws_access_key_id=access_key,
+            aws_secret_access_key=secret_key,
+            # Path-style addressing works with MinIO and other self-hosted services
+            config=Config(signature_version='s3v4', s3={'addressing_style': 'path'}),
+        )
+        self.transfer = TransferConfig(multipart_threshold=part_bytes, multipart_chunksize=part_bytes)
+        self._bucket_ready = False
+        self._bucket_lock = threading.Lock()
+
+    def _ensure_bucket(self):
+        if self._bucket_ready:
+            return
+        with self._bucket_lock:
+            if self._bucket_ready:
+                return
+            try:
+                self.client.head_bucket(Bucket=self.bucket)
+            except ClientError:
+                self.client.create_bucket(Bucket=self.bucket)
+            self._bucket_ready = True
+
+    def _head(self, key, **kwargs):
+        self._ensure_bucket()
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=key, **kwargs)
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+
+    def exists(self, key):
+        return self._head(key) is not None
+
+    def identity(self, key):
+        head = self._head(key)
+        return head['ETag'].strip('"') if head else None
+
+    def checksum(self, key):
+        """Hex SHA-256 the bucket verified on upload, or None if it keeps none"""
+        head = self._head(key, ChecksumMode='ENABLED')
+        value = head.get('ChecksumSHA256') if head else None
+        # Multipart checksums ("...-<parts>") are over the parts, not the content
+        if not value or '-' in value:
+            return None
+        return base64.b64decode(value).hex()
+
+    def save(self, key, fileobj, content_type=None, cache_control=None):
+        """Stream `fileobj` to the bucket, in parts once it passes the multipart threshold"""
+        self._ensure_bucket()
+        extra = {}
+        if content_type:
+            extra['ContentType'] = content_type
+        if cache_control:
+            extra['CacheControl'] = cache_control
+        self.client.upload_fileobj(fileobj, self.bucket, key, ExtraArgs=extra, Config=self.transfer)
+
+    def move(self, key, target):
+        if not self.exists(key):
+            return False
+        self.client.copy_object(Bucket=self.bucket, Key=target, CopySource={'Bucket': self.bucket, 'Key': key})
+        self.client.delete_object(Bucket=self.bucket, Key=key)
+        return True
+
+    def delete(self, key):
+        self._ensure_bucket()
+        self.client.delete_object(Bucket=self.bucket, Key=key)
+
+    @contextmanager
+    def local_file(self, key):
+        """Download the object to a temporary file for the duration of the block"""
+        self._ensure_bucket()
+        fd, path = tempfile.mkstemp(suffix=os.path.splitext(key)[1])
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                try:
+                    self.client.download_fileobj(self.bucket, key, f, Config=self.transfer)
+                except ClientError as e:
+                    if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+                        raise FileNotFoundError(key)
+                    raise
+            yield path
+        finally:
+            os.remove(path)
+
+    def download_url(self, key):
+        if self.public_url:
+            return f'{self.public_url}/{key}'
+        return self.client.generate_presigned_url(
+            'get_object', Params={'Bucket': self.bucket, 'Key': key}, ExpiresIn=self.url_expires
+        )
+
+    def presigned_upload(self, key, content_type, size, sha256, cache_control=None):
+        """
+        A presigned PUT for uploading exactly one file to `key`
+
+        The content type, length and SHA-256 are signed, so the bucket rejects
+        any other body.
+
+        Returns:
+            dict: {'method', 'url', 'headers'}; the client must send the headers as given
+        """
+        self._ensure_bucket()
+        checksum = base64.b64encode(bytes.fromhex(sha256)).decode()
+        params = {
+            'Bucket': self.bucket,
+            'Key': key,
+            'ContentType': content_type,
+            'ContentLength': size,
+            'ChecksumSHA256': checksum,
+        }
+        headers = {'Content-Type': content_type, 'x-amz-checksum-sha256': checksum}
+        if cache_control:
+            params['CacheControl'] = cache_control
+            headers['Cache-Control'] = cache_control
+        url = self.client.generate_presigned_url('put_object', Params=params, ExpiresIn=self.url_expires)
+        return {'method': 'PUT', 'url': url, 'headers': headers}
+
+
+_storage = None
+_storage_lock = threading.Lock()
+
+def create_storage():
+    """The backend configured by UPLOAD_STORAGE and its settings"""
+    if UPLOAD_STORAGE == 's3':
+        return S3Storage(
+            os.environ['S3_BUCKET'],
+            endpoint_url=os.environ.get('S3_ENDPOINT_URL'),
+            region=os.environ.get('S3_REGION'),
+            access_key=os.environ.get('S3_ACCESS_KEY_ID'),
+            secret_key=os.environ.get('S3_SECRET_ACCESS_KEY'),
+            public_url=os.environ.get('S3_PUBLIC_URL'),
+        )
+    if UPLOAD_STORAGE != 'local':
+        raise ValueError(f'Unknown UPLOAD_STORAGE: {UPLOAD_STORAGE}')
+    return LocalStorage()
+
+def get_storage():
+    """The process-wide upload storage, created on first use"""
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                _storage = create_storage()
+    return _storage
@@ -1,40 +1,370 @@
+"""
+Storage of uploaded images
+
+Uploads are content-addressed: a file is stored once under the SHA-256 of
+its bytes (`/uploads/blobs/<2 hex>/<digest>.<ext>`), however many times and
+by whomever it is uploaded. The `uploads` collection keeps one document per
+stored file with a reference count. Every save adds a reference, and a
+duplicate save resolves to the existing file without writing it again. Code
+that drops an image calls `release_upload` (app.utils.upload_refs) instead of
+removing the file. Files nobody references any more are deleted later by the
+upload collector.
+
+Files are kept by the configured storage backend (app.utils.storage). With
+an object store, clients can also upload an image straight to the bucket
+(`presign_upload`) and send its URL in place of the image (`save_image_data`).
+
+Files uploaded before content addressing keep their old URLs and are not
+reference counted.
+"""
+import binascii
+import hashlib
+import io
 import os
+import posixpath
+import re
+from datetime import datetime
+from pymongo import ReturnDocument
 from werkzeug.utils import secure_filename
-import uuid
 
-def save_image(file, folder):
+from app.db import get_db
+from app.utils.storage import get_storage
+
+BLOB_FOLDER = 'blobs'
+# Largest accepted image, uploaded as a file or decoded from a base64 data URL
+MAX_IMAGE_BYTES = int(os.environ.get('MAX_IMAGE_UPLOAD_BYTES', 10 * 1024 * 1024))
+# Base64 characters decoded per step (a multiple of 4)
+DECODE_CHUNK = 64 * 1024
+# Bytes read per step when hashing an uploaded file
+READ_CHUNK = 64 * 1024
+# A data URL header ("data:image/jpeg;base64,") is never longer than this
+MAX_HEADER = 256
+# Content-addressed files never change, wherever they are served from
+BLOB_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+# Leading bytes of the accepted formats -> extension
+IMAGE_SIGNATURES = (
+    (b'\xff\xd8\xff', 'jpg'),
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+)
+CONTENT_TYPES = {'jpg': 'image/jpeg', 'png': 'image/png', 'gif': 'image/gif', 'webp': 'image/webp'}
+# Kinds of upload a client may store directly in the bucket
+UPLOAD_FOLDERS = {'marketplace', 'lost_found', 'profiles', 'messages'}
+
+_BLOB_URL = re.compile(rf'/uploads/{BLOB_FOLDER}/[0-9a-f]{{2}}/([0-9a-f]{{64}})\.[a-z]+$')
+
+_indexes_ready = False
+
+def uploads_collection(db=None):
+    global _indexes_ready
+    collection = (db if db is not None else get_db()).uploads
+    if not _indexes_ready:
+        # Finds unreferenced files for the collector
+        collection.create_index([('refs', 1), ('released_at', 1)])
+        _indexes_ready = True
+    return collection
+
+def blob_url(digest, ext):
+    return f"/uploads/{BLOB_FOLDER}/{digest[:2]}/{digest}.{ext}"
+
+def blob_digest(url):
+    """Digest of a content-addressed upload URL, or None for other URLs"""
+    match = _BLOB_URL.search(url or '')
+    return match.group(1) if match else None
+
+def upload_key(url):
+    """
+    Storage key of an uploaded file from its `/uploads/...` URL
+
+    Returns:
+        str: The key, or None if the URL does not point into the uploads
+    """
+    if not url or '/uploads/' not in url:
+        return None
+    key = posixpath.normpath(url.split('/uploads/', 1)[1].split('?', 1)[0])
+    if key.startswith(('/', '..')) or key == '.':
+        return None
+    return key
+
+def _too_large(max_bytes):
+    return ValueError(f'Image is too large (max {max_bytes / (1024 * 1024):.1f} MB)')
+
+def _store(digest, ext, size, folder, open_data, db=None):
     """
-    Save an uploaded image to the specified folder
-    
+    Add a reference to the file with this digest, storing the bytes from
+    `open_data()` only if no verified copy exists yet
+
+    Returns:
+        str: The URL of the stored file
+    """
+    url = blob_url(digest, ext)
+    collection = uploads_collection(db)
+    # Reference first: the collector only deletes files whose count is zero,
+    # and restores a file it finds referenced again
+    before = collection.find_one_and_update(
+        {'_id': digest},
+        {'$inc': {'refs': 1},
+         '$unset': {'released_at': ''},
+         '$setOnInsert': {'url': url, 'size': size, 'folder': folder, 'created_at': datetime.utcnow()}},
+        projection={'pending': 1},
+        upsert=True,
+        return_document=ReturnDocument.BEFORE
+    )
+    key = upload_key(url)
+    storage = get_storage()
+    # A pending direct upload is not verified yet; our bytes are
+    pending = before is not None and before.get('pending')
+    if pending or not storage.exists(key):
+        storage.save(key, open_data(), CONTENT_TYPES[ext], BLOB_CACHE_CONTROL)
+    if pending:
+        collection.update_one({'_id': digest}, {'$unset': {'pending': ''}})
+    return url
+
+def save_image(file, folder, max_bytes=MAX_IMAGE_BYTES, db=None):
+    """
+    Save an uploaded image, or add a reference to an identical one already stored
+
     Args:
         file: The uploaded file object
-        folder: The subfolder to save the image in (e.g., 'marketplace', 'lost-found')
-        
+        folder: The kind of upload (e.g., 'marketplace', 'lost_found'), recorded with the file
+        max_bytes: Largest accepted size
+
     Returns:
         str: The relative URL path to the saved image
     """
     if not file:
         return None
-        
+
     # Get file extension
     filename = secure_filename(file.filename)
     ext = filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
-    
+
     # Only allow image files
     if ext not in {'png', 'jpg', 'jpeg', 'gif'}:
         raise ValueError('Invalid file type. Only PNG, JPG, JPEG, and GIF are allowed.')
-    
-    # Create unique filename
-    unique_filename = f"{uuid.uuid4()}.{ext}"
-    
-    # Create folder if it doesn't exist
-    upload_folder = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'uploads', folder)
-    if not os.path.exists(upload_folder):
-        os.makedirs(upload_folder, exist_ok=True)
-    
-    # Save the file
-    file_path = os.path.join(upload_folder, unique_filename)
-    file.save(file_path)
-    
-    # Return relative URL path
-    return f"/uploads/{folder}/{unique_filename}" 
\ No newline at end of file
+
+    # Hash the upload where Werkzeug spooled it; nothing is written unless it is new
+    stream = file.stream
+    stream.seek(0)
+    digest = hashlib.sha256()
+    size = 0
+    for chunk in iter(lambda: stream.read(READ_CHUNK), b''):
+        if size == 0:
+            ext = image_extension(chunk[:16])
+            if ext is None:
+                raise ValueError('Invalid image data. Only PNG, JPG and GIF images are allowed.')
+        size += len(chunk)
+        if size > max_bytes:
+            raise _too_large(max_bytes)
+        digest.update(chunk)
+    if size == 0:
+        raise ValueError('Empty file')
+
+    def open_data():
+        stream.seek(0)
+        return stream
+
+    return _store(digest.hexdigest(), ext, size, folder, open_data, db)
+
+def image_extension(head):
+    """Extension of an image from its first bytes, or None if it is not an accepted format"""
+    for signature, ext in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return ext
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+def _base64_chunks(data, start):
+    """Decode `data[start:]` a chunk at a time, skipping whitespace"""
+    pending = ''
+    for offset in range(start, len(data), DECODE_CHUNK):
+        chunk = pending + data[offset:offset + DECODE_CHUNK]
+        if ' ' in chunk or '\n' in chunk or '\r' in chunk or '\t' in chunk:
+            chunk = ''.join(chunk.split())
+        usable = len(chunk) - len(chunk) % 4
+        pending = chunk[usable:]
+        if usable:
+            yield binascii.a2b_base64(chunk[:usable])
+    if pending:
+        raise ValueError('Invalid base64 image data')
+
+
+class _Base64Reader(io.RawIOBase):
+    """Readable file over the decoded bytes of `data[start:]`"""
+
+    def __init__(self, data, start):
+        self._chunks = _base64_chunks(data, start)
+        self._buffer = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, target):
+        while not self._buffer:
+            self._buffer = next(self._chunks, None)
+            if self._buffer is None:
+                self._buffer = b''
+                return 0
+        count = min(len(target), len(self._buffer))
+        target[:count] = self._buffer[:count]
+        self._buffer = self._buffer[count:]
+        return count
+
+def save_base64_image(data_url, folder, max_bytes=MAX_IMAGE_BYTES, db=None):
+    """
+    Save an image sent as a base64 data URL (or bare base64), or add a
+    reference to an identical one already stored
+
+    The data is decoded a chunk at a time: a first pass validates and hashes
+    it, and only a new image is decoded again, straight into storage. A
+    large photo is never held in memory twice. The format is taken from the
+    decoded magic bytes, not from the data URL header.
+
+    Args:
+        data_url: The "data:image/...;base64,..." string
+        folder: The kind of upload (e.g., 'messages', 'lost_found'), recorded with the file
+        max_bytes: Largest accepted decoded size
+
+    Returns:
+        str: The relative URL path to the saved image
+
+    Raises:
+        ValueError: If the data is not valid base64, not an accepted image format or too large
+    """
+    if not data_url or not isinstance(data_url, str):
+        raise ValueError('No image data provided')
+
+    comma = data_url.find(',', 0, MAX_HEADER)
+    start = comma + 1 if comma >= 0 else 0
+    # Four base64 characters per three bytes; reject oversized images before decoding anything
+    if (len(data_url) - start) // 4 * 3 > max_bytes + 2:
+        raise _too_large(max_bytes)
+
+    ext = None
+    size = 0
+    digest = hashlib.sha256()
+    try:
+        for data in _base64_chunks(data_url, start):
+            if ext is None:
+                ext = image_extension(data[:16])
+                if ext is None:
+                    raise ValueError('Invalid image data. Only PNG, JPG, GIF and WEBP images are allowed.')
+            size += len(data)
+            if size > max_bytes:
+                raise _too_large(max_bytes)
+            digest.update(data)
+    except binascii.Error:
+        raise ValueError('Invalid base64 image data')
+    if ext is None:
+        raise ValueError('No image data provided')
+
+    def open_data():
+        return io.BufferedReader(_Base64Reader(data_url, start), DECODE_CHUNK)
+
+    return _store(digest.hexdigest(), ext, size, folder, open_data, db)
+
+def presign_upload(content_type, size, sha256, folder, max_bytes=MAX_IMAGE_BYTES, db=None):
+    """
+    Let a client upload an image straight to storage
+
+    The client hashes the file and asks for an upload URL. Nothing needs to
+    be uploaded if the same content is already stored. Otherwise the upload
+    is recorded as pending, without references, so the collector removes it
+    if it is never claimed.
+
+    Returns:
+        dict: {'url': the image's URL, 'upload': {'method', 'url', 'headers'} or None if already stored}
+
+    Raises:
+        ValueError: If the image is not accepted
+        NotImplementedError: If the storage backend takes no direct uploads
+    """
+    ext = {content: ext for ext, content in CONTENT_TYPES.items()}.get(content_type)
+    if ext is None:
+        raise ValueError('Invalid file type. Only PNG, JPG, GIF and WEBP images are allowed.')
+    if folder not in UPLOAD_FOLDERS:
+        raise ValueError('Invalid upload folder')
+    if not isinstance(size, int) or size <= 0:
+        raise ValueError('Invalid file size')
+    if size > max_bytes:
+        raise _too_large(max_bytes)
+    if not isinstance(sha256, str) or not re.fullmatch(r'[0-9a-f]{64}', sha256):
+        raise ValueError('sha256 must be the hex SHA-256 of the file')
+
+    url = blob_url(sha256, ext)
+    key = upload_key(url)
+    storage = get_storage()
+    existing = uploads_collection(db).find_one({'_id': sha256}, {'pending': 1})
+    if existing is not None and not existing.get('pending') and storage.exists(key):
+        return {'url': url, 'upload': None}
+    upload = storage.presigned_upload(key, content_type, size, sha256, BLOB_CACHE_CONTROL)
+    if upload is None:
+        raise NotImplementedError('Direct uploads are not supported by this storage')
+    uploads_collection(db).update_one(
+        {'_id': sha256},
+        {'$setOnInsert': {'url': url, 'size': size, 'folder': folder, 'created_at': datetime.utcnow(),
+                          'refs': 0, 'released_at': datetime.utcnow(), 'pending': True}},
+        upsert=True
+    )
+    return {'url': url, 'upload': upload}
+
+def claim_upload(url, db=None):
+    """
+    Add a reference to a file the client uploaded directly
+
+    The first claim checks the stored bytes against the digest in the URL:
+    from the checksum the bucket verified, or by hashing the file where it
+    keeps none.
+
+    Returns:
+        str: The URL
+
+    Raises:
+        ValueError: If the URL is not a stored upload or its content does not match
+    """
+    digest = blob_digest(url)
+    collection = uploads_collection(db)
+    upload = collection.find_one({'_id': digest}, {'url': 1, 'pending': 1}) if digest else None
+    if upload is None:
+        raise ValueError('Unknown upload')
+    key = upload_key(upload['url'])
+    if upload.get('pending'):
+        storage = get_storage()
+        actual = storage.checksum(key)
+        if actual is None:
+            try:
+                with storage.local_file(key) as path:
+                    hasher = hashlib.sha256()
+                    with open(path, 'rb') as f:
+                        for chunk in iter(lambda: f.read(READ_CHUNK), b''):
+                            hasher.update(chunk)
+                    actual = hasher.hexdigest()
+            except FileNotFoundError:
+                raise ValueError('The image has not been uploaded')
+        if actual != digest:
+            storage.delete(key)
+            raise ValueError('Uploaded image does not match its digest')
+    collection.update_one(
+        {'_id': digest},
+        {'$inc': {'refs': 1}, '$unset': {'released_at': '', 'pending': ''}}
+    )
+    return upload['url']
+
+def is_image_data(value):
+    """Whether a JSON value carries an image to store: a data URL or a direct upload's URL"""
+    return isinstance(value, str) and (value.startswith('data:') or blob_digest(value) is not None)
+
+def save_image_data(value, folder, max_bytes=MAX_IMAGE_BYTES, db=None):
+    """
+    Store an image sent in a JSON body: a base64 data URL, or the URL of an
+    image the client uploaded directly (see presign_upload)
+
+    Returns:
+        str: The relative URL path to the image
+    """
+    if isinstance(value, str) and blob_digest(value):
+        return claim_upload(value, db)
+    return save_base64_image(value, folder, max_bytes, db)
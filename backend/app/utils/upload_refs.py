@@ -0,0 +1,102 @@
+"""
+Releasing uploaded files
+
+Content-addressed uploads (see app.utils.upload) can be shared by several
+documents, so dropping an image only releases one reference to it. The
+collector deletes a file, together with its resized variants, once its count
+has been zero for RELEASE_GRACE_SECONDS. The grace period covers documents
+that are deleted and recreated, and pages still showing the image.
+"""
+import os
+from datetime import datetime, timedelta
+
+from app.utils.image_variants import variant_keys
+from app.utils.storage import get_storage
+from app.utils.upload import blob_digest, upload_key, uploads_collection
+
+RELEASE_GRACE_SECONDS = int(os.environ.get('UPLOAD_RELEASE_GRACE_SECONDS', 3600))
+COLLECT_INTERVAL_SECONDS = int(os.environ.get('UPLOAD_COLLECT_INTERVAL_SECONDS', 3600))
+
+def _remove(keys):
+    storage = get_storage()
+    for key in keys:
+        if key:
+            storage.delete(key)
+
+def release_upload(url, db=None):
+    """
+    Drop one reference to an uploaded file
+
+    Files from before content addressing are not shared and are removed
+    right away, with their variants.
+
+    Returns:
+        int: The references left, or None for files that are not reference counted
+    """
+    if not url:
+        return None
+    digest = blob_digest(url)
+    if digest is None:
+        _remove([upload_key(url)] + variant_keys(url))
+        return None
+    upload = uploads_collection(db).find_one_and_update(
+        {'_id': digest, 'refs': {'$gt': 0}},
+        {'$inc': {'refs': -1}, '$set': {'released_at': datetime.utcnow()}},
+        projection={'refs': 1}
+    )
+    return upload['refs'] - 1 if upload else 0
+
+def release_uploads(urls, db=None):
+    for url in urls or []:
+        release_upload(url, db)
+
+def collect_uploads(db=None, grace_seconds=RELEASE_GRACE_SECONDS, log=print):
+    """
+    Delete the files whose reference count has been zero for the grace period
+
+    A file is moved aside before its document is deleted. If the document
+    is no longer deletable because an upload referenced the file again, it is
+    put back. The uploader also rewrites a missing file after taking its
+    reference, so a racing upload never ends up without a file.
+
+    Returns:
+        int: The number of files deleted
+    """
+    collection = uploads_collection(db)
+    storage = get_storage()
+    cutoff = datetime.utcnow() - timedelta(seconds=grace_seconds)
+    deleted = 0
+    for upload in collection.find({'refs': {'$lte': 0}, 'released_at': {'$lt': cutoff}}, {'url': 1}):
+        key = upload_key(upload['url'])
+        aside = f'{key}.deleted'
+        if not storage.move(key, aside):
+            aside = None
+        if collection.delete_one({'_id': upload['_id'], 'refs': {'$lte': 0}}).deleted_count:
+            _remove([aside] + variant_keys(upload['url']))
+            deleted += 1
+        elif aside and not storage.exists(key):
+            storage.move(aside, key)
+        elif aside:
+            storage.delete(aside)
+    if deleted:
+        log(f"Deleted {deleted} unreferenced uploads")
+    return deleted
+
+def start_upload_collector(app, socketio, interval=COLLECT_INTERVAL_SECONDS):
+    """
+    Run the collector every `interval` seconds in a Socket.IO background task
+    (a non-positive interval disables it)
+    """
+    if interval <= 0:
+        return None
+
+    def run():
+        while True:
+            socketio.sleep(interval)
+            try:
+                with app.app_context():
+                    collect_uploads(app.db, log=app.logger.info)
+            except Exception as e:
+                app.logger.error(f"Upload collection failed: {str(e)}")
+
+    return socketio.start_background_task(run)
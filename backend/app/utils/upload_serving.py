@@ -0,0 +1,132 @@
+"""
+Serving uploaded files
+
+`send_upload` answers `/uploads/...` requests with a strong ETag and
+Last-Modified, answering `304 Not Modified` to revalidations and
+`206 Partial Content` to range requests. Content-addressed uploads
+(`/uploads/blobs/...`) never change at a given URL, so they and their
+resized copies are sent as immutable and cached for a year. Other files are
+cached for DEFAULT_MAX_AGE and revalidated after that.
+
+Uploads kept in an object store (see app.utils.storage) are not sent by the
+app: `/uploads/<key>` redirects to the object, and the redirect is cached
+like the file would be (at most half the lifetime of a presigned URL).
+Resized copies are still rendered into the local cache and sent from it.
+
+With UPLOAD_OFFLOAD set, files on this host are not streamed by Python at all: the
+response only carries the headers and tells the front server which file to
+send.
+
+- `x-accel-redirect` (nginx): the header holds an internal location, under
+  UPLOAD_ACCEL_PREFIX for uploads and RESIZE_ACCEL_PREFIX for resized
+  copies, e.g.
+
+      location /_protected/uploads/ { internal; alias /srv/app/backend/uploads/; }
+      location /_protected/resize_cache/ { internal; alias /srv/app/backend/resize_cache/; }
+
+- `x-sendfile` (Apache mod_xsendfile, lighttpd): the header holds the file path.
+
+The front server then handles ranges itself; matching ETags are still
+answered with a 304 here.
+"""
+import hashlib
+import mimetypes
+import os
+
+from flask import current_app, jsonify, redirect, request, send_file
+
+from app.utils.image_resize import CACHE_DIR, resize_cache, resize_params
+from app.utils.storage import UPLOAD_ROOT, get_storage
+from app.utils.upload import blob_digest, upload_key
+
+# '', 'x-accel-redirect' or 'x-sendfile'
+UPLOAD_OFFLOAD = os.environ.get('UPLOAD_OFFLOAD', '').lower()
+UPLOAD_ACCEL_PREFIX = os.environ.get('UPLOAD_ACCEL_PREFIX', '/_protected/uploads/')
+RESIZE_ACCEL_PREFIX = os.environ.get('RESIZE_ACCEL_PREFIX', '/_protected/resize_cache/')
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+DEFAULT_MAX_AGE = 300
+
+def _accel_url(path):
+    for root, prefix in ((UPLOAD_ROOT, UPLOAD_ACCEL_PREFIX), (CACHE_DIR, RESIZE_ACCEL_PREFIX)):
+        if path.startswith(root + os.sep):
+            return prefix.rstrip('/') + '/' + os.path.relpath(path, root).replace(os.sep, '/')
+    raise ValueError(f'{path} is outside the served folders')
+
+def file_etag(path, stat):
+    """Strong ETag of a file from its path, size and modification time"""
+    identity = f'{os.path.relpath(path, UPLOAD_ROOT)}|{stat.st_size}|{stat.st_mtime_ns}'
+    return hashlib.sha256(identity.encode()).hexdigest()[:32]
+
+def send_upload(path, mimetype=None, etag=None, immutable=False):
+    """
+    Response sending the file at `path`
+
+    Args:
+        path: An uploaded file, or a rendering in the resize cache
+        mimetype: Content type, guessed from the extension if not given
+        etag: Strong ETag; derived from the file's identity if not given
+        immutable: Whether the content at this URL can never change
+    """
+    stat = os.stat(path)
+    etag = etag or file_etag(path, stat)
+    mimetype = mimetype or mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    max_age = IMMUTABLE_MAX_AGE if immutable else DEFAULT_MAX_AGE
+
+    if UPLOAD_OFFLOAD in ('x-accel-redirect', 'x-sendfile'):
+        response = current_app.response_class(mimetype=mimetype)
+        response.set_etag(etag)
+        response.last_modified = stat.st_mtime
+        if request.if_none_match.contains(etag):
+            response.status_code = 304
+        elif UPLOAD_OFFLOAD == 'x-accel-redirect':
+            response.headers['X-Accel-Redirect'] = _accel_url(path)
+        else:
+            response.headers['X-Sendfile'] = path
+        response.cache_control.public = True
+        response.cache_control.max_age = max_age
+    else:
+        response = send_file(
+            path, mimetype=mimetype, etag=etag, last_modified=stat.st_mtime,
+            max_age=max_age, conditional=True
+        )
+        response.accept_ranges = 'bytes'
+    if immutable:
+        response.cache_control.immutable = True
+    return response
+
+def serve_upload(filename):
+    """Response to `/uploads/<filename>`; `?w=&h=&fmt=` serves a resized copy"""
+    try:
+        params = resize_params(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    url = f'/uploads/{filename}'
+    key = upload_key(url)
+    if not key:
+        return jsonify({"error": "Resource not found"}), 404
+    # Content-addressed files never change at the same URL
+    digest = blob_digest(url)
+    storage = get_storage()
+
+    if params and resize_cache.enabled:
+        try:
+            path, etag, mimetype = resize_cache.get(key, *params)
+        except FileNotFoundError:
+            return jsonify({"error": "Resource not found"}), 404
+        except OSError:
+            return jsonify({"error": "File is not a resizable image"}), 400
+        return send_upload(path, mimetype, etag=etag, immutable=digest is not None)
+
+    download_url = storage.download_url(key)
+    if download_url is None:
+        path = storage.path(key)
+        if not path or not os.path.isfile(path):
+            return jsonify({"error": "Resource not found"}), 404
+        return send_upload(path, etag=digest, immutable=digest is not None)
+    response = redirect(download_url)
+    max_age = IMMUTABLE_MAX_AGE if digest else DEFAULT_MAX_AGE
+    if storage.download_url_expires:
+        max_age = min(max_age, storage.download_url_expires // 2)
+    response.cache_control.public = True
+    response.cache_control.max_age = max_age
+    return response
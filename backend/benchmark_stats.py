@@ -0,0 +1,17 @@
+"""
+Latency helpers shared by the benchmark scripts (socket_benchmark.py,
+booking_benchmark.py, geo_benchmark.py).
+"""
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of an unsorted list"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def format_ms(value):
+    return 'n/a' if value is None else f'{value * 1000:.1f}ms'
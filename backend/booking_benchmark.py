@@ -0,0 +1,171 @@
+"""
+Seat booking contention benchmark for the share ride booking path.
+
+Creates a handful of rides with few seats, then lets many threads book them
+at the same time, the way a popular ride fills up right after it is posted.
+Two strategies are compared against the same MongoDB:
+
+- legacy: read seats_available, insert the booking, write the new count back
+  (what ride.create_booking did before seats were reserved atomically)
+- atomic: one conditional find_one_and_update via app.utils.seats.reserve_seats,
+  then the booking insert
+
+Reports, per strategy:
+- bookings accepted and rejected, bookings per second, latency percentiles
+- oversold seats (seats booked beyond what the ride offered)
+- rides whose stored seats_available disagrees with their bookings
+
+The benchmark writes to its own collections (bench_share_rides, bench_bookings)
+and drops them before each strategy, so point it at a scratch database.
+
+Example:
+    python booking_benchmark.py --mongo-uri mongodb://localhost:27017/bracu_circle_bench --bookers 100
+"""
+import argparse
+import datetime
+import os
+import random
+import threading
+import time
+
+from bson import ObjectId
+from pymongo import MongoClient
+
+from app.utils.seats import reserve_seats
+from benchmark_stats import percentile, format_ms
+
+MONGO_URI = os.environ.get('BENCH_MONGO_URI', 'mongodb://localhost:27017/bracu_circle_bench')
+
+RIDES = 'bench_share_rides'
+BOOKINGS = 'bench_bookings'
+
+
+def book_legacy(db, ride_id, user_id, seats):
+    """Read-check-write booking, as the endpoint used to do it"""
+    ride = db[RIDES].find_one({'_id': ride_id})
+    if not ride or ride['status'] != 'active' or seats > ride['seats_available']:
+        return False
+    db[BOOKINGS].insert_one({
+        'user_id': user_id, 'ride_id': str(ride_id), 'seats': seats,
+        'status': 'active', 'created_at': datetime.datetime.utcnow()
+    })
+    new_seats_available = ride['seats_available'] - seats
+    db[RIDES].update_one(
+        {'_id': ride_id},
+        {'$set': {'seats_available': new_seats_available,
+                  'status': 'booked' if new_seats_available == 0 else 'active'}}
+    )
+    return True
+
+
+def book_atomic(db, ride_id, user_id, seats):
+    """Conditional reservation followed by the booking insert"""
+    ride = reserve_seats(db[RIDES], ride_id, seats, query={'status': 'active'}, full_status='booked')
+    if not ride:
+        return False
+    db[BOOKINGS].insert_one({
+        'user_id': user_id, 'ride_id': str(ride_id), 'seats': seats,
+        'status': 'active', 'created_at': datetime.datetime.utcnow()
+    })
+    return True
+
+
+STRATEGIES = {'legacy': book_legacy, 'atomic': book_atomic}
+
+
+def create_rides(db, count, seats):
+    db[RIDES].drop()
+    db[BOOKINGS].drop()
+    rides = [{
+        '_id': ObjectId(), 'user_id': ObjectId(), 'from_location': 'Mohakhali', 'to_location': 'Uttara',
+        'date': '2030-01-01', 'time': '08:00', 'seats_available': seats, 'status': 'active'
+    } for _ in range(count)]
+    db[RIDES].insert_many(rides)
+    return [ride['_id'] for ride in rides]
+
+
+def run_strategy(db, name, args):
+    """Run one strategy with all bookers released at once; returns a result dict"""
+    book = STRATEGIES[name]
+    ride_ids = create_rides(db, args.rides, args.seats)
+    barrier = threading.Barrier(args.bookers)
+    lock = threading.Lock()
+    latencies = []
+    outcome = {'accepted': 0, 'rejected': 0, 'errors': 0}
+
+    def booker(index):
+        rng = random.Random(args.seed + index)
+        user_id = ObjectId()
+        barrier.wait()
+        for _ in range(args.attempts):
+            ride_id = rng.choice(ride_ids)
+            seats = rng.randint(1, args.max_seats)
+            started = time.perf_counter()
+            try:
+                ok = book(db, ride_id, user_id, seats)
+                key = 'accepted' if ok else 'rejected'
+            except Exception:
+                key = 'errors'
+            elapsed = time.perf_counter() - started
+            with lock:
+                outcome[key] += 1
+                latencies.append(elapsed)
+
+    threads = [threading.Thread(target=booker, args=(i,)) for i in range(args.bookers)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    booked = {ride_id: 0 for ride_id in ride_ids}
+    for booking in db[BOOKINGS].find({}, {'ride_id': 1, 'seats': 1}):
+        booked[ObjectId(booking['ride_id'])] += booking['seats']
+    oversold = sum(max(0, seats - args.seats) for seats in booked.values())
+    inconsistent = 0
+    for ride in db[RIDES].find({}, {'seats_available': 1}):
+        if ride['seats_available'] != args.seats - booked[ride['_id']]:
+            inconsistent += 1
+
+    return dict(outcome, name=name, elapsed=elapsed, latencies=latencies,
+                oversold=oversold, inconsistent=inconsistent)
+
+
+def report(result, args):
+    attempts = result['accepted'] + result['rejected'] + result['errors']
+    latencies = result['latencies']
+    print(f"\n{result['name']}")
+    print(f"  attempts:            {attempts} in {result['elapsed']:.2f}s "
+          f"({attempts / result['elapsed']:.0f}/s)")
+    print(f"  accepted / rejected: {result['accepted']} / {result['rejected']} ({result['errors']} errors)")
+    print(f"  latency p50/p95/p99: {format_ms(percentile(latencies, 50))} / "
+          f"{format_ms(percentile(latencies, 95))} / {format_ms(percentile(latencies, 99))}")
+    print(f"  oversold seats:      {result['oversold']} (capacity {args.rides * args.seats})")
+    print(f"  inconsistent rides:  {result['inconsistent']} of {args.rides}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark concurrent seat bookings')
+    parser.add_argument('--mongo-uri', default=MONGO_URI)
+    parser.add_argument('--bookers', type=int, default=100, help='Concurrent booking threads')
+    parser.add_argument('--attempts', type=int, default=20, help='Booking attempts per thread')
+    parser.add_argument('--rides', type=int, default=10, help='Rides competed for')
+    parser.add_argument('--seats', type=int, default=4, help='Seats offered per ride')
+    parser.add_argument('--max-seats', type=int, default=2, help='Largest seat count per booking')
+    parser.add_argument('--strategy', choices=['both'] + list(STRATEGIES), default='both')
+    parser.add_argument('--seed', type=int, default=300)
+    args = parser.parse_args()
+
+    db = MongoClient(args.mongo_uri, maxPoolSize=args.bookers).get_database()
+    names = list(STRATEGIES) if args.strategy == 'both' else [args.strategy]
+    print(f'{args.bookers} bookers x {args.attempts} attempts on {args.rides} rides '
+          f'with {args.seats} seats each')
+    for name in names:
+        report(run_strategy(db, name, args), args)
+    db[RIDES].drop()
+    db[BOOKINGS].drop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+"""
+Geospatial ride matching benchmark for app.utils.geo.find_nearby_rides.
+
+Loads N synthetic rides (100k by default) whose pickup and drop-off points are
+clustered around popular places in Dhaka, then runs random "rides near me"
+searches two ways against the same mongod:
+
+- indexed: $geoNear over the 2dsphere index on from_point with a $geoWithin
+  filter on to_point, exactly what /api/ride/share/nearby runs
+- scan: the same $geoWithin filters on both points in a plain $match on a
+  copy of the collection without geo indexes, i.e. what the search costs
+  when every ride has to be inspected
+
+Reports query latency percentiles and rides returned per query, and
+checks that both strategies return the same rides.
+
+The benchmark uses its own collections (bench_geo_rides, bench_geo_rides_scan)
+and drops them when done, so point it at a scratch database.
+
+Example:
+    python geo_benchmark.py --mongo-uri mongodb://localhost:27017/bracu_circle_bench --rides 100000 --queries 500
+"""
+import argparse
+import datetime
+import os
+import random
+import time
+
+from pymongo import MongoClient
+
+from app.utils.geo import EARTH_RADIUS_M, find_nearby_rides, rank_rides, to_point
+from benchmark_stats import percentile, format_ms
+
+MONGO_URI = os.environ.get('BENCH_MONGO_URI', 'mongodb://localhost:27017/bracu_circle_bench')
+
+INDEXED = 'bench_geo_rides'
+SCAN = 'bench_geo_rides_scan'
+
+# (lat, lng) of places rides start and end at, BRAC University first
+HOTSPOTS = [
+    (23.7800, 90.4070), (23.8759, 90.3795), (23.7465, 90.3760), (23.7937, 90.4066),
+    (23.7561, 90.3872), (23.8103, 90.4125), (23.7104, 90.4074), (23.8223, 90.3654),
+    (23.7389, 90.3958), (23.7781, 90.3578), (23.8680, 90.4008), (23.7508, 90.4305),
+]
+SPREAD_DEGREES = 0.02   # roughly 2 km of jitter around a hotspot
+
+
+def random_coordinates(rng):
+    lat, lng = rng.choice(HOTSPOTS)
+    return {'lat': rng.gauss(lat, SPREAD_DEGREES), 'lng': rng.gauss(lng, SPREAD_DEGREES)}
+
+
+def make_ride(rng, start_date):
+    departure = start_date + datetime.timedelta(days=rng.randrange(14), minutes=rng.randrange(6 * 60, 22 * 60, 5))
+    return {
+        'from_location': 'bench', 'to_location': 'bench',
+        'from_point': to_point(random_coordinates(rng)),
+        'to_point': to_point(random_coordinates(rng)),
+        'date': departure.strftime('%Y-%m-%d'),
+        'time': departure.strftime('%H:%M'),
+        'seats_available': rng.randint(1, 4),
+        'status': 'active'
+    }
+
+
+def load_rides(db, count, batch_size, rng):
+    db[INDEXED].drop()
+    db[SCAN].drop()
+    start_date = datetime.datetime(2030, 1, 1)
+    for offset in range(0, count, batch_size):
+        batch = [make_ride(rng, start_date) for _ in range(min(batch_size, count - offset))]
+        db[INDEXED].insert_many(batch)
+        for ride in batch:
+            ride.pop('_id')
+        db[SCAN].insert_many(batch)
+
+
+def scan_search(collection, origin, destination, radius, query, departure, limit):
+    """The search without geo indexes: $geoWithin on both points in a plain $match"""
+    match = dict(query)
+    for field, point in (('from_point', origin), ('to_point', destination)):
+        lng, lat = point['coordinates']
+        match[field] = {'$geoWithin': {'$centerSphere': [[lng, lat], radius / EARTH_RADIUS_M]}}
+    return rank_rides(list(collection.find(match)), origin, destination, departure)[:limit]
+
+
+def ride_key(ride):
+    return (tuple(ride['from_point']['coordinates']), tuple(ride['to_point']['coordinates']), ride['date'], ride['time'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark geospatial ride matching')
+    parser.add_argument('--mongo-uri', default=MONGO_URI)
+    parser.add_argument('--rides', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--radius', type=float, default=1500, help='Search radius in metres')
+    parser.add_argument('--limit', type=int, default=20)
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--with-date', action='store_true', help='Restrict searches to one day and rank by time')
+    parser.add_argument('--keep', action='store_true', help='Keep the benchmark collections afterwards')
+    parser.add_argument('--seed', type=int, default=320)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    db = MongoClient(args.mongo_uri).get_database()
+
+    print(f'Loading {args.rides} rides ...')
+    started = time.perf_counter()
+    load_rides(db, args.rides, args.batch_size, rng)
+    print(f'  loaded in {time.perf_counter() - started:.1f}s')
+
+    searches = []
+    for _ in range(args.queries):
+        query = {'status': 'active'}
+        departure = None
+        if args.with_date:
+            day = datetime.datetime(2030, 1, 1) + datetime.timedelta(days=rng.randrange(14))
+            query['date'] = day.strftime('%Y-%m-%d')
+            departure = day + datetime.timedelta(minutes=rng.randrange(6 * 60, 22 * 60))
+        searches.append((to_point(random_coordinates(rng)), to_point(random_coordinates(rng)), query, departure))
+
+    results = {}
+    for name, collection, search in (
+        ('indexed', db[INDEXED], find_nearby_rides),
+        ('scan', db[SCAN], scan_search),
+    ):
+        # Warm up (and build the 2dsphere indexes for the indexed collection)
+        search(collection, searches[0][0], searches[0][1], args.radius, searches[0][2], searches[0][3], args.limit)
+        latencies, found, keys = [], 0, []
+        for origin, destination, query, departure in searches:
+            started = time.perf_counter()
+            rides = search(collection, origin, destination, args.radius, query, departure, args.limit)
+            latencies.append(time.perf_counter() - started)
+            found += len(rides)
+            keys.append([ride_key(ride) for ride in rides])
+        results[name] = keys
+        total = sum(latencies)
+        print(f'\n{name}')
+        print(f'  queries:             {len(latencies)} in {total:.2f}s ({len(latencies) / total:.0f}/s)')
+        print(f'  latency p50/p95/p99: {format_ms(percentile(latencies, 50))} / '
+              f'{format_ms(percentile(latencies, 95))} / {format_ms(percentile(latencies, 99))}')
+        print(f'  rides per query:     {found / len(latencies):.1f}')
+
+    mismatches = sum(1 for a, b in zip(results['indexed'], results['scan']) if sorted(a) != sorted(b))
+    # The indexed search ranks the limit * 10 candidates nearest to the pickup point,
+    # so it can only differ when a query matches more rides than that
+    print(f'\nqueries with different top results: {mismatches} of {len(searches)}')
+
+    if not args.keep:
+        db[INDEXED].drop()
+        db[SCAN].drop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""
+Script to run the online data migrations in app/migrations
+
+Every module in app/migrations exposes a MIGRATIONS list. Migrations are
+batched and checkpointed, so the script can be stopped and rerun at any time
+while the application is serving traffic.
+
+Examples:
+    python migrate.py --list
+    python migrate.py                                  # run everything that is not done yet
+    python migrate.py normalize_user_ids --pause 0.1   # one module, throttled
+    python migrate.py normalize_user_ids.bookings --reset
+"""
+import argparse
+import importlib
+import os
+import pkgutil
+
+from pymongo import MongoClient
+
+import app.migrations
+from app.utils.migrations import get_state, reset_state, run_migration
+
+MONGO_URI = os.environ.get('MONGO_URI', 'mongodb://localhost:27017/bracu_circle')
+
+def load_migrations():
+    """Collect the migrations of every module in app/migrations, in module name order"""
+    migrations = []
+    for module_info in sorted(pkgutil.iter_modules(app.migrations.__path__), key=lambda m: m.name):
+        module = importlib.import_module(f'app.migrations.{module_info.name}')
+        migrations.extend(getattr(module, 'MIGRATIONS', []))
+    return migrations
+
+def select(migrations, names):
+    """Keep migrations whose name equals or starts with one of the given names"""
+    if not names:
+        return migrations
+    return [m for m in migrations if any(m.name == n or m.name.startswith(n + '.') for n in names)]
+
+def main():
+    parser = argparse.ArgumentParser(description='Run batched, resumable data migrations')
+    parser.add_argument('names', nargs='*', help='Migration or module names (default: all)')
+    parser.add_argument('--mongo-uri', default=MONGO_URI)
+    parser.add_argument('--list', action='store_true', help='Show migrations and their progress')
+    parser.add_argument('--reset', action='store_true', help='Forget progress and start over')
+    parser.add_argument('--batch-size', type=int)
+    parser.add_argument('--max-batches', type=int, help='Stop after this many batches per migration')
+    parser.add_argument('--pause', type=float, default=0, help='Seconds to sleep between batches')
+    args = parser.parse_args()
+
+    db = MongoClient(args.mongo_uri).get_database()
+    migrations = select(load_migrations(), args.names)
+    if not migrations:
+        parser.error('No matching migrations')
+
+    if args.list:
+        for migration in migrations:
+            state = get_state(db, migration.name) or {}
+            print(f"{migration.name}: {state.get('status', 'pending')} "
+                  f"({state.get('processed', 0)} processed, {state.get('modified', 0)} modified)")
+        return
+
+    for migration in migrations:
+        if args.reset:
+            reset_state(db, migration.name)
+        run_migration(db, migration, batch_size=args.batch_size, max_batches=args.max_batches, pause=args.pause)
+
+if __name__ == '__main__':
+    main()
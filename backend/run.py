@@ -4,6 +4,8 @@ from flask_cors import CORS
 from app import create_app
 from app.socket_events import init_socket_events
 from app.extensions import socketio
+from app.utils.ride_expiry import start_sweeper
+from app.utils.upload_refs import start_upload_collector
 
 app = create_app()
 
@@ -16,6 +18,12 @@ socketio.init_app(app, cors_allowed_origins="*")
 # Initialize socket events
 init_socket_events(socketio)
 
+# Expire past rides and archive old ones in the background
+start_sweeper(app, socketio)
+
+# Delete uploads that are no longer referenced
+start_upload_collector(app, socketio)
+
 if __name__ == '__main__':
     # Check if we're in development or production
     is_dev = os.environ.get('FLASK_ENV') == 'development'
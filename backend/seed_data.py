@@ -0,0 +1,304 @@
+"""
+Script to fill the database with synthetic data for benchmarking and capacity planning.
+
+The documents match the shapes written by the application:
+- users:             auth.register
+- marketplace_items: marketplace.create_item (user_id stored as ObjectId)
+- share_rides:       ride.create_share_ride (user_id stored as the JWT identity string)
+- messages and conversations: Message.create_message
+
+Sizes are skewed the way real usage is: a few sellers own most of the items,
+a few conversations hold most of the messages and rides cluster on popular dates.
+
+Example:
+    python seed_data.py --users 100000 --items 1000000 --rides 500000 --messages 3000000 --workers 8
+"""
+import argparse
+import datetime
+import os
+import random
+import struct
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from bson import ObjectId
+from pymongo import MongoClient
+from werkzeug.security import generate_password_hash
+
+MONGO_URI = os.environ.get('MONGO_URI', 'mongodb://localhost:27017/bracu_circle')
+
+# Fixed timestamp prefix for generated ObjectIds, so every worker process can
+# derive the _id of user N without sharing state
+USER_ID_PREFIX = 0x66000000
+CONVERSATION_ID_PREFIX = 0x66100000
+
+DEPARTMENTS = ['CSE', 'EEE', 'BBA', 'ARCH', 'MNS', 'ENH', 'LAW', 'PHR', 'ECO']
+MARKETPLACE_CATEGORIES = ['Books', 'Electronics', 'Clothing', 'Furniture', 'Stationery', 'Sports', 'Other']
+ITEM_WORDS = ['used', 'new', 'calculator', 'textbook', 'laptop', 'phone', 'chair', 'desk', 'lamp',
+              'headphones', 'bag', 'guitar', 'cycle', 'jacket', 'notes', 'charger', 'monitor']
+LOCATIONS = ['BRAC University', 'Mohakhali', 'Gulshan 1', 'Gulshan 2', 'Banani', 'Uttara', 'Mirpur 10',
+             'Dhanmondi', 'Farmgate', 'Motijheel', 'Bashundhara', 'Badda', 'Rampura', 'Mohammadpur']
+VEHICLE_TYPES = ['car', 'bike', 'cng']
+PAYMENT_METHODS = ['in_person', 'bkash', 'nagad']
+MESSAGE_WORDS = ['hi', 'hello', 'is', 'this', 'still', 'available', 'yes', 'price', 'negotiable',
+                 'where', 'meet', 'campus', 'tomorrow', 'ok', 'thanks', 'ride', 'seat', 'time']
+
+
+def user_oid(index):
+    """Deterministic ObjectId for the user with the given index"""
+    return ObjectId(struct.pack('>IQ', USER_ID_PREFIX, index))
+
+
+def conversation_oid(index):
+    """Deterministic ObjectId for the conversation with the given index"""
+    return ObjectId(struct.pack('>IQ', CONVERSATION_ID_PREFIX, index))
+
+
+def skewed_index(rng, n, exponent=3.0):
+    """Pick an index in [0, n) with a heavy head; larger exponents concentrate more on low indexes"""
+    return min(int(n * rng.random() ** exponent), n - 1)
+
+
+def skewed_count(rng, mean, alpha=1.5, cap=None):
+    """Pick a positive count whose distribution has a long tail around the given mean"""
+    scale = mean * (alpha - 1) / alpha
+    count = max(1, int(rng.paretovariate(alpha) * scale))
+    return min(count, cap) if cap else count
+
+
+def random_words(rng, words, n):
+    return ' '.join(rng.choice(words) for _ in range(n))
+
+
+def make_user(index, rng, password_hash, now):
+    created = now - datetime.timedelta(days=rng.randint(0, 720))
+    return {
+        '_id': user_oid(index),
+        'email': f'student{index}@g.bracu.ac.bd',
+        'username': f'student{index}',
+        'password': password_hash,
+        'name': f'Student {index}',
+        'student_id': f'{20000000 + index % 80000000:08d}',
+        'department': rng.choice(DEPARTMENTS),
+        'semester': str(rng.randint(1, 12)),
+        'id_card_photo': f'/uploads/seed_id_card_{index % 50}.jpeg',
+        'verification_status': 'approved' if rng.random() < 0.9 else 'pending',
+        'created_at': created,
+        'updated_at': created
+    }
+
+
+def make_item(rng, num_users, now):
+    created = now - datetime.timedelta(minutes=rng.randint(0, 60 * 24 * 365))
+    return {
+        'title': random_words(rng, ITEM_WORDS, rng.randint(2, 5)).title(),
+        'description': random_words(rng, ITEM_WORDS, rng.randint(8, 30)),
+        'price': float(rng.randint(50, 50000)),
+        'category': rng.choice(MARKETPLACE_CATEGORIES),
+        'images': [f'/uploads/marketplace/seed_{rng.randint(0, 99)}.jpeg' for _ in range(rng.randint(1, 3))],
+        'user_id': user_oid(skewed_index(rng, num_users)),
+        'created_at': created,
+        'updated_at': created
+    }
+
+
+def make_ride(rng, num_users, today, now):
+    user_index = skewed_index(rng, num_users)
+    # Most rides are for the next few days, with a long tail further out and in the past
+    date = today + datetime.timedelta(days=skewed_index(rng, 90, exponent=2.0) - 7)
+    is_paid = rng.random() < 0.4
+    from_location, to_location = rng.sample(LOCATIONS, 2)
+    created = now - datetime.timedelta(minutes=rng.randint(0, 60 * 24 * 30))
+    return {
+        'user_id': str(user_oid(user_index)),
+        'user_name': f'Student {user_index}',
+        'user_email': f'student{user_index}@g.bracu.ac.bd',
+        'from_location': from_location,
+        'to_location': to_location,
+        'date': date.strftime('%Y-%m-%d'),
+        'time': f'{rng.randint(6, 22):02d}:{rng.choice([0, 15, 30, 45]):02d}',
+        'vehicle_type': rng.choice(VEHICLE_TYPES),
+        'phone_number': f'017{rng.randint(10000000, 99999999)}',
+        'seats_available': rng.randint(1, 4),
+        'is_paid': is_paid,
+        'fee_per_seat': rng.randint(30, 300) if is_paid else 0,
+        'payment_method': rng.choice(PAYMENT_METHODS) if is_paid else 'in_person',
+        'description': random_words(rng, MESSAGE_WORDS, rng.randint(0, 12)),
+        'status': 'active',
+        'updated_at': created,
+        'created_at': created
+    }
+
+
+def make_conversation(index, rng, num_users, now):
+    sender = skewed_index(rng, num_users)
+    receiver = rng.randrange(num_users)
+    if receiver == sender:
+        receiver = (receiver + 1) % num_users
+    return {
+        '_id': conversation_oid(index),
+        'participant1_id': user_oid(sender),
+        'participant2_id': user_oid(receiver),
+        'last_message': '',
+        'last_message_time': now,
+        'created_at': now - datetime.timedelta(days=rng.randint(0, 365))
+    }
+
+
+def make_message(rng, conversation, sent_at):
+    # Either participant may be the sender
+    if rng.random() < 0.5:
+        sender_id, receiver_id = conversation['participant1_id'], conversation['participant2_id']
+    else:
+        sender_id, receiver_id = conversation['participant2_id'], conversation['participant1_id']
+    has_item = rng.random() < 0.3
+    return {
+        'sender_id': sender_id,
+        'receiver_id': receiver_id,
+        'content': random_words(rng, MESSAGE_WORDS, rng.randint(1, 20)),
+        'item_id': ObjectId() if has_item else None,
+        'item_type': 'marketplace' if has_item else None,
+        'item_title': random_words(rng, ITEM_WORDS, 3).title() if has_item else None,
+        'image_url': None,
+        'read': rng.random() < 0.8,
+        'created_at': sent_at
+    }
+
+
+def write_users(args, start, stop, password_hash):
+    db = MongoClient(args.mongo_uri).get_database()
+    rng = random.Random(args.seed * 1000003 + start)
+    now = datetime.datetime.utcnow()
+    written = 0
+    for batch_start in range(start, stop, args.batch_size):
+        batch_stop = min(batch_start + args.batch_size, stop)
+        docs = [make_user(i, rng, password_hash, now) for i in range(batch_start, batch_stop)]
+        db.users.insert_many(docs, ordered=False)
+        written += len(docs)
+    return 'users', written
+
+
+def write_items(args, count, shard):
+    db = MongoClient(args.mongo_uri).get_database()
+    rng = random.Random(args.seed * 1000003 + shard + 1)
+    now = datetime.datetime.utcnow()
+    written = 0
+    while written < count:
+        n = min(args.batch_size, count - written)
+        db.marketplace_items.insert_many([make_item(rng, args.users, now) for _ in range(n)], ordered=False)
+        written += n
+    return 'marketplace_items', written
+
+
+def write_rides(args, count, shard):
+    db = MongoClient(args.mongo_uri).get_database()
+    rng = random.Random(args.seed * 1000003 + shard + 2)
+    now = datetime.datetime.utcnow()
+    today = now.date()
+    written = 0
+    while written < count:
+        n = min(args.batch_size, count - written)
+        db.share_rides.insert_many([make_ride(rng, args.users, today, now) for _ in range(n)], ordered=False)
+        written += n
+    return 'share_rides', written
+
+
+def write_messages(args, count, shard):
+    """Write roughly `count` messages spread over skewed conversations owned by this shard"""
+    db = MongoClient(args.mongo_uri).get_database()
+    rng = random.Random(args.seed * 1000003 + shard + 3)
+    now = datetime.datetime.utcnow()
+    written = 0
+    conversation_index = shard << 32
+    conversations = []
+    messages = []
+    while written < count:
+        conversation = make_conversation(conversation_index, rng, args.users, now)
+        conversation_index += 1
+        size = min(skewed_count(rng, args.messages_per_conversation, cap=5000), count - written)
+        sent_at = conversation['created_at']
+        for _ in range(size):
+            sent_at += datetime.timedelta(seconds=rng.randint(5, 6 * 3600))
+            messages.append(make_message(rng, conversation, sent_at))
+        conversation['last_message'] = messages[-1]['content']
+        conversation['last_message_time'] = sent_at
+        conversations.append(conversation)
+        written += size
+
+        if len(messages) >= args.batch_size:
+            db.messages.insert_many(messages, ordered=False)
+            db.conversations.insert_many(conversations, ordered=False)
+            messages, conversations = [], []
+    if messages:
+        db.messages.insert_many(messages, ordered=False)
+    if conversations:
+        db.conversations.insert_many(conversations, ordered=False)
+    return 'messages', written
+
+
+def split(total, parts):
+    """Split `total` into `parts` near-equal chunk sizes"""
+    base, extra = divmod(total, parts)
+    return [base + (1 if i < extra else 0) for i in range(parts)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Seed the database with synthetic BRACU Circle data')
+    parser.add_argument('--mongo-uri', default=MONGO_URI)
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--items', type=int, default=50000)
+    parser.add_argument('--rides', type=int, default=50000)
+    parser.add_argument('--messages', type=int, default=200000)
+    parser.add_argument('--messages-per-conversation', type=int, default=20,
+                        help='Mean conversation size; actual sizes are heavy-tailed')
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 4)
+    parser.add_argument('--seed', type=int, default=470)
+    parser.add_argument('--drop', action='store_true',
+                        help='Drop the seeded collections before writing')
+    args = parser.parse_args()
+
+    if args.users < 2:
+        parser.error('--users must be at least 2')
+
+    db = MongoClient(args.mongo_uri).get_database()
+    if args.drop:
+        for name in ['users', 'marketplace_items', 'share_rides', 'messages', 'conversations']:
+            db.drop_collection(name)
+            print(f'Dropped {name}')
+
+    # Hashing is deliberately slow, so every seeded user shares one hash
+    password_hash = generate_password_hash('Seed@1234')
+
+    started = time.time()
+    totals = {}
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = []
+        user_start = 0
+        for chunk in split(args.users, args.workers):
+            if chunk:
+                futures.append(executor.submit(write_users, args, user_start, user_start + chunk, password_hash))
+            user_start += chunk
+        for shard, chunk in enumerate(split(args.items, args.workers)):
+            if chunk:
+                futures.append(executor.submit(write_items, args, chunk, shard))
+        for shard, chunk in enumerate(split(args.rides, args.workers)):
+            if chunk:
+                futures.append(executor.submit(write_rides, args, chunk, shard))
+        for shard, chunk in enumerate(split(args.messages, args.workers)):
+            if chunk:
+                futures.append(executor.submit(write_messages, args, chunk, shard))
+
+        for future in as_completed(futures):
+            collection, written = future.result()
+            totals[collection] = totals.get(collection, 0) + written
+
+    elapsed = time.time() - started
+    documents = sum(totals.values())
+    for collection, written in sorted(totals.items()):
+        print(f'{collection}: {written} documents')
+    print(f'Wrote {documents} documents in {elapsed:.1f}s ({documents / max(elapsed, 1e-9):.0f} docs/s)')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,10 @@
 """
 Simple Flask server to handle ride share API requests
+
+Ride listings are served from an in-memory RideFeed snapshot that a
+background thread refreshes from updated_at deltas, so reads do not touch
+MongoDB. Ride edits and deletes go through RideRepository, the same store
+the main app uses, and are applied to the snapshot right away.
 """
 from flask import Flask, jsonify, request
 from flask_cors import CORS
@@ -7,6 +12,9 @@ from pymongo import MongoClient
 from bson import ObjectId
 import json
 
+from app.models.ride_repository import RideRepository, as_post, from_post
+from app.utils.ride_feed import RideFeed, PAGE_SIZE, MAX_PAGE_SIZE
+
 # Create Flask app
 app = Flask(__name__)
 
@@ -17,13 +25,15 @@ CORS(app,
          'methods': ['GET', 'POST', 'PUT', 'DELETE', 'OPTIONS'],
          'allow_headers': ['Content-Type', 'Authorization', 'X-Requested-With'],
          'supports_credentials': True,
-         'expose_headers': ['Content-Type', 'Authorization'],
+         'expose_headers': ['Content-Type', 'Authorization', 'X-Total-Count'],
          'max_age': 600  # Cache preflight requests for 10 minutes
      }})
 
 # Connect to MongoDB
 client = MongoClient('mongodb://localhost:27017/')
 db = client.bracu_circle
+rides = RideRepository(db)
+ride_feed = RideFeed(rides, serialize=as_post)
 
 # Custom JSON encoder to handle ObjectId
 class MongoJSONEncoder(json.JSONEncoder):
@@ -38,11 +48,23 @@ app.json_encoder = MongoJSONEncoder
 @app.route('/api/ride/posts', methods=['GET'])
 @app.route('/ride/posts', methods=['GET'])
 def get_ride_posts():
-    """Get all ride share posts"""
+    """
+    Get ride share posts by date and time, filtered by from, to, date and
+    status, one page at a time (page, per_page); the total is returned in
+    the X-Total-Count header
+    """
     try:
-        # Get all ride posts from the database
-        posts = list(db.ride_posts.find({}))
-        return jsonify(posts)
+        args = request.args
+        page = max(args.get('page', 1, type=int), 1)
+        per_page = max(1, min(args.get('per_page', PAGE_SIZE, type=int), MAX_PAGE_SIZE))
+        ride_feed.start()
+        total, posts = ride_feed.query(
+            args.get('from'), args.get('to'), args.get('date'), args.get('status'),
+            offset=(page - 1) * per_page, limit=per_page
+        )
+        response = jsonify(posts)
+        response.headers['X-Total-Count'] = str(total)
+        return response
     except Exception as e:
         print(f"Error in get_ride_posts: {str(e)}")
         return jsonify({"error": str(e)}), 500
@@ -55,14 +77,12 @@ def update_ride_post(post_id):
         # Get post data from request
         data = request.get_json()
         
-        # Update the post in the database
-        result = db.ride_posts.update_one(
-            {"_id": ObjectId(post_id)},
-            {"$set": data}
-        )
+        # Update the post in the main store, then in the feed
+        post = rides.update(post_id, from_post(data))
         
-        if result.modified_count == 0:
+        if not post:
             return jsonify({"error": "Post not found or no changes made"}), 404
+        ride_feed.put(post)
             
         return jsonify({"message": "Ride post updated successfully"}), 200
     except Exception as e:
@@ -74,11 +94,12 @@ def update_ride_post(post_id):
 def delete_ride_post(post_id):
     """Delete a ride share post"""
     try:
-        # Delete the post from the database
-        result = db.ride_posts.delete_one({"_id": ObjectId(post_id)})
+        # Delete the post from the main store, then from the feed
+        post = rides.delete(post_id)
         
-        if result.deleted_count == 0:
+        if not post:
             return jsonify({"error": "Post not found"}), 404
+        ride_feed.remove(post_id)
             
         return jsonify({"message": "Ride post deleted successfully"}), 200
     except Exception as e:
@@ -195,12 +216,13 @@ def get_statistics():
         pending_users = db.users.count_documents({'verification_status': 'pending'})
         
         # Count items by type
-        ride_share_posts = db.ride_posts.count_documents({})
+        ride_feed.start()
+        ride_share_posts = ride_feed.count()
         marketplace_items = db.marketplace_items.count_documents({})
         lost_found_items = db.lost_found_items.count_documents({})
         
         # Get recent items
-        recent_ride_share_posts = list(db.ride_posts.find({}).sort('_id', -1).limit(5))
+        recent_ride_share_posts = ride_feed.recent(5)
         recent_marketplace_items = list(db.marketplace_items.find({}).sort('_id', -1).limit(5))
         recent_lost_found_items = list(db.lost_found_items.find({}).sort('_id', -1).limit(5))
         
@@ -360,4 +382,5 @@ def handle_options(path):
     return response
 
 if __name__ == '__main__':
+    ride_feed.start()
     app.run(debug=True, host='0.0.0.0', port=5000)
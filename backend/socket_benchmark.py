@@ -0,0 +1,275 @@
+"""
+Socket.IO throughput benchmark for the messaging events in app/socket_events.py.
+
+Opens N simulated users, each registering its user room with `register_user`,
+then sends `send_message` events to random peers at a fixed rate. Receivers
+acknowledge a share of the messages with `mark_as_read`, which exercises the
+read receipt path back to the sender.
+
+Reports:
+- send acknowledgements and delivered messages per second
+- sender -> receiver room delivery latency percentiles
+- read receipt round trip latency percentiles
+- dropped events (sent messages that never reached the receiver)
+- server CPU usage, when --server-pid is given and psutil is installed
+
+The client needs the python-socketio client extras:
+    pip install "python-socketio[client]" psutil
+
+Example (server started with `python run.py`, database seeded with seed_data.py):
+    python socket_benchmark.py --url http://localhost:5000 --users 200 --rate 2 --duration 30 --server-pid 12345
+"""
+import argparse
+import random
+import threading
+import time
+
+try:
+    import socketio
+except ImportError:  # pragma: no cover - optional benchmark dependency
+    socketio = None
+
+try:
+    import psutil
+except ImportError:  # pragma: no cover - optional benchmark dependency
+    psutil = None
+
+from benchmark_stats import percentile, format_ms
+from seed_data import user_oid
+
+CONTENT_PREFIX = 'bench'
+
+
+class Stats:
+    """Counters shared by all simulated users"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sent = {}               # message key -> send timestamp
+        self.acked = 0
+        self.errors = 0
+        self.delivered = {}          # message key -> delivery latency
+        self.read_requested = {}     # message id -> mark_as_read timestamp
+        self.read_latencies = []
+
+    def record_sent(self, key, sent_at):
+        with self.lock:
+            self.sent[key] = sent_at
+
+    def record_ack(self, ok):
+        with self.lock:
+            if ok:
+                self.acked += 1
+            else:
+                self.errors += 1
+
+    def record_error(self):
+        with self.lock:
+            self.errors += 1
+
+    def record_delivery(self, key, latency):
+        with self.lock:
+            # Duplicates (e.g. from extra conversation rooms) only count once
+            self.delivered.setdefault(key, latency)
+
+    def record_read_request(self, message_id):
+        with self.lock:
+            self.read_requested[message_id] = time.time()
+
+    def record_read_receipt(self, message_id):
+        with self.lock:
+            requested_at = self.read_requested.pop(message_id, None)
+            if requested_at is not None:
+                self.read_latencies.append(time.time() - requested_at)
+
+
+class SimulatedUser:
+    """One connected client registered in its own user room"""
+
+    def __init__(self, index, args, stats, peers):
+        self.index = index
+        self.user_id = str(user_oid(index))
+        self.args = args
+        self.stats = stats
+        self.peers = peers
+        self.rng = random.Random(args.seed + index)
+        self.sequence = 0
+        self.client = socketio.Client(reconnection=False)
+        self.client.on('new_message', self.on_new_message)
+        self.client.on('message_read', self.on_message_read)
+        self.client.on('error', self.on_error)
+
+    def connect(self):
+        self.client.connect(self.args.url, transports=[self.args.transport], wait_timeout=10)
+        self.client.emit('register_user', {'user_id': self.user_id})
+
+    def disconnect(self):
+        try:
+            self.client.disconnect()
+        except Exception:
+            pass
+
+    def send_one(self):
+        receiver = self.rng.choice(self.peers)
+        if receiver == self.user_id:
+            return
+        self.sequence += 1
+        key = f'{self.user_id}:{self.sequence}'
+        sent_at = time.time()
+        self.stats.record_sent(key, sent_at)
+        self.client.emit('send_message', {
+            'sender_id': self.user_id,
+            'receiver_id': receiver,
+            'content': f'{CONTENT_PREFIX}|{key}|{sent_at:.6f}',
+        }, callback=self.on_ack)
+
+    def on_ack(self, response=None):
+        self.stats.record_ack(isinstance(response, dict) and response.get('status') == 'success')
+
+    def on_new_message(self, message):
+        # The sender room gets an echo of every message too; only receivers measure delivery
+        if message.get('receiver_id') != self.user_id:
+            return
+        parts = (message.get('content') or '').split('|')
+        if len(parts) != 3 or parts[0] != CONTENT_PREFIX:
+            return
+        self.stats.record_delivery(parts[1], time.time() - float(parts[2]))
+
+        if message.get('_id') and self.rng.random() < self.args.read_ratio:
+            self.stats.record_read_request(message['_id'])
+            self.client.emit('mark_as_read', {'message_id': message['_id'], 'user_id': self.user_id})
+
+    def on_message_read(self, data):
+        self.stats.record_read_receipt(data.get('message_id'))
+
+    def on_error(self, data=None):
+        self.stats.record_error()
+
+    def run(self, stop_at):
+        interval = 1.0 / self.args.rate
+        # Spread users over the first interval so sends are not synchronised
+        next_send = time.time() + self.rng.random() * interval
+        while True:
+            now = time.time()
+            if now >= stop_at:
+                break
+            if now < next_send:
+                time.sleep(min(next_send - now, stop_at - now))
+                continue
+            try:
+                self.send_one()
+            except Exception:
+                self.stats.record_error()
+            next_send += interval
+
+
+def sample_cpu(pid, samples, stop_event):
+    """Collect server CPU percentages once a second until stopped"""
+    process = psutil.Process(pid)
+    children = process.children(recursive=True)
+    process.cpu_percent(None)
+    for child in children:
+        child.cpu_percent(None)
+    while not stop_event.wait(1.0):
+        total = process.cpu_percent(None)
+        for child in children:
+            try:
+                total += child.cpu_percent(None)
+            except psutil.NoSuchProcess:
+                pass
+        samples.append(total)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark Socket.IO message delivery')
+    parser.add_argument('--url', default='http://localhost:5000')
+    parser.add_argument('--users', type=int, default=50, help='Number of simulated users')
+    parser.add_argument('--user-offset', type=int, default=0,
+                        help='Index of the first seeded user to impersonate (see seed_data.py)')
+    parser.add_argument('--rate', type=float, default=1.0, help='Messages per second per user')
+    parser.add_argument('--duration', type=float, default=20.0, help='Seconds to send for')
+    parser.add_argument('--drain', type=float, default=5.0,
+                        help='Seconds to wait for in-flight deliveries after sending stops')
+    parser.add_argument('--read-ratio', type=float, default=0.5,
+                        help='Share of delivered messages the receiver marks as read')
+    parser.add_argument('--transport', choices=['websocket', 'polling'], default='websocket')
+    parser.add_argument('--server-pid', type=int, help='PID of the server process to sample CPU from')
+    parser.add_argument('--seed', type=int, default=470)
+    args = parser.parse_args()
+
+    if socketio is None:
+        parser.error('python-socketio client is not installed: pip install "python-socketio[client]"')
+    if args.users < 2:
+        parser.error('--users must be at least 2')
+    if args.server_pid and psutil is None:
+        print('psutil is not installed; server CPU will not be reported')
+
+    stats = Stats()
+    peers = [str(user_oid(args.user_offset + i)) for i in range(args.users)]
+    users = [SimulatedUser(args.user_offset + i, args, stats, peers) for i in range(args.users)]
+
+    print(f'Connecting {len(users)} users to {args.url} ...')
+    connected = []
+    for user in users:
+        try:
+            user.connect()
+            connected.append(user)
+        except Exception as e:
+            print(f'User {user.user_id} failed to connect: {e}')
+    if len(connected) < 2:
+        print('Not enough users connected; aborting')
+        return
+    # Give the server time to process the room registrations
+    time.sleep(1.0)
+
+    cpu_samples = []
+    cpu_stop = threading.Event()
+    cpu_thread = None
+    if args.server_pid and psutil is not None:
+        cpu_thread = threading.Thread(target=sample_cpu, args=(args.server_pid, cpu_samples, cpu_stop), daemon=True)
+        cpu_thread.start()
+
+    started = time.time()
+    stop_at = started + args.duration
+    threads = [threading.Thread(target=user.run, args=(stop_at,), daemon=True) for user in connected]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    send_elapsed = time.time() - started
+
+    time.sleep(args.drain)
+    cpu_stop.set()
+    if cpu_thread:
+        cpu_thread.join()
+    for user in connected:
+        user.disconnect()
+
+    with stats.lock:
+        sent = len(stats.sent)
+        delivered = len(stats.delivered)
+        latencies = list(stats.delivered.values())
+        read_latencies = list(stats.read_latencies)
+        pending_reads = len(stats.read_requested)
+        acked, errors = stats.acked, stats.errors
+
+    print()
+    print(f'Users connected:        {len(connected)}/{len(users)}')
+    print(f'Messages sent:          {sent} ({sent / send_elapsed:.1f}/s)')
+    print(f'Send acknowledgements:  {acked} ({acked / send_elapsed:.1f}/s)')
+    print(f'Messages delivered:     {delivered} ({delivered / send_elapsed:.1f}/s)')
+    print(f'Dropped deliveries:     {sent - delivered} ({(sent - delivered) / max(sent, 1) * 100:.2f}%)')
+    print(f'Error events:           {errors}')
+    print('Delivery latency:       ' + ', '.join(
+        f'p{p}={format_ms(percentile(latencies, p))}' for p in (50, 90, 95, 99)) +
+        f', max={format_ms(max(latencies) if latencies else None)}')
+    print(f'Read receipts:          {len(read_latencies)} received, {pending_reads} missing')
+    print('Read receipt latency:   ' + ', '.join(
+        f'p{p}={format_ms(percentile(read_latencies, p))}' for p in (50, 90, 99)))
+    if cpu_samples:
+        print(f'Server CPU:             avg={sum(cpu_samples) / len(cpu_samples):.1f}% '
+              f'max={max(cpu_samples):.1f}% over {len(cpu_samples)} samples')
+
+
+if __name__ == '__main__':
+    main()
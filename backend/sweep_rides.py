@@ -0,0 +1,35 @@
+"""
+Script to expire past rides and archive old ones
+
+The API server already runs this sweep in the background every
+RIDE_SWEEP_INTERVAL_SECONDS (set it to 0 to disable that and run this script
+from cron instead). Safe to run at any time; interrupted runs resume cleanly.
+
+Examples:
+    python sweep_rides.py
+    python sweep_rides.py --no-archive
+"""
+import argparse
+import os
+
+from pymongo import MongoClient
+
+from app.utils.ride_expiry import BATCH_SIZE, ensure_sweep_indexes, sweep
+
+MONGO_URI = os.environ.get('MONGO_URI', 'mongodb://localhost:27017/bracu_circle')
+
+def main():
+    parser = argparse.ArgumentParser(description='Expire past rides and archive old ones')
+    parser.add_argument('--mongo-uri', default=MONGO_URI)
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--no-archive', action='store_true', help='Only expire rides, do not archive them')
+    args = parser.parse_args()
+
+    db = MongoClient(args.mongo_uri).get_database()
+    ensure_sweep_indexes(db)
+    results = sweep(db, batch_size=args.batch_size, archive=not args.no_archive)
+    for collection, counts in results.items():
+        print(f'{collection}: {counts}')
+
+if __name__ == '__main__':
+    main()